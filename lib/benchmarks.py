@@ -0,0 +1,584 @@
+import argparse
+import gc
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.orm import sessionmaker
+from db.session import SessionLocal, read_only, unit_of_work, SQLALCHEMY_DATABASE_URL, engine_options
+from db import metrics
+from db.models import Flower, Customer, Order, OrderItem, FlowerPrice
+from db.lookups import get_flower, get_customer, get_order
+from db.orders import place_order, change_order_status
+from db.ledger import record_movement, RESTOCK
+from db.reservations import InsufficientStock
+from db.prices import price_at, set_price
+from db.reports import _top_flowers
+from db.recommendations import Recommender
+from db import dedupe
+
+
+def per_call(fn, calls):
+    """Average seconds per call of fn(i) over `calls` calls"""
+    fn(0)  # warm up caches
+    started = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - started) / calls
+
+
+def bench_lookups(calls):
+    """Per-call cost of the hot primary key lookups, before and after lookups.py.
+
+    The identity map is cleared before every call so both versions go to the
+    database and only statement construction and compilation differ.
+    """
+    db = SessionLocal()
+    flower_ids = [f for f, in db.query(Flower.id).all()] or [1]
+    customer_ids = [c for c, in db.query(Customer.id).all()] or [1]
+    order_ids = [o for o, in db.query(Order.id).all()] or [1]
+
+    def pick(ids, i):
+        db.expunge_all()
+        return ids[i % len(ids)]
+
+    cases = [
+        ("flower", lambda i: db.query(Flower).get(pick(flower_ids, i)),
+                   lambda i: get_flower(db, pick(flower_ids, i))),
+        ("customer", lambda i: db.query(Customer).get(pick(customer_ids, i)),
+                     lambda i: get_customer(db, pick(customer_ids, i))),
+        ("order", lambda i: db.query(Order).filter(Order.id == pick(order_ids, i)).all(),
+                  lambda i: get_order(db, pick(order_ids, i))),
+    ]
+    print(f"{'Lookup':<10} {'before us':>10} {'after us':>10} {'speedup':>8}")
+    for name, before, after in cases:
+        old = per_call(before, calls)
+        new = per_call(after, calls)
+        print(f"{name:<10} {old * 1e6:>10.1f} {new * 1e6:>10.1f} {old / new:>7.2f}x")
+    db.close()
+
+
+SLOW_REPORT = text("""
+    WITH RECURSIVE counter(x) AS (
+        SELECT 1 UNION ALL SELECT x + 1 FROM counter WHERE x < :rows
+    )
+    SELECT (SELECT COUNT(*) FROM orders) + COUNT(*) FROM counter
+""")
+
+CHECKOUT_BUDGET = 0.5      # seconds a checkout may take while a report runs
+
+
+def bench_read_split(calls):
+    """Commit a checkout while a multi-second report runs on the read engine.
+
+    Fails unless the checkout commits within CHECKOUT_BUDGET while the
+    report is still running. Run against a copy of the database: it places
+    one real order.
+    """
+    report = {}
+
+    def run_report():
+        started = time.perf_counter()
+        with read_only() as reader:
+            reader.execute(SLOW_REPORT, {"rows": calls * 2000}).scalar()
+        report["seconds"] = time.perf_counter() - started
+
+    thread = threading.Thread(target=run_report)
+    thread.start()
+    time.sleep(0.5)
+
+    db = SessionLocal()
+    flower = db.query(Flower).filter(Flower.quantity - Flower.reserved > 0).first()
+    customer = db.query(Customer).first()
+    started = time.perf_counter()
+    order_id, _ = place_order(db, customer.id, [(flower.id, 1)])
+    commit_seconds = time.perf_counter() - started
+    report_running = thread.is_alive()
+    db.close()
+    thread.join()
+
+    print(f"Report query: {report['seconds']:.2f}s on the read engine")
+    print(f"Checkout of order #{order_id}: {commit_seconds * 1000:.1f}ms")
+    if not report_running:
+        print("Report finished before the checkout committed; raise --calls for a longer report")
+        raise SystemExit(1)
+    if commit_seconds > CHECKOUT_BUDGET:
+        print(f"Checkout took longer than {CHECKOUT_BUDGET * 1000:.0f}ms while the report ran")
+        raise SystemExit(1)
+    print("Checkout committed while the report was still running")
+
+
+def bench_metrics(calls, rounds=5):
+    """Cost of the metrics instrumentation, alone and on the hot paths.
+
+    The uninstrumented side uses a second engine without the statement
+    counter and the undecorated place_order. Both sides run in alternating
+    rounds and the best round counts, which keeps machine noise out of the
+    comparison. Run against a copy of the database: it places real orders.
+    """
+    counter = metrics.Counter("bench_total", "benchmark").labels()
+    histogram = metrics.Histogram("bench_seconds", "benchmark").labels()
+    noop = lambda i: None
+    timed_noop = metrics.timed(metrics.Histogram("bench_timed", "benchmark"))(noop)
+    base = per_call(noop, calls)
+    print(f"{'Primitive':<20} {'ns/call':>8}")
+    print(f"{'counter inc':<20} {(per_call(lambda i: counter.inc(), calls) - base) * 1e9:>8.0f}")
+    print(f"{'histogram observe':<20} {(per_call(lambda i: histogram.observe(0.003), calls) - base) * 1e9:>8.0f}")
+    print(f"{'timed() wrapper':<20} {(per_call(timed_noop, calls) - base) * 1e9:>8.0f}")
+    print(f"{'render registry':<20} {per_call(lambda i: metrics.registry.render(), 100) * 1e9:>8.0f}")
+
+    plain_engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
+    plain, instrumented = sessionmaker(bind=plain_engine)(), SessionLocal()
+    flower_ids = [f for f, in instrumented.query(Flower.id).all()] or [1]
+    customer_id = instrumented.query(Customer.id).limit(1).scalar()
+    for flower in instrumented.query(Flower):
+        record_movement(instrumented, flower, calls, RESTOCK, note="metrics benchmark")
+    instrumented.commit()
+
+    def lookup(db):
+        def run(i):
+            db.expunge_all()
+            return get_flower(db, flower_ids[i % len(flower_ids)])
+        return run
+
+    def order(db, place):
+        return lambda i: place(db, customer_id, [(flower_ids[i % len(flower_ids)], 1)])
+
+    cases = [
+        ("flower lookup", calls // rounds, lookup(plain), lookup(instrumented)),
+        ("place order", max(1, calls // (rounds * 20)),
+            order(plain, place_order.__wrapped__), order(instrumented, place_order)),
+    ]
+    print(f"\n{'Hot path':<20} {'plain us':>10} {'metrics us':>10} {'overhead':>9}")
+    for name, n, before, after in cases:
+        old = new = float("inf")
+        for _ in range(rounds):
+            old = min(old, per_call(before, n))
+            new = min(new, per_call(after, n))
+        print(f"{name:<20} {old * 1e6:>10.1f} {new * 1e6:>10.1f} {(new / old - 1) * 100:>8.1f}%")
+    plain.close()
+    instrumented.close()
+
+
+def bench_prices(calls, changes=200):
+    """Point-in-time price lookups and revenue at historical prices.
+
+    Gives every flower `changes` price changes spread over the last year
+    first, so run it against a copy of the database.
+    """
+    db = SessionLocal()
+    flowers = db.query(Flower).order_by(Flower.id).all()
+    now = datetime.now()
+    for step in range(changes, 0, -1):
+        for flower in flowers:
+            set_price(db, flower, round(flower.price * 1.01, 2), when=now - timedelta(days=365 * step / changes))
+    db.commit()
+    flower_ids = [flower.id for flower in flowers]
+
+    seek = per_call(lambda i: price_at(db, flower_ids[i % len(flower_ids)], now - timedelta(days=i % 365)), calls)
+    print(f"{len(flower_ids) * changes} price changes recorded")
+    print(f"price_at: {seek * 1e6:.1f}us per lookup")
+    if db.get_bind().dialect.name == "sqlite":
+        plan = db.execute(text("EXPLAIN QUERY PLAN " + str(
+            select(FlowerPrice.price).where(FlowerPrice.flower_id == 1, FlowerPrice.effective_from <= now)
+            .order_by(FlowerPrice.effective_from.desc(), FlowerPrice.id.desc()).limit(1)
+            .compile(compile_kwargs={"literal_binds": True})
+        ))).all()
+        print("plan: " + "; ".join(row[-1] for row in plan))
+
+    items = db.query(func.count(OrderItem.id)).scalar()
+    revenue = per_call(lambda i: _top_flowers(db, 10), max(1, calls // 500))
+    print(f"top flowers revenue over {items} items: {revenue * 1000:.1f}ms")
+    db.close()
+
+
+def add_orders(db, orders, rng):
+    """Bulk insert `orders` completed orders of 1-5 flowers for the first customer"""
+    flower_ids = [f for f, in db.query(Flower.id)]
+    customer_id = db.query(Customer.id).limit(1).scalar()
+    first = (db.query(func.max(Order.id)).scalar() or 0) + 1
+    db.execute(Order.__table__.insert(), [
+        {"id": first + i, "customer_id": customer_id, "status": "completed"} for i in range(orders)
+    ])
+    db.execute(OrderItem.__table__.insert(), [
+        {"order_id": first + i, "flower_id": flower_id, "quantity": 1}
+        for i in range(orders) for flower_id in rng.sample(flower_ids, rng.randint(1, 5))
+    ])
+    db.commit()
+
+
+def bench_recommendations(calls, orders=20000):
+    """Co-occurrence build, incremental refresh and per-basket suggestion cost.
+
+    Adds `orders` synthetic completed orders of 1-5 flowers first, so run
+    it against a copy of the database. The incrementally refreshed matrix
+    is checked against a fresh build.
+    """
+    import random
+    rng = random.Random(0)
+    db = SessionLocal()
+    flower_ids = [f for f, in db.query(Flower.id)]
+    customer_id = db.query(Customer.id).limit(1).scalar()
+    add_orders(db, orders, rng)
+    items = db.query(func.count(OrderItem.id)).scalar()
+
+    recommender = Recommender()
+    started = time.perf_counter()
+    pairs = recommender.build(db)
+    print(f"build: {(time.perf_counter() - started) * 1000:.0f}ms for {items} items ({pairs} flower pairs)")
+
+    for flower in db.query(Flower):
+        record_movement(db, flower, 1000, RESTOCK, note="recommendation benchmark")
+    db.commit()
+    placed = [
+        place_order(db, customer_id, [(flower_id, 1) for flower_id in rng.sample(flower_ids, 3)])[0]
+        for _ in range(50)
+    ]
+    for order_id in placed[:10]:
+        change_order_status(db, order_id, 'cancelled')
+    started = time.perf_counter()
+    applied = recommender.refresh(db)
+    print(f"refresh: {(time.perf_counter() - started) * 1000:.1f}ms for {applied} newly completed orders")
+    fresh = Recommender()
+    fresh.build(db)
+    print("incremental matrix matches a rebuild" if fresh.pairs == {
+        a: {b: n for b, n in others.items() if n} for a, others in recommender.pairs.items() if any(others.values())
+    } else "incremental matrix DIFFERS from a rebuild")
+
+    baskets = [rng.sample(flower_ids, rng.randint(1, 4)) for _ in range(100)]
+    per_basket = per_call(lambda i: recommender.suggest(baskets[i % len(baskets)]), calls)
+    print(f"suggest: {per_basket * 1e6:.1f}us per basket")
+    db.close()
+
+
+def bench_dedupe(calls, customers=20000, share=0.05):
+    """Duplicate detection over synthetic customers, in memory.
+
+    One in twenty customers gets a re-entered copy with a typo, a title,
+    a reformatted phone or a tagged email. Reports the pairs scored
+    against all n² pairs and how many planted duplicates were found.
+    """
+    import random
+    from faker import Faker
+    fake = Faker()
+    Faker.seed(0)
+    rng = random.Random(0)
+    raw = [(i, fake.name(), fake.numerify("###-###-####"), fake.email()) for i in range(customers)]
+
+    def variant(name, phone, email):
+        change = rng.randrange(4)
+        if change == 0:
+            i = rng.randrange(len(name))
+            name = name[:i] + name[i + 1:]
+        elif change == 1:
+            name = "Mr. " + name.upper()
+        elif change == 2:
+            phone = "+1 (" + phone[:3] + ") " + phone[4:].replace("-", " ")
+        else:
+            local, domain = email.split("@")
+            email = f"{local.capitalize()}+flowers@{domain}"
+        return name, phone, email
+
+    planted = set()
+    for i in rng.sample(range(customers), int(customers * share)):
+        planted.add((i, len(raw)))
+        raw.append((len(raw),) + variant(*raw[i][1:]))
+    records = [dedupe._record(i, name, phone, email, 0) for i, name, phone, email in raw]
+
+    started = time.perf_counter()
+    pairs = sum(1 for _ in dedupe.candidate_pairs(records))
+    blocking = time.perf_counter() - started
+    started = time.perf_counter()
+    found = dedupe.match(records)
+    matching = time.perf_counter() - started
+
+    pairs_found = {(min(c.keep.id, c.drop.id), max(c.keep.id, c.drop.id)) for c in found}
+    recall = len(planted & pairs_found) / len(planted)
+    print(f"{len(records)} customers: {pairs} pairs scored of {len(records) * (len(records) - 1) // 2}")
+    print(f"blocking: {blocking * 1000:.0f}ms, blocking and scoring: {matching * 1000:.0f}ms")
+    print(f"found {recall:.1%} of {len(planted)} planted duplicates, {len(pairs_found - planted)} other candidates")
+
+
+def bench_export(calls, orders=100000):
+    """Compact export and load against sqlite3 .dump/executescript and re-seeding.
+
+    Adds `orders` synthetic completed orders first, so run it against a
+    copy of the database. Each step is timed, then run again under
+    tracemalloc to show that export and load stream instead of holding
+    whole tables.
+    """
+    import gzip
+    import os
+    import random
+    import sqlite3
+    import subprocess
+    import sys
+    import tempfile
+    from db.export import export_database, load_export
+
+    db = SessionLocal()
+    if db.get_bind().dialect.name != "sqlite":
+        print("the export benchmark compares against sqlite3 .dump; point it at a SQLite copy")
+        return
+    add_orders(db, orders, random.Random(0))
+    source = db.get_bind().url.database
+    items = db.query(func.count(OrderItem.id)).scalar()
+    db.close()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        def path(name, run):
+            return os.path.join(scratch, f"{run}-{name}")
+
+        def sqlite_engine(filename):
+            return create_engine(f"sqlite:///{filename}", **engine_options(f"sqlite:///{filename}"))
+
+        def export(run):
+            export_database(path("shop.export", run), sqlite_engine(source))
+
+        def load(run):
+            load_export(path("shop.export", run), sqlite_engine(path("loaded.db", run)))
+
+        def dump(run):
+            with gzip.open(path("shop.sql.gz", run), "wt") as f, sqlite3.connect(source) as conn:
+                for line in conn.iterdump():
+                    f.write(line + "\n")
+
+        def undump(run):
+            conn = sqlite3.connect(path("undumped.db", run))
+            with gzip.open(path("shop.sql.gz", run), "rt") as f:
+                conn.executescript(f.read())
+            conn.close()
+
+        def reseed(run):
+            env = dict(os.environ, MYSHOP_DATABASE_URL=f"sqlite:///{path('seeded.db', run)}")
+            subprocess.run([sys.executable, os.path.join(os.path.dirname(__file__), "cli.py"), "--init"],
+                           env=env, cwd=scratch, stdout=subprocess.DEVNULL, check=True)
+
+        steps = [
+            ("export", export, "shop.export"),
+            ("load export", load, None),
+            (".dump (gzipped)", dump, "shop.sql.gz"),
+            ("executescript dump", undump, None),
+            ("re-seed (100 orders)", reseed, None),
+        ]
+        print(f"{orders} orders added, {items} order items, database file {os.path.getsize(source) / 1e6:.1f} MB")
+        print(f"{'Step':<22} {'seconds':>8} {'MB':>7} {'peak MB':>8}")
+        for name, step, output in steps:
+            started = time.perf_counter()
+            step("timed")
+            seconds = time.perf_counter() - started
+            size = f"{os.path.getsize(path(output, 'timed')) / 1e6:>7.2f}" if output else f"{'':>7}"
+            peak = ""
+            if step is not reseed:      # its memory is another process's
+                tracemalloc.start()
+                step("traced")
+                peak = f"{tracemalloc.get_traced_memory()[1] / 1e6:>8.1f}"
+                tracemalloc.stop()
+            print(f"{name:<22} {seconds:>8.2f} {size} {peak}")
+
+
+def bench_rebuild(calls, orders=100000):
+    """rebuild_table on orders, the table the order total triggers update.
+
+    Adds `orders` synthetic completed orders first, so run it against a
+    copy of the database; the rebuild itself runs on a scratch copy of that.
+    Afterwards the rows, totals and triggers must be as before, and adding
+    an item must still update its order's total.
+    """
+    import os
+    import random
+    import sqlite3
+    import tempfile
+    from alembic.migration import MigrationContext
+    from alembic.operations import Operations
+    from sqlalchemy import MetaData
+    from db.models import Base
+    from db.backfill import rebuild_table
+
+    db = SessionLocal()
+    if db.get_bind().dialect.name != "sqlite":
+        print("the rebuild benchmark copies a SQLite file; point it at a SQLite copy")
+        return
+    add_orders(db, orders, random.Random(0))
+    source = db.get_bind().url.database
+    db.close()
+
+    def state(conn):
+        return {
+            "orders": conn.execute("SELECT COUNT(*), ROUND(SUM(total), 2), MAX(id) FROM orders").fetchone(),
+            "triggers": conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' "
+                                     "ORDER BY name").fetchall(),
+            "indexes": conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                    "AND tbl_name = 'orders' ORDER BY name").fetchall(),
+        }
+
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, "rebuild.db")
+        with sqlite3.connect(source) as conn, sqlite3.connect(path) as copy:
+            conn.backup(copy)
+        conn = sqlite3.connect(path)
+        before = state(conn)
+        conn.close()
+
+        # The table as a migration would pass it, outside the models' metadata
+        metadata = MetaData()
+        for table in Base.metadata.sorted_tables:
+            table.to_metadata(metadata)
+        scratch_engine = create_engine(f"sqlite:///{path}", **engine_options(f"sqlite:///{path}"))
+        started = time.perf_counter()
+        with scratch_engine.connect() as connection:
+            rebuild_table(Operations(MigrationContext.configure(connection)), metadata.tables["orders"])
+        seconds = time.perf_counter() - started
+        scratch_engine.dispose()
+
+        conn = sqlite3.connect(path)
+        after = state(conn)
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        problems = [] if problems == ["ok"] else problems
+        problems += [f"foreign key: {row}" for row in conn.execute("PRAGMA foreign_key_check")]
+        for part in before:
+            if after[part] != before[part]:
+                problems.append(f"{part} differ: {before[part]} before, {after[part]} after")
+        order_id, total = conn.execute("SELECT id, total FROM orders ORDER BY id DESC LIMIT 1").fetchone()
+        conn.execute("INSERT INTO order_items (order_id, flower_id, quantity) "
+                     "VALUES (?, (SELECT MIN(id) FROM flowers), 1)", (order_id,))
+        if conn.execute("SELECT total FROM orders WHERE id = ?", (order_id,)).fetchone()[0] == total:
+            problems.append("adding an item left its order total unchanged")
+        conn.rollback()
+        conn.close()
+
+    count = before["orders"][0]
+    print(f"Rebuilt orders: {count} rows in {seconds:.2f}s ({count / seconds:.0f} rows/s), "
+          f"{len(before['triggers'])} triggers and {len(before['indexes'])} indexes kept")
+    for problem in problems:
+        print(f"  PROBLEM: {problem}")
+    if problems:
+        raise SystemExit(1)
+
+
+SOAK_LIMIT = 256 * 1024    # bytes the per-action soak may grow by after warm-up
+
+
+def soak_actions(flower_ids, customer_ids):
+    """What the menus do, minus the prompts: list, look up, report and sell"""
+    def view_flowers(db, i):
+        return db.query(Flower).order_by(Flower.name).all()
+
+    def customer_history(db, i):
+        customer_id = customer_ids[i % len(customer_ids)]
+        return [order.items for order in db.query(Order).filter(Order.customer_id == customer_id)]
+
+    def order_details(db, i):
+        order = db.query(Order).order_by(Order.id.desc()).first()
+        [(item.flower.name, item.quantity) for item in order.items]
+        return order
+
+    def create_order(db, i):
+        items = [(flower_ids[i % len(flower_ids)], 1), (flower_ids[(i * 7) % len(flower_ids)], 2)]
+        try:
+            return place_order(db, customer_ids[i % len(customer_ids)], items, status='pending')
+        except InsufficientStock:
+            return None     # the cashier is told the flowers are sold out
+
+    def top_customers(db, i):
+        return db.query(Customer.name, Order.total).join(Order).order_by(Order.total.desc()).limit(10).all()
+
+    return [view_flowers, customer_history, order_details, create_order, top_customers]
+
+
+def soak_growth(scope, actions, calls, kept=None):
+    """Traced bytes still held after `calls` actions, measured after a warm-up.
+
+    With a `kept` list every action's result is appended to it, the way a
+    screen holding on to what it loaded would.
+    """
+    def run(start, count):
+        for i in range(start, start + count):
+            with scope() as db:
+                result = actions[i % len(actions)](db, i)
+                if kept is not None:
+                    kept.append(result)
+
+    tracemalloc.start()
+    run(0, max(len(actions), calls // 10))
+    gc.collect()
+    baseline = tracemalloc.get_traced_memory()[0]
+    run(calls, calls)
+    gc.collect()
+    growth = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return growth
+
+
+def bench_soak(calls):
+    """Memory held after thousands of menu actions, per-action vs one shared session.
+
+    The shared arm is the old CLI: one session for the whole run, never
+    closed or expunged, with every screen's rows still referenced. It must
+    grow, or the soak could not tell the two designs apart; the per-action
+    footprint must stay within SOAK_LIMIT. Run against a copy of the
+    database: every fifth action places an order.
+    """
+    with read_only() as db:
+        flower_ids = [f for f, in db.query(Flower.id)] or [1]
+        customer_ids = [c for c, in db.query(Customer.id)] or [1]
+    actions = soak_actions(flower_ids, customer_ids)
+    with unit_of_work() as db:
+        # Enough stock that the orders keep coming in both arms
+        for flower in db.query(Flower):
+            record_movement(db, flower, calls, RESTOCK, note="soak benchmark")
+        db.commit()
+
+    shared = SessionLocal()
+    held = []
+    @contextmanager
+    def shared_session():
+        yield shared
+        held.append(len(shared.identity_map))
+
+    per_action = soak_growth(unit_of_work, actions, calls)
+    kept = []
+    long_lived = soak_growth(shared_session, actions, calls, kept)
+    shared.close()
+    del kept
+    warm_held, held = held[-calls - 1], held[-1]
+
+    print(f"{calls} actions after warm-up")
+    print(f"{'Session':<12} {'growth KiB':>11} {'bytes/action':>13}")
+    print(f"{'per action':<12} {per_action / 1024:>11.1f} {per_action / calls:>13.1f}")
+    print(f"{'shared':<12} {long_lived / 1024:>11.1f} {long_lived / calls:>13.1f}   "
+          f"(identity map {warm_held} -> {held} objects)")
+    if long_lived <= SOAK_LIMIT or long_lived <= 4 * per_action or held <= warm_held:
+        print("The shared session did not grow; the soak cannot tell the two designs apart")
+        raise SystemExit(1)
+    if per_action > SOAK_LIMIT:
+        print(f"Per-action sessions grew by more than {SOAK_LIMIT // 1024} KiB")
+        raise SystemExit(1)
+    print("Memory footprint: flat")
+
+
+BENCHMARKS = {
+    "dedupe": bench_dedupe,
+    "export": bench_export,
+    "lookups": bench_lookups,
+    "metrics": bench_metrics,
+    "prices": bench_prices,
+    "recommend": bench_recommendations,
+    "read-split": bench_read_split,
+    "rebuild": bench_rebuild,
+    "soak": bench_soak,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MyShop microbenchmarks")
+    parser.add_argument('name', choices=sorted(BENCHMARKS), help="benchmark to run")
+    parser.add_argument('--calls', type=int, default=5000)
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args.calls)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,40 @@
 import sys
 import os
+import argparse
 from db.session import SessionLocal, engine
-from db.models import Base, Flower
+from db.models import Base, Flower, create_order_total_triggers
+from db.report_cache import report_cache
 from helpers import (
     main_menu, stock_menu, customer_menu, 
     order_menu, reports_menu, init_database
 )
 
 class MyShopCLI:
-    def __init__(self):
-        self.db = SessionLocal()
+    def __init__(self, snapshot_every=None, precompute=True, metrics_port=None, metrics_file=None,
+                 nightly_maintenance=False):
+        report_cache.load()
+        self.snapshots = None
+        if snapshot_every:
+            from db.backup import SnapshotScheduler
+            self.snapshots = SnapshotScheduler(snapshot_every * 60).start()
+        self.precompute = None
+        if precompute:
+            from db.reports import start_precompute
+            self.precompute = start_precompute()
+        from db.reservations import start_sweeper
+        self.sweeper = start_sweeper()
+        self.maintenance = None
+        if nightly_maintenance:
+            from db.maintenance import start_maintenance
+            self.maintenance = start_maintenance()
+        self.metrics_server = None
+        if metrics_port:
+            from db.metrics import serve
+            self.metrics_server = serve(metrics_port)
+        self.metrics_file = None
+        if metrics_file:
+            from db.metrics import TextfileWriter
+            self.metrics_file = TextfileWriter(metrics_file).start()
         self.run()
 
     def run(self):
@@ -17,22 +42,57 @@ class MyShopCLI:
             choice = main_menu()
             
             if choice == 'stock':
-                stock_menu(self.db)
+                stock_menu()
             elif choice == 'customer':
-                customer_menu(self.db)
+                customer_menu()
             elif choice == 'order':
-                order_menu(self.db)
+                order_menu()
             elif choice == 'reports':
-                reports_menu(self.db)
+                reports_menu()
             elif choice == 'exit':
                 print("\nThank you for using MyShop. Goodbye!")
-                self.db.close()
+                report_cache.save()
+                if self.snapshots:
+                    self.snapshots.stop()
+                if self.precompute:
+                    self.precompute.stop()
+                self.sweeper.stop()
+                if self.maintenance:
+                    self.maintenance.stop()
+                if self.metrics_server:
+                    self.metrics_server.shutdown()
+                if self.metrics_file:
+                    self.metrics_file.stop()
                 sys.exit(0)
 
+def check_schema():
+    """Stop with upgrade instructions if the database predates this code"""
+    from db.schema import schema_status, upgrade_command, UNSTAMPED_REVISION
+    status = schema_status()
+    if status is None:
+        return
+    revision, head, missing = status
+    if revision is None:
+        print("The database schema has no migration revision recorded.")
+    else:
+        print(f"The database schema is at revision {revision}; this version of MyShop needs {head}.")
+    if missing:
+        print(f"Missing: {', '.join(missing)}")
+    print("Take a snapshot, then upgrade it with:")
+    if revision is None:
+        print(f"  {upgrade_command(revision=UNSTAMPED_REVISION, action='stamp')}")
+    print(f"  {upgrade_command()}")
+    sys.exit(1)
+
 def initialize_database():
     """Initialize database tables and seed data if needed"""
+    from db.schema import shop_tables, stamp_head
+    new = not shop_tables()
     Base.metadata.create_all(bind=engine)
-    
+    with engine.begin() as connection:
+        create_order_total_triggers(connection)
+        if new:
+            stamp_head(connection)
 
     db = SessionLocal()
     try:
@@ -40,9 +100,255 @@ def initialize_database():
             print("Seeding database for the first time...")
             from db.seed import seed_database
             seed_database()
+        from db.ledger import write_checkpoints
+        from db.orders import purge_expired_keys
+        from db.reservations import release_expired
+        write_checkpoints(db)
+        purge_expired_keys(db)
+        release_expired(db)
+    finally:
+        db.close()
+
+def take_snapshot():
+    """Take an online snapshot of the database"""
+    from db.backup import create_snapshot
+    try:
+        path = create_snapshot()
+    except ValueError as e:
+        print(f"Snapshot failed: {str(e)}")
+        sys.exit(1)
+    print(f"Snapshot written to {path}")
+
+def restore_database(path):
+    """Restore the database from a snapshot file"""
+    from db.backup import restore_snapshot
+    try:
+        counts = restore_snapshot(path)
+    except ValueError as e:
+        print(f"Restore failed: {str(e)}")
+        sys.exit(1)
+    print(f"Restored {path}")
+    for table, count in counts.items():
+        print(f"  {table}: {count} rows")
+
+def export_data(path):
+    """Write the whole database to a compact export file"""
+    from db.export import export_database
+    counts = export_database(path)
+    print(f"Exported {sum(counts.values())} rows to {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+def load_data(path):
+    """Load an export file into a new database"""
+    from db.export import load_export
+    try:
+        counts = load_export(path)
+    except ValueError as e:
+        print(f"Load failed: {str(e)}")
+        sys.exit(1)
+    print(f"Loaded {path}")
+    for table, count in counts.items():
+        print(f"  {table}: {count} rows")
+
+def reconcile_stock():
+    """Check the stock ledger against Flower.quantity"""
+    from db.ledger import reconcile
+    from db.reservations import reservation_mismatches
+    db = SessionLocal()
+    try:
+        mismatches = reconcile(db)
+        for flower, balance in mismatches:
+            print(f"  {flower.name} (ID: {flower.id}): on hand {flower.quantity}, ledger {balance}")
+        held = reservation_mismatches(db)
+        for flower, units in held:
+            print(f"  {flower.name} (ID: {flower.id}): reserved {flower.reserved}, reservations {units}")
+        mismatches += held
+        print(f"{len(mismatches)} mismatches found")
     finally:
         db.close()
+    if mismatches:
+        sys.exit(1)
+
+def import_stock(path, dry_run=False):
+    """Bulk update stock counts and prices from a CSV file"""
+    from db.importer import plan_import, apply_import, StockImportError
+    from helpers import print_import_diff
+    db = SessionLocal()
+    try:
+        with open(path, newline='') as f:
+            changes = plan_import(db, f)
+        print_import_diff(changes)
+        if dry_run:
+            print(f"Dry run: {len(changes)} flowers would change")
+        else:
+            apply_import(db, changes)
+            print(f"Updated {len(changes)} flowers")
+    except StockImportError as e:
+        print(f"Nothing imported, {len(e.errors)} invalid rows:")
+        for error in e.errors:
+            print(f"  {error}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+def segment_customers(full=False):
+    """Recompute customer RFM segments"""
+    from db.segments import refresh_segments
+    db = SessionLocal()
+    try:
+        refreshed = refresh_segments(db, full=full)
+        print(f"Refreshed segments for {refreshed} customers")
+    finally:
+        db.close()
+
+def dedupe_customers(merge=False):
+    """List likely duplicate customers; with merge, merge the near-certain ones"""
+    from db.dedupe import find_duplicates, merge_candidates, AUTO_MERGE_SCORE
+    from db.segments import refresh_segments
+    db = SessionLocal()
+    try:
+        candidates = find_duplicates(db)
+        for c in candidates:
+            print(f"{c.score:.2f}  #{c.keep.id} {c.keep.label} <- #{c.drop.id} {c.drop.label}  ({', '.join(c.reasons)})")
+        print(f"{len(candidates)} likely duplicates")
+        if merge:
+            sure = [c for c in candidates if c.score >= AUTO_MERGE_SCORE]
+            merged, moved = merge_candidates(db, sure)
+            if merged:
+                refresh_segments(db, full=True)
+            print(f"Merged {merged} customers scoring {AUTO_MERGE_SCORE} or more ({moved} orders moved)")
+    except Exception as e:
+        db.rollback()
+        print(f"\n Error: {str(e)}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+def complete_pending():
+    """Complete pending orders; safe to run on several nodes at once"""
+    from db.orders import complete_pending_orders
+    db = SessionLocal()
+    try:
+        orders, units, short = complete_pending_orders(db)
+        print(f"Completed {orders} pending orders ({units} units)")
+        if short:
+            print(f"{len(short)} orders left pending for lack of stock: {', '.join(map(str, short))}")
+    finally:
+        db.close()
+
+def release_reservations():
+    """Release the stock held by expired pending-order reservations"""
+    from db.reservations import release_expired
+    db = SessionLocal()
+    try:
+        released = release_expired(db)
+        print(f"Released {released} expired reservations")
+    finally:
+        db.close()
+
+def format_size(pages, page_size):
+    return f"{pages * page_size / 1024:,.0f} KiB"
+
+def print_maintenance_report(report):
+    """Show what maintenance did and the database size before and after"""
+    before, after = report.before, report.after
+    print(f"{'':<12} {'Before':>14} {'After':>14}")
+    print(f"{'Pages':<12} {before.page_count:>14,} {after.page_count:>14,}")
+    print(f"{'Free pages':<12} {before.freelist_count:>14,} {after.freelist_count:>14,}")
+    print(f"{'File size':<12} {format_size(before.page_count, before.page_size):>14} "
+          f"{format_size(after.page_count, after.page_size):>14}")
+    if after.objects:
+        print(f"\n{'Table or index':<44} {'Before':>12} {'After':>12}")
+        for name, size in after.objects.items():
+            print(f"{name:<44} {before.objects.get(name, 0) // 1024:>9,} KiB {size // 1024:>9,} KiB")
+    print()
+    print("Statistics: " + ("full ANALYZE" if report.analyzed else "PRAGMA optimize"))
+    if report.vacuumed is None:
+        print("Vacuum: skipped, auto_vacuum is not INCREMENTAL (run the migrations)")
+    else:
+        print(f"Vacuum: {report.vacuumed:,} pages returned")
+    busy, wal_pages, checkpointed = report.checkpoint
+    print(f"WAL checkpoint: {checkpointed} of {wal_pages} pages" + (" (readers busy)" if busy else ""))
+    print(f"Integrity: {'ok' if not report.integrity else f'{len(report.integrity)} problems'}")
+    for problem in report.integrity:
+        print(f"  {problem}")
+    print(f"Finished in {report.seconds:.1f}s")
+
+def maintain_database(vacuum=True):
+    """Analyze, vacuum, checkpoint and integrity-check the database"""
+    from db.maintenance import run_maintenance
+    try:
+        report = run_maintenance(vacuum=vacuum)
+    except ValueError as e:
+        print(f"Maintenance skipped: {str(e)}")
+        sys.exit(1)
+    print_maintenance_report(report)
+    if report.integrity:
+        sys.exit(1)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="MyShop flower shop management")
+    parser.add_argument('--init', action='store_true', help="initialize and seed the database, then exit")
+    parser.add_argument('--snapshot', action='store_true', help="take an online snapshot of the database")
+    parser.add_argument('--restore', metavar='SNAPSHOT', help="restore the database from a snapshot")
+    parser.add_argument('--export', metavar='PATH', help="export the whole database to a compact file")
+    parser.add_argument('--load-export', metavar='PATH', help="load an export into a new, empty database")
+    parser.add_argument('--reconcile-stock', action='store_true', help="check the stock ledger against stock on hand")
+    parser.add_argument('--import-stock', metavar='CSV', help="bulk update stock and prices from a CSV file")
+    parser.add_argument('--dry-run', action='store_true', help="with --import-stock, show the changes without applying them")
+    parser.add_argument('--segment-customers', action='store_true',
+                        help="refresh RFM segments for customers with changed orders")
+    parser.add_argument('--full', action='store_true', help="with --segment-customers, recompute every customer")
+    parser.add_argument('--dedupe-customers', action='store_true', help="list customers that look like duplicates")
+    parser.add_argument('--merge', action='store_true',
+                        help="with --dedupe-customers, merge the duplicates that are near-certain")
+    parser.add_argument('--complete-pending', action='store_true',
+                        help="complete every pending order, taking its items out of stock")
+    parser.add_argument('--release-reservations', action='store_true',
+                        help="release stock held by expired pending-order reservations")
+    parser.add_argument('--maintenance', action='store_true',
+                        help="ANALYZE, vacuum, checkpoint and integrity-check the database")
+    parser.add_argument('--no-vacuum', action='store_true', help="with --maintenance, skip the incremental vacuum")
+    parser.add_argument('--nightly-maintenance', action='store_true',
+                        help="run database maintenance at 03:30 while the shop is open")
+    parser.add_argument('--snapshot-every', type=int, metavar='MINUTES',
+                        help="take snapshots in the background while the shop is open")
+    parser.add_argument('--no-precompute', action='store_true',
+                        help="do not precompute reports in the background")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument('--metrics-file', metavar='PATH',
+                        help="rewrite Prometheus metrics to PATH every 15 seconds")
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    initialize_database()
-    MyShopCLI()
\ No newline at end of file
+    args = parse_args()
+    if not (args.snapshot or args.restore or args.load_export):
+        check_schema()
+    if args.snapshot:
+        take_snapshot()
+    elif args.restore:
+        restore_database(args.restore)
+    elif args.export:
+        export_data(args.export)
+    elif args.load_export:
+        load_data(args.load_export)
+    elif args.reconcile_stock:
+        reconcile_stock()
+    elif args.import_stock:
+        import_stock(args.import_stock, dry_run=args.dry_run)
+    elif args.segment_customers:
+        segment_customers(full=args.full)
+    elif args.dedupe_customers:
+        dedupe_customers(merge=args.merge)
+    elif args.complete_pending:
+        complete_pending()
+    elif args.release_reservations:
+        release_reservations()
+    elif args.maintenance:
+        maintain_database(vacuum=not args.no_vacuum)
+    else:
+        initialize_database()
+        if not args.init:
+            MyShopCLI(snapshot_every=args.snapshot_every, precompute=not args.no_precompute,
+                      metrics_port=args.metrics_port, metrics_file=args.metrics_file,
+                      nightly_maintenance=args.nightly_maintenance)
\ No newline at end of file
@@ -1,3 +1,3 @@
 # This file makes the 'db' directory a Python package
 from .session import SessionLocal, engine, get_db
-from .models import Base, Flower, Customer, Order, OrderItem
\ No newline at end of file
+from .models import Base, Flower, Customer, Order, OrderItem, StockMovement, StockCheckpoint, IdempotencyKey, CustomerSegment, ReportSnapshot, Reservation, FlowerPrice
\ No newline at end of file
@@ -0,0 +1,194 @@
+import time
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+from alembic.util import CommandError
+from sqlalchemy.schema import CreateTable
+
+# Backfill settings
+CHUNK_SIZE = 5000       # rows per transaction
+CHUNK_SLEEP = 0.05      # seconds to yield to the shop between chunks
+REPORT_EVERY = 5        # seconds between progress lines
+
+# Progress of every chunked job, so an interrupted migration resumes where
+# it stopped. Not a model: env.py keeps autogenerate from dropping it.
+PROGRESS_TABLE = "backfill_progress"
+progress = sa.Table(
+    PROGRESS_TABLE, sa.MetaData(),
+    sa.Column("job", sa.String(100), primary_key=True),
+    sa.Column("table_name", sa.String(100), nullable=False),
+    sa.Column("last_key", sa.Integer, nullable=False),
+    sa.Column("rows_done", sa.Integer, nullable=False),
+    sa.Column("rows_total", sa.Integer, nullable=False),
+    sa.Column("started_at", sa.DateTime, nullable=False),
+    sa.Column("updated_at", sa.DateTime, nullable=False),
+    sa.Column("finished_at", sa.DateTime),
+)
+
+
+class BackfillError(CommandError, ValueError):
+    """Raised when a helper cannot run as asked; alembic reports it as FAILED"""
+
+
+def _report(job, done, total, rate):
+    eta = timedelta(seconds=round((total - done) / rate)) if rate else "?"
+    percent = f"{done / total:.0%}" if total else "100%"
+    print(f"  {job}: {done}/{total} rows ({percent}), {rate:.0f} rows/s, ETA {eta}")
+
+
+def _start(connection, job, table):
+    """The job's progress row, created on the first run"""
+    progress.create(connection, checkfirst=True)
+    row = connection.execute(sa.select(progress).where(progress.c.job == job)).first()
+    if row is None:
+        total = connection.execute(sa.text(f"SELECT COUNT(*) FROM {table}")).scalar()
+        now = datetime.now()
+        connection.execute(progress.insert().values(
+            job=job, table_name=table, last_key=0, rows_done=0, rows_total=total,
+            started_at=now, updated_at=now
+        ))
+        row = connection.execute(sa.select(progress).where(progress.c.job == job)).first()
+    connection.commit()
+    return row
+
+
+def run_chunks(engine, job, table, statement, key="id", chunk_size=CHUNK_SIZE, sleep=CHUNK_SLEEP):
+    """Run `statement` over `table` one primary key range at a time.
+
+    `statement` is SQL with :low and :high parameters, applied to keys
+    low < key <= high; each range of `chunk_size` rows commits together
+    with the job's progress, then the shop gets `sleep` seconds. Re-running
+    a job resumes after the last committed range, and a finished job is
+    skipped. Returns the rows covered by this run.
+    """
+    with engine.connect() as connection:
+        row = _start(connection, job, table)
+        if row.finished_at is not None:
+            print(f"  {job}: already done")
+            return 0
+        if row.rows_done:
+            print(f"  {job}: resuming after {key} {row.last_key}")
+
+        last_key, done, total = row.last_key, row.rows_done, row.rows_total
+        next_keys = sa.text(f"SELECT {key} FROM {table} WHERE {key} > :low ORDER BY {key} LIMIT :n")
+        started = reported = time.monotonic()
+        covered = 0
+        while True:
+            keys = connection.execute(next_keys, {"low": last_key, "n": chunk_size}).scalars().all()
+            if not keys:
+                break
+            connection.execute(sa.text(statement), {"low": last_key, "high": keys[-1]})
+            last_key, done, covered = keys[-1], done + len(keys), covered + len(keys)
+            connection.execute(progress.update().where(progress.c.job == job).values(
+                last_key=last_key, rows_done=done, rows_total=max(total, done), updated_at=datetime.now()
+            ))
+            connection.commit()
+
+            if time.monotonic() - reported >= REPORT_EVERY:
+                reported = time.monotonic()
+                _report(job, done, max(total, done), covered / (reported - started))
+            time.sleep(sleep)
+
+        connection.execute(progress.update().where(progress.c.job == job).values(
+            rows_total=done, finished_at=datetime.now()
+        ))
+        connection.commit()
+        elapsed = time.monotonic() - started
+        print(f"  {job}: {done} rows done, {covered} in {elapsed:.1f}s")
+        return covered
+
+
+def _migration_engine(op):
+    """The engine behind a migration, for work done on its own connections.
+
+    Call inside autocommit_block(): the migration's transaction is then
+    committed, so it holds no locks the chunks would wait on.
+    """
+    return op.get_bind().engine
+
+
+def backfill(op, job, table, values, where=None, key="id", chunk_size=CHUNK_SIZE, sleep=CHUNK_SLEEP):
+    """Fill columns of a large table from a migration, a chunk at a time.
+
+    `values` is the SET clause, e.g. "item_count = (SELECT ...)", and
+    `where` optionally narrows the rows. It must be safe to apply twice,
+    since a chunk cut short is run again on resume. Everything before the
+    backfill in the migration is committed first. In --sql mode a single
+    UPDATE is emitted instead.
+    """
+    condition = f" AND ({where})" if where else ""
+    if op.get_context().as_sql:
+        op.execute(f"UPDATE {table} SET {values}" + (f" WHERE {where}" if where else ""))
+        return 0
+    statement = f"UPDATE {table} SET {values} WHERE {key} > :low AND {key} <= :high{condition}"
+    with op.get_context().autocommit_block():
+        return run_chunks(_migration_engine(op), job, table, statement, key, chunk_size, sleep)
+
+
+def has_column(op, table, column):
+    """True if `table` already has `column`, for migrations that may run twice"""
+    return column in {c["name"] for c in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def _triggers_naming(connection, table):
+    """(name, sql) of the SQLite triggers on `table` or whose SQL mentions it"""
+    if connection.dialect.name != "sqlite":
+        return []
+    return connection.execute(sa.text(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' "
+        "AND (tbl_name = :table OR sql LIKE '%' || :table || '%') ORDER BY name"
+    ), {"table": table}).all()
+
+
+def rebuild_table(op, new_table, job=None, columns=None, key="id", chunk_size=CHUNK_SIZE, sleep=CHUNK_SLEEP):
+    """Chunked alternative to batch_alter_table for large SQLite tables.
+
+    batch_alter_table rebuilds a table with one INSERT ... SELECT, holding
+    the write lock for the whole copy. Here `new_table` (the table as it
+    should be) is created under a temporary name and filled a chunk at a
+    time, resumably. Then, in one short transaction, rows added since are
+    copied, the old table is dropped and the new one renamed into place,
+    and its indexes are built. `columns` are copied across (default: those
+    both tables have). Rows already copied must not change while it runs,
+    so run it with the shop closed unless the table is append-only.
+    On SQLite the triggers on the table, or whose SQL names it (such as
+    the order total triggers on order_items), are dropped before the swap
+    and recreated as they were in the same transaction.
+    """
+    if op.get_context().as_sql:
+        raise BackfillError("rebuild_table copies rows as it goes; use batch_alter_table for --sql")
+    name = new_table.name
+    temporary = f"_chunked_{name}"
+    job = job or f"rebuild {name}"
+    with op.get_context().autocommit_block():
+        engine = _migration_engine(op)
+        existing = sa.inspect(engine)
+        if columns is None:
+            old = {c["name"] for c in existing.get_columns(name)}
+            columns = [c.name for c in new_table.columns if c.name in old]
+        listed = ", ".join(columns)
+        copy = f"INSERT INTO {temporary} ({listed}) SELECT {listed} FROM {name} WHERE {key} > :low"
+
+        if not existing.has_table(temporary):
+            with engine.begin() as connection:
+                connection.execute(CreateTable(new_table.to_metadata(new_table.metadata, name=temporary)))
+        run_chunks(engine, job, name, copy + f" AND {key} <= :high", key, chunk_size, sleep)
+
+        with engine.connect() as connection:
+            copied = connection.execute(sa.text(f"SELECT MAX({key}) FROM {temporary}")).scalar() or 0
+            connection.execute(sa.text(copy), {"low": copied})
+            # A trigger that names a dropped table makes the RENAME fail
+            triggers = _triggers_naming(connection, name)
+            for trigger, _ in triggers:
+                connection.execute(sa.text(f"DROP TRIGGER {trigger}"))
+            connection.execute(sa.text(f"DROP TABLE {name}"))
+            connection.execute(sa.text(f"ALTER TABLE {temporary} RENAME TO {name}"))
+            for index in new_table.indexes:
+                index.create(connection)
+            for _, sql in triggers:
+                connection.execute(sa.text(sql))
+            connection.execute(progress.delete().where(progress.c.job == job))
+            connection.commit()
+    if op.get_bind().dialect.name == "sqlite":
+        # The migration's connection still has the old schema cached and
+        # would see the dropped table; reading sqlite_master reloads it
+        op.execute("SELECT 1 FROM sqlite_master LIMIT 1")
@@ -0,0 +1,177 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from .models import Base
+from .session import engine, read_engine
+
+# Snapshot settings
+SNAPSHOT_DIR = "backups"
+SNAPSHOT_PREFIX = "myshop-"
+SNAPSHOT_SUFFIX = ".db"
+PAGES_PER_STEP = 256      # pages copied per backup step
+STEP_SLEEP = 0.05         # seconds to yield to writers between steps
+KEEP_LAST = 24            # always keep the newest N snapshots
+KEEP_DAILY = 14           # plus the newest snapshot of each of the last N days
+
+TABLES = [table.name for table in Base.metadata.sorted_tables]
+
+
+def database_path():
+    """Path of the live SQLite database file"""
+    if engine.dialect.name != "sqlite":
+        raise ValueError("snapshots need a SQLite database; use pg_dump for PostgreSQL")
+    return engine.url.database
+
+
+def _snapshot_name(when):
+    return f"{SNAPSHOT_PREFIX}{when.strftime('%Y%m%d-%H%M%S')}{SNAPSHOT_SUFFIX}"
+
+
+def _snapshot_time(filename):
+    stamp = filename[len(SNAPSHOT_PREFIX):-len(SNAPSHOT_SUFFIX)]
+    return datetime.strptime(stamp, "%Y%m%d-%H%M%S")
+
+
+def list_snapshots(directory=SNAPSHOT_DIR):
+    """Return (taken_at, path) for every snapshot, newest first"""
+    if not os.path.isdir(directory):
+        return []
+    snapshots = []
+    for filename in os.listdir(directory):
+        if not (filename.startswith(SNAPSHOT_PREFIX) and filename.endswith(SNAPSHOT_SUFFIX)):
+            continue
+        try:
+            taken_at = _snapshot_time(filename)
+        except ValueError:
+            continue
+        snapshots.append((taken_at, os.path.join(directory, filename)))
+    return sorted(snapshots, reverse=True)
+
+
+def _copy(source_path, target_path, pages=PAGES_PER_STEP, sleep=STEP_SLEEP):
+    """Copy one SQLite database into another with the online backup API.
+
+    The copy runs in steps of `pages` pages and sleeps between steps so the
+    shop can keep committing orders while the backup is in progress.
+    """
+    def pause(status, remaining, total):
+        # backup()'s own `sleep` only applies when a step finds the database
+        # busy; this is the pause between every step
+        if remaining:
+            time.sleep(sleep)
+
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages, progress=pause)
+    finally:
+        target.close()
+        source.close()
+
+
+def table_counts(path):
+    """Row counts for the shop tables in the given database file"""
+    conn = sqlite3.connect(path)
+    try:
+        existing = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")}
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in TABLES if table in existing
+        }
+    finally:
+        conn.close()
+
+
+def integrity_check(path):
+    """Run PRAGMA integrity_check and return the list of problems (empty if ok)"""
+    conn = sqlite3.connect(path)
+    try:
+        rows = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    finally:
+        conn.close()
+    return [] if rows == ["ok"] else rows
+
+
+def create_snapshot(directory=SNAPSHOT_DIR, pages=PAGES_PER_STEP, sleep=STEP_SLEEP):
+    """Take a consistent snapshot of the live database and rotate old ones"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, _snapshot_name(datetime.now()))
+    partial = path + ".part"
+    _copy(database_path(), partial, pages=pages, sleep=sleep)
+    os.replace(partial, path)
+    rotate_snapshots(directory)
+    return path
+
+
+def rotate_snapshots(directory=SNAPSHOT_DIR, keep_last=KEEP_LAST, keep_daily=KEEP_DAILY, now=None):
+    """Delete snapshots not covered by the retention rules, return removed paths"""
+    now = now or datetime.now()
+    snapshots = list_snapshots(directory)
+    keep = {path for _, path in snapshots[:keep_last]}
+
+    oldest_day = (now - timedelta(days=keep_daily)).date()
+    seen_days = set()
+    for taken_at, path in snapshots:
+        day = taken_at.date()
+        if day > oldest_day and day not in seen_days:
+            seen_days.add(day)
+            keep.add(path)
+
+    removed = []
+    for _, path in snapshots:
+        if path not in keep:
+            os.remove(path)
+            removed.append(path)
+    return removed
+
+
+def restore_snapshot(snapshot_path, pages=PAGES_PER_STEP, sleep=STEP_SLEEP):
+    """Restore the live database from a snapshot.
+
+    The snapshot is integrity checked before anything is touched, and the
+    restored database must report the same row counts as the snapshot.
+    """
+    problems = integrity_check(snapshot_path)
+    if problems:
+        raise ValueError(f"Snapshot failed integrity check: {problems[0]}")
+    expected = table_counts(snapshot_path)
+
+    engine.dispose()
+    read_engine.dispose()
+    _copy(snapshot_path, database_path(), pages=pages, sleep=sleep)
+
+    problems = integrity_check(database_path())
+    if problems:
+        raise ValueError(f"Restored database failed integrity check: {problems[0]}")
+    restored = table_counts(database_path())
+    if restored != expected:
+        raise ValueError(f"Row counts differ after restore: expected {expected}, got {restored}")
+    return restored
+
+
+class SnapshotScheduler:
+    """Background thread that takes a snapshot every `interval` seconds"""
+
+    def __init__(self, interval, directory=SNAPSHOT_DIR):
+        self.interval = interval
+        self.directory = directory
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="snapshot-scheduler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                create_snapshot(self.directory)
+            except Exception as e:
+                print(f"\n Snapshot failed: {str(e)}")
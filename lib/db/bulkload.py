@@ -0,0 +1,42 @@
+import csv
+import io
+
+NULL = r"\N"    # how COPY is told a value is NULL, so empty strings stay empty
+
+
+def _copy_value(value):
+    return NULL if value is None else value
+
+
+def copy_rows(db, table, rows, columns=None):
+    """Load dict rows into `table` in the session's transaction.
+
+    PostgreSQL gets a single COPY ... FROM STDIN; other databases get one
+    executemany INSERT. Returns the number of rows loaded.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    columns = columns or list(rows[0])
+    connection = db.connection()
+    if connection.dialect.name != "postgresql":
+        db.execute(table.insert(), rows)
+        return len(rows)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_copy_value(row[column]) for column in columns])
+    sql = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')"
+
+    cursor = connection.connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):     # psycopg2
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+        else:                                  # psycopg 3
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+    finally:
+        cursor.close()
+    return len(rows)
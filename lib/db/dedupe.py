@@ -0,0 +1,218 @@
+import re
+from collections import namedtuple
+from difflib import SequenceMatcher
+from itertools import combinations
+from sqlalchemy import func
+from .models import Customer, CustomerSegment, Order
+from .lookups import get_customer
+
+# Dedupe settings
+MATCH_SCORE = 0.6       # pairs scoring at least this are reported
+AUTO_MERGE_SCORE = 0.9  # and at least this are merged without asking
+MAX_BLOCK = 50          # larger blocks only compare neighbours by name
+WINDOW = 5              # neighbours compared in a large block
+
+# Score weights; they add up to 1
+NAME_WEIGHT = 0.4
+PHONE_WEIGHT = 0.35
+EMAIL_WEIGHT = 0.25
+
+Candidate = namedtuple("Candidate", ["keep", "drop", "score", "reasons"])
+
+_TITLES = {"mr", "mrs", "ms", "miss", "dr", "prof", "jr", "sr", "ii", "iii", "iv", "md", "phd", "dds", "dvm"}
+_SOUNDEX = {c: str(d) for d, letters in enumerate(["aeiouyhw", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r"])
+            for c in letters}
+
+
+def normalize_name(name):
+    """Lowercase name words without titles, suffixes or punctuation"""
+    words = re.sub(r"[^a-z ]", " ", (name or "").lower()).split()
+    return " ".join(w for w in words if w not in _TITLES)
+
+
+def normalize_phone(phone):
+    """Digits of a phone number without extension or US country code"""
+    digits = re.sub(r"\D", "", re.split(r"x|ext", (phone or "").lower())[0])
+    if digits.startswith("001"):
+        digits = digits[3:]
+    if len(digits) == 11 and digits.startswith("1"):
+        digits = digits[1:]
+    return digits
+
+
+def normalize_email(email):
+    """Lowercase address with any +tag dropped from the local part"""
+    local, _, domain = (email or "").strip().lower().partition("@")
+    return f"{local.split('+')[0]}@{domain}" if domain else ""
+
+
+def soundex(word):
+    """Four character Soundex code, e.g. 'Robert' -> 'r163'"""
+    if not word:
+        return ""
+    codes = [_SOUNDEX.get(c, "") for c in word]
+    kept = [word[0]]
+    previous = codes[0]
+    for c, code in zip(word[1:], codes[1:]):
+        if code not in ("0", "") and code != previous:
+            kept.append(code)
+        if c not in "hw":
+            previous = code
+    return ("".join(kept) + "000")[:4]
+
+
+def name_key(name):
+    """Phonetic key for blocking: Soundex of the last name plus first initial"""
+    words = normalize_name(name).split()
+    return f"{soundex(words[-1])}:{words[0][0]}" if words else ""
+
+
+# name, phone and email are normalized; label is the name as entered
+Record = namedtuple("Record", ["id", "label", "name", "phone", "email", "orders"])
+
+
+def _record(customer_id, name, phone, email, orders):
+    return Record(customer_id, name, normalize_name(name), normalize_phone(phone), normalize_email(email), orders)
+
+
+def blocks(records):
+    """Groups of records sharing a normalized phone, email or name key"""
+    keyed = {}
+    for record in records:
+        keys = [("name", name_key(record.name))]
+        if len(record.phone) >= 7:
+            keys.append(("phone", record.phone))
+        if record.email:
+            keys.append(("email", record.email))
+        for key in keys:
+            if key[1]:
+                keyed.setdefault(key, []).append(record)
+    return [group for group in keyed.values() if len(group) > 1]
+
+
+def candidate_pairs(records):
+    """Pairs of records worth scoring, each once.
+
+    Only records sharing a blocking key are paired, so the work grows
+    with the block sizes instead of with n². Blocks bigger than MAX_BLOCK
+    (a common surname) are sorted by name and each record is only paired
+    with its next WINDOW neighbours.
+    """
+    seen = set()
+    for group in blocks(records):
+        if len(group) <= MAX_BLOCK:
+            pairs = combinations(group, 2)
+        else:
+            group = sorted(group, key=lambda r: r.name)
+            pairs = ((a, b) for i, a in enumerate(group) for b in group[i + 1:i + 1 + WINDOW])
+        for a, b in pairs:
+            key = (min(a.id, b.id), max(a.id, b.id))
+            if key not in seen:
+                seen.add(key)
+                yield a, b
+
+
+def score(a, b):
+    """(similarity 0..1, reasons) for two normalized records.
+
+    A phone or email missing on either side is left out rather than
+    counted as a mismatch, but a name alone never scores above NAME_WEIGHT.
+    """
+    reasons = []
+    name = SequenceMatcher(None, a.name, b.name).ratio() if a.name and b.name else 0.0
+    if name >= 0.8:
+        reasons.append("name" if name == 1 else f"name {name:.0%}")
+    total, weights = NAME_WEIGHT * name, NAME_WEIGHT
+    if a.phone and b.phone:
+        weights += PHONE_WEIGHT
+        if a.phone == b.phone:
+            total += PHONE_WEIGHT
+            reasons.append("phone")
+        elif len(a.phone) >= 7 and a.phone[-7:] == b.phone[-7:]:
+            total += PHONE_WEIGHT / 2
+            reasons.append("phone ending")
+    if a.email and b.email:
+        weights += EMAIL_WEIGHT
+        if a.email == b.email:
+            total += EMAIL_WEIGHT
+            reasons.append("email")
+    return (total if weights == NAME_WEIGHT else total / weights), reasons
+
+
+def match(records, threshold=MATCH_SCORE):
+    """Candidates scoring at least `threshold`, best first.
+
+    The customer with more orders (then the older one) is the one to keep.
+    """
+    found = []
+    for a, b in candidate_pairs(records):
+        similarity, reasons = score(a, b)
+        if similarity >= threshold:
+            keep, drop = sorted((a, b), key=lambda r: (-r.orders, r.id))
+            found.append(Candidate(keep, drop, similarity, reasons))
+    return sorted(found, key=lambda c: (-c.score, c.keep.id, c.drop.id))
+
+
+def find_duplicates(db, threshold=MATCH_SCORE):
+    """Likely duplicate customers as Candidates, best first"""
+    orders = dict(db.query(Order.customer_id, func.count(Order.id)).group_by(Order.customer_id).all())
+    records = [
+        _record(customer_id, name, phone, email, orders.get(customer_id, 0))
+        for customer_id, name, phone, email in db.query(Customer.id, Customer.name, Customer.phone, Customer.email)
+    ]
+    return match(records, threshold)
+
+
+def merge_customers(db, keep_id, drop_ids):
+    """Move the orders of `drop_ids` to `keep_id` and delete them.
+
+    Orders are repointed with one UPDATE. The kept customer takes a phone
+    or email it is missing from the first dropped customer that has one.
+    Segments of the dropped customers are deleted; refresh them with
+    full=True afterwards. Returns the number of orders moved.
+    """
+    drop_ids = [d for d in drop_ids if d != keep_id]
+    if not drop_ids:
+        return 0
+    moved = db.query(Order).filter(Order.customer_id.in_(drop_ids)).update(
+        {Order.customer_id: keep_id}, synchronize_session=False
+    )
+    db.query(CustomerSegment).filter(CustomerSegment.customer_id.in_(drop_ids)).delete(synchronize_session=False)
+
+    keep = get_customer(db, keep_id)
+    dropped = db.query(Customer).filter(Customer.id.in_(drop_ids)).order_by(Customer.id).all()
+    phone = next((c.phone for c in dropped if c.phone), None)
+    email = next((c.email for c in dropped if c.email), None)
+    for customer in dropped:
+        db.delete(customer)
+    db.flush()  # free the unique phone before the kept customer takes it
+    if not keep.phone and phone:
+        keep.phone = phone
+    if not keep.email and email:
+        keep.email = email
+    db.flush()
+    return moved
+
+
+def merge_candidates(db, candidates):
+    """Merge every candidate pair in one transaction; returns (customers merged, orders moved).
+
+    Chains such as A~B and B~C end up in a single surviving customer.
+    """
+    survivor = {}
+
+    def find(customer_id):
+        while customer_id in survivor:
+            customer_id = survivor[customer_id]
+        return customer_id
+
+    merged = moved = 0
+    for candidate in candidates:
+        keep, drop = find(candidate.keep.id), find(candidate.drop.id)
+        if keep == drop:
+            continue
+        moved += merge_customers(db, keep, [drop])
+        survivor[drop] = keep
+        merged += 1
+    db.commit()
+    return merged, moved
@@ -0,0 +1,230 @@
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from sqlalchemy import DateTime, Float, Integer, String, func, inspect, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateTable
+from .models import Base, create_order_total_triggers
+from .session import engine, read_engine
+from .bulkload import copy_rows
+from .schema import stamp_head
+
+# Export settings
+MAGIC = b"MYSHOPX\x01"
+BLOCK_ROWS = 8192       # rows per column block; bounds memory on both sides
+LEVEL = 6               # zlib compression level
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# Frame kinds
+TABLE, BLOCK, END = b"T", b"B", b"E"
+FRAME = struct.Struct("<cI")
+
+# Column codes and the arrays their values are packed into
+INTEGER, TIMESTAMP, REAL, TEXT = "i", "t", "f", "s"
+ARRAYS = {INTEGER: "q", TIMESTAMP: "q", REAL: "d"}
+
+
+def _code(column):
+    kind = column.type
+    if isinstance(kind, Integer):
+        return INTEGER
+    if isinstance(kind, DateTime):
+        return TIMESTAMP
+    if isinstance(kind, Float):
+        return REAL
+    if isinstance(kind, String):
+        return TEXT
+    raise ValueError(f"cannot export {column.table.name}.{column.name} of type {kind}")
+
+
+def _little_endian(packed):
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed
+
+
+def _pack_column(code, values):
+    """Compressed bytes for one column of a block: null mask flag, mask, data"""
+    nulls = bytes(value is None for value in values)
+    if code == TEXT:
+        encoded = [b"" if value is None else value.encode() for value in values]
+        data = _little_endian(array("I", map(len, encoded))).tobytes() + b"".join(encoded)
+    else:
+        if code == TIMESTAMP:
+            values = [None if value is None else (value - EPOCH) // MICROSECOND for value in values]
+        filler = 0.0 if code == REAL else 0
+        data = _little_endian(array(ARRAYS[code], [filler if value is None else value for value in values])).tobytes()
+    payload = (b"\x01" + nulls if any(nulls) else b"\x00") + data
+    return zlib.compress(payload, LEVEL)
+
+
+def _unpack_column(code, rows, packed):
+    payload = zlib.decompress(packed)
+    nulls = payload[1:1 + rows] if payload[0] else None
+    data = payload[1 + rows:] if nulls else payload[1:]
+    if code == TEXT:
+        lengths = _little_endian(array("I", data[:4 * rows]))
+        values, offset = [], 4 * rows
+        for length in lengths:
+            values.append(data[offset:offset + length].decode())
+            offset += length
+    else:
+        values = _little_endian(array(ARRAYS[code], data)).tolist()
+        if code == TIMESTAMP:
+            values = [EPOCH + value * MICROSECOND for value in values]
+    if nulls:
+        values = [None if null else value for null, value in zip(nulls, values)]
+    return values
+
+
+def _write_frame(f, kind, payload):
+    f.write(FRAME.pack(kind, len(payload)))
+    f.write(payload)
+
+
+def _read_frame(f):
+    header = f.read(FRAME.size)
+    if len(header) < FRAME.size:
+        raise ValueError("export file is truncated")
+    kind, length = FRAME.unpack(header)
+    payload = f.read(length)
+    if len(payload) < length:
+        raise ValueError("export file is truncated")
+    return kind, payload
+
+
+def _pack_block(codes, rows):
+    columns = [_pack_column(code, [row[i] for row in rows]) for i, code in enumerate(codes)]
+    return struct.pack("<I", len(rows)) + b"".join(struct.pack("<I", len(c)) + c for c in columns)
+
+
+def _unpack_block(codes, payload):
+    rows, = struct.unpack_from("<I", payload)
+    offset, columns = 4, []
+    for code in codes:
+        length, = struct.unpack_from("<I", payload, offset)
+        columns.append(_unpack_column(code, rows, payload[offset + 4:offset + 4 + length]))
+        offset += 4 + length
+    return columns
+
+
+def _snapshot(source):
+    """A connection that sees every table as of one moment"""
+    if source.dialect.name == "sqlite":
+        connection = source.connect()
+        # pysqlite does not open a transaction for SELECTs, so each table
+        # would otherwise be read as of a different commit
+        connection.exec_driver_sql("BEGIN")
+        return connection
+    return source.connect().execution_options(isolation_level="REPEATABLE READ")
+
+
+def export_database(path, source=read_engine, block_rows=BLOCK_ROWS):
+    """Write every shop table to `path` as compressed column blocks.
+
+    Tables are streamed in primary key order, `block_rows` rows at a time,
+    from one consistent snapshot. Returns {table: rows}.
+    """
+    counts = {}
+    with open(path + ".part", "wb") as f, _snapshot(source) as connection:
+        f.write(MAGIC)
+        for table in Base.metadata.sorted_tables:
+            codes = [_code(column) for column in table.columns]
+            header = {"table": table.name, "columns": [[c.name, code] for c, code in zip(table.columns, codes)]}
+            _write_frame(f, TABLE, json.dumps(header).encode())
+            result = connection.execution_options(yield_per=block_rows).execute(
+                select(table).order_by(*table.primary_key.columns)
+            )
+            counts[table.name] = 0
+            for rows in result.partitions():
+                _write_frame(f, BLOCK, _pack_block(codes, rows))
+                counts[table.name] += len(rows)
+        _write_frame(f, END, json.dumps({"rows": counts}).encode())
+        connection.rollback()
+    os.replace(path + ".part", path)
+    return counts
+
+
+def read_export(path):
+    """Yield (table name, column names, rows as tuples) per block, then ("", None, {table: rows})"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a shop export")
+        table = names = codes = None
+        while True:
+            kind, payload = _read_frame(f)
+            if kind == TABLE:
+                header = json.loads(payload)
+                table = header["table"]
+                names = [name for name, _ in header["columns"]]
+                codes = [code for _, code in header["columns"]]
+            elif kind == BLOCK:
+                yield table, names, list(zip(*_unpack_block(codes, payload)))
+            elif kind == END:
+                yield "", None, json.loads(payload)["rows"]
+                return
+            else:
+                raise ValueError(f"unknown frame {kind!r} in {path}")
+
+
+def _reset_sequences(db):
+    """Point PostgreSQL id sequences past the loaded ids"""
+    for table in Base.metadata.sorted_tables:
+        key = list(table.primary_key.columns)
+        if len(key) == 1 and isinstance(key[0].type, Integer) and not key[0].foreign_keys:
+            db.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', '{key[0].name}'), "
+                f"COALESCE((SELECT MAX({key[0].name}) FROM {table.name}), 0) + 1, false)"
+            ))
+
+
+def load_export(path, target=engine):
+    """Load an export into a new, empty database; returns {table: rows}.
+
+    Tables are created bare and bulk loaded block by block; indexes and the
+    order total triggers are only created once the rows are in, so stored
+    order totals are kept as exported. The tables are built from the current
+    models, so the database is stamped at the newest migration. The row
+    counts are checked against the export's own.
+    """
+    existing = set(inspect(target).get_table_names()) & set(Base.metadata.tables)
+    if existing:
+        raise ValueError(f"the database already has shop tables ({', '.join(sorted(existing))}); "
+                         "load exports into a new database")
+    db = Session(bind=target)
+    try:
+        for table in Base.metadata.sorted_tables:
+            db.execute(CreateTable(table))
+        for name, columns, rows in read_export(path):
+            if not name:
+                expected = rows
+                break
+            copy_rows(db, Base.metadata.tables[name], [dict(zip(columns, row)) for row in rows], columns)
+
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.connection())
+        create_order_total_triggers(db.connection())
+        stamp_head(db.connection())
+        if target.dialect.name == "postgresql":
+            _reset_sequences(db)
+
+        loaded = {
+            table.name: db.execute(select(func.count()).select_from(table)).scalar()
+            for table in Base.metadata.sorted_tables if table.name in expected
+        }
+        if loaded != expected:
+            raise ValueError(f"Row counts differ after load: expected {expected}, got {loaded}")
+        db.commit()
+        return loaded
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
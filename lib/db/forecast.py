@@ -0,0 +1,134 @@
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from .models import Flower, Order, OrderItem, StockMovement
+
+# Forecast settings
+WINDOW_DAYS = 90          # days of order history used for velocity
+SHORT_WINDOW_DAYS = 7     # moving average window shown next to the smoothed rate
+SMOOTHING = 0.3           # exponential smoothing factor (higher reacts faster)
+LEAD_TIME_DAYS = 3        # days between placing and receiving a supplier order
+REVIEW_DAYS = 7           # days a restock should cover
+SERVICE_Z = 1.65          # safety stock for roughly a 95% service level
+
+Forecast = namedtuple("Forecast", [
+    "flower_id", "name", "quantity", "threshold",
+    "moving_average", "velocity", "reorder_point", "reorder_quantity",
+])
+
+# Sales statistics of one flower; stock on hand is read fresh every time
+Demand = namedtuple("Demand", ["moving_average", "velocity", "std"])
+
+_cache = {"signature": None, "key": None, "demand": None}
+
+
+def sales_signature(db):
+    """Changes whenever an order is completed or a completed order is undone.
+
+    Both write stock movements, so the newest movement id catches status
+    changes to old orders that leave the completed count and max id alone.
+    """
+    count, last_id = db.query(func.count(Order.id), func.max(Order.id)).filter(
+        Order.status == 'completed'
+    ).one()
+    return count, last_id, db.query(func.max(StockMovement.id)).scalar()
+
+
+def daily_sales(db, days=WINDOW_DAYS, today=None):
+    """Units sold per flower per day as {flower_id: [units, ...]}, oldest day first.
+
+    Aggregation happens in SQLite so only one row per flower and day comes
+    back, however many order items the window contains.
+    """
+    today = today or datetime.now().date()
+    start = today - timedelta(days=days - 1)
+    day = func.date(Order.created_at)
+
+    rows = db.query(
+        OrderItem.flower_id, day.label('day'), func.sum(OrderItem.quantity)
+    ).join(Order).filter(
+        Order.status == 'completed',
+        Order.created_at >= datetime.combine(start, datetime.min.time())
+    ).group_by(OrderItem.flower_id, day).all()
+
+    series = {}
+    for flower_id, sold_on, units in rows:
+        if isinstance(sold_on, str):  # SQLite's date() returns text
+            sold_on = datetime.strptime(sold_on, "%Y-%m-%d").date()
+        offset = (sold_on - start).days
+        if 0 <= offset < days:
+            series.setdefault(flower_id, [0] * days)[offset] += units or 0
+    return series
+
+
+def smoothed_rate(values, alpha=SMOOTHING):
+    """Exponentially smoothed daily rate of a series"""
+    rate = values[0] if values else 0
+    for value in values[1:]:
+        rate = alpha * value + (1 - alpha) * rate
+    return rate
+
+
+def _std(values):
+    if len(values) < 2:
+        return 0.0
+    mean = sum(values) / len(values)
+    return math.sqrt(sum((v - mean) ** 2 for v in values) / (len(values) - 1))
+
+
+def demand(values):
+    """Moving average, smoothed rate and spread of a flower's daily sales"""
+    recent = values[-SHORT_WINDOW_DAYS:]
+    moving_average = sum(recent) / len(recent) if recent else 0
+    return Demand(moving_average, smoothed_rate(values), _std(values))
+
+
+def forecast_flower(flower, sales, lead_time=LEAD_TIME_DAYS, review=REVIEW_DAYS):
+    """Suggest a reorder point and quantity for one flower from its Demand"""
+    safety_stock = SERVICE_Z * sales.std * math.sqrt(lead_time)
+
+    reorder_point = math.ceil(sales.velocity * lead_time + safety_stock)
+    target_stock = math.ceil(sales.velocity * (lead_time + review) + safety_stock)
+    reorder_quantity = max(0, target_stock - flower.quantity)
+
+    return Forecast(
+        flower.id, flower.name, flower.quantity, flower.low_stock_threshold,
+        round(sales.moving_average, 2), round(sales.velocity, 2), reorder_point, reorder_quantity,
+    )
+
+
+def sales_demand(db, days=WINDOW_DAYS):
+    """Demand per flower id, reused until sales change or the day turns"""
+    signature = sales_signature(db)
+    key = (days, datetime.now().date())
+    if _cache["signature"] != signature or _cache["key"] != key:
+        series = daily_sales(db, days)
+        _cache.update(signature=signature, key=key, demand={
+            flower_id: demand(values) for flower_id, values in series.items()
+        })
+    return _cache["demand"]
+
+
+def replenishment_forecast(db, days=WINDOW_DAYS, lead_time=LEAD_TIME_DAYS, review=REVIEW_DAYS):
+    """Forecast every flower against its current stock and threshold"""
+    sales = sales_demand(db, days)
+    no_sales = demand([0] * days)
+    return [
+        forecast_flower(flower, sales.get(flower.id, no_sales), lead_time, review)
+        for flower in db.query(Flower).order_by(Flower.name).all()
+    ]
+
+
+def apply_thresholds(db, forecasts):
+    """Write suggested reorder points back as low stock thresholds"""
+    updated = 0
+    for forecast in forecasts:
+        if forecast.reorder_point != forecast.threshold:
+            db.query(Flower).filter(Flower.id == forecast.flower_id).update(
+                {Flower.low_stock_threshold: forecast.reorder_point},
+                synchronize_session='fetch'
+            )
+            updated += 1
+    db.commit()
+    return updated
@@ -0,0 +1,210 @@
+import csv
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, case, func, literal, select
+from .models import Flower, FlowerPrice, StockMovement, local_now
+from .bulkload import copy_rows
+from .ledger import RESTOCK, ADJUST
+from .report_cache import mark_reports_stale
+from .metrics import STOCK_MOVEMENTS
+
+# Expected CSV header: flower,quantity,price
+# flower   - flower id or exact name
+# quantity - absolute count ("40"), a delta ("+12" / "-3"), or blank to keep
+# price    - new unit price, or blank to keep
+
+# Per-transaction staging table the planned changes are bulk loaded into
+STAGING = Table(
+    "stock_import", MetaData(),
+    Column("flower_id", Integer, primary_key=True),
+    Column("change", Integer, nullable=False),
+    Column("counted", Integer),     # stock-take count, set as is
+    Column("kind", String(20), nullable=False),
+    Column("new_price", Float),
+    prefixes=["TEMPORARY"],
+)
+
+# `counted` is True when new_quantity comes from a stock-take count rather
+# than deltas alone; it is then applied as an absolute quantity
+Change = namedtuple("Change", ["flower_id", "name", "old_quantity", "new_quantity", "old_price", "new_price",
+                               "counted"])
+
+
+class StockImportError(ValueError):
+    """Raised when a stock import file has invalid rows"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"{len(errors)} invalid rows")
+
+
+def _parse_quantity(value):
+    """Return (is_delta, amount) or None when the cell is blank"""
+    value = value.strip()
+    if not value:
+        return None
+    is_delta = value[0] in "+-"
+    amount = int(value)
+    if not is_delta and amount < 0:
+        raise ValueError("absolute quantity cannot be negative")
+    return is_delta, amount
+
+
+def _parse_price(value):
+    value = value.strip()
+    if not value:
+        return None
+    price = round(float(value), 2)
+    if price < 0:
+        raise ValueError("price cannot be negative")
+    return price
+
+
+def plan_import(db, lines):
+    """Validate every row of a stock CSV and return the resulting changes.
+
+    Rows are streamed from `lines` (any iterable of CSV lines, such as an open
+    file). Nothing is written; invalid rows raise StockImportError listing every
+    problem with its line number.
+    """
+    current = {
+        flower_id: [name, quantity, price, reserved]
+        for flower_id, name, quantity, price, reserved in db.query(
+            Flower.id, Flower.name, Flower.quantity, Flower.price, Flower.reserved
+        )
+    }
+    by_name = {}
+    for flower_id, (name, _, _, _) in current.items():
+        by_name.setdefault(name.lower(), []).append(flower_id)
+
+    planned = {}
+    errors = []
+    reader = csv.DictReader(lines)
+    missing = {"flower", "quantity", "price"} - set(reader.fieldnames or [])
+    if missing:
+        raise StockImportError([f"header: missing column(s) {', '.join(sorted(missing))}"])
+
+    for row in reader:
+        line = reader.line_num
+        key = (row["flower"] or "").strip()
+        if key.isdigit() and int(key) in current:
+            flower_id = int(key)
+        elif len(by_name.get(key.lower(), [])) == 1:
+            flower_id = by_name[key.lower()][0]
+        elif by_name.get(key.lower()):
+            errors.append(f"line {line}: '{key}' matches several flowers, use the ID")
+            continue
+        else:
+            errors.append(f"line {line}: unknown flower '{key}'")
+            continue
+
+        try:
+            quantity = _parse_quantity(row["quantity"] or "")
+            price = _parse_price(row["price"] or "")
+        except ValueError as e:
+            errors.append(f"line {line}: {str(e)}")
+            continue
+
+        name, old_quantity, old_price, reserved = current[flower_id]
+        new_quantity, new_price, counted = planned.get(flower_id, (old_quantity, old_price, False))
+        if quantity is not None:
+            is_delta, amount = quantity
+            new_quantity = new_quantity + amount if is_delta else amount
+            counted = counted or not is_delta
+        if new_quantity < 0:
+            errors.append(f"line {line}: stock of '{name}' would go below zero")
+            continue
+        if new_quantity < reserved:
+            errors.append(f"line {line}: stock of '{name}' would go below the {reserved} "
+                          "units pending orders hold")
+            continue
+        if price is not None:
+            new_price = price
+        planned[flower_id] = (new_quantity, new_price, counted)
+
+    if errors:
+        raise StockImportError(errors)
+
+    return [
+        Change(flower_id, current[flower_id][0], current[flower_id][1], new_quantity,
+               current[flower_id][2], new_price, counted)
+        for flower_id, (new_quantity, new_price, counted) in planned.items()
+        if counted or new_quantity != current[flower_id][1] or new_price != current[flower_id][2]
+    ]
+
+
+def apply_import(db, changes):
+    """Apply planned changes in one transaction with set-based statements.
+
+    The changes are bulk loaded (COPY on PostgreSQL) into a temporary
+    staging table, then one UPDATE ... FROM and INSERT ... SELECTs apply
+    them to flowers, the stock ledger and the price history. Counted
+    quantities are set as counted: with the flowers locked, the ledger
+    records the difference from the stock at that moment, whatever sold
+    since the plan. Raises StockImportError, writing nothing, if stock
+    would end up below what pending orders hold.
+    """
+    if not changes:
+        return 0
+    flowers = Flower.__table__
+    connection = db.connection()
+    STAGING.drop(connection, checkfirst=True)   # left over from a failed import
+    STAGING.create(connection)
+
+    copy_rows(db, STAGING, [
+        {
+            "flower_id": c.flower_id,
+            "change": c.new_quantity - c.old_quantity,
+            "counted": c.new_quantity if c.counted else None,
+            "kind": RESTOCK if c.new_quantity > c.old_quantity else ADJUST,
+            "new_price": c.new_price if c.new_price != c.old_price else None,
+        }
+        for c in changes
+    ])
+
+    # Lock the flowers in id order, as orders do, then measure the counts
+    # against the stock as it is now
+    db.execute(select(flowers.c.id).where(
+        flowers.c.id.in_(select(STAGING.c.flower_id))
+    ).order_by(flowers.c.id).with_for_update())
+    on_hand = select(flowers.c.quantity).where(flowers.c.id == STAGING.c.flower_id).scalar_subquery()
+    db.execute(STAGING.update().where(STAGING.c.counted.isnot(None)).values(change=STAGING.c.counted - on_hand))
+    db.execute(STAGING.update().values(kind=case((STAGING.c.change > 0, RESTOCK), else_=ADJUST)))
+    short = db.execute(select(flowers.c.name, flowers.c.reserved).where(
+        flowers.c.id == STAGING.c.flower_id,
+        flowers.c.quantity + STAGING.c.change < flowers.c.reserved
+    ).order_by(flowers.c.name)).all()
+    if short:
+        db.rollback()
+        raise StockImportError([
+            f"stock of '{name}' would go below the {reserved} units pending orders hold"
+            for name, reserved in short
+        ])
+
+    db.execute(flowers.update().where(flowers.c.id == STAGING.c.flower_id).values(
+        quantity=flowers.c.quantity + STAGING.c.change,
+        price=func.coalesce(STAGING.c.new_price, flowers.c.price)
+    ))
+    db.execute(StockMovement.__table__.insert().from_select(
+        ['flower_id', 'change', 'kind', 'note', 'created_at'],
+        select(
+            STAGING.c.flower_id, STAGING.c.change, STAGING.c.kind,
+            literal("csv import"), literal(datetime.now())
+        ).where(STAGING.c.change != 0)
+    ))
+    db.execute(FlowerPrice.__table__.insert().from_select(
+        ['flower_id', 'price', 'effective_from'],
+        select(
+            STAGING.c.flower_id, STAGING.c.new_price, local_now()
+        ).where(STAGING.c.new_price.isnot(None))
+    ))
+    kinds = db.execute(
+        select(STAGING.c.kind, func.count()).where(STAGING.c.change != 0).group_by(STAGING.c.kind)
+    ).all()
+    STAGING.drop(connection)
+
+    mark_reports_stale(db)
+    db.commit()
+    for kind, count in kinds:
+        STOCK_MOVEMENTS.labels(kind).inc(count)
+    return len(changes)
@@ -0,0 +1,150 @@
+from datetime import datetime
+from sqlalchemy import func, inspect
+from .models import Flower, StockMovement, StockCheckpoint
+from .metrics import STOCK_MOVEMENTS
+
+# Movement kinds
+SALE = 'sale'
+RESTOCK = 'restock'
+CANCEL_RETURN = 'cancel_return'
+ADJUST = 'adjust'
+
+CHECKPOINT_EVERY = 200    # movements per flower between checkpoints
+
+
+def record_movement(db, flower, change, kind, order_id=None, note=None):
+    """Change a flower's stock and append the matching ledger row.
+
+    Both land in the caller's session, so they are committed (or rolled
+    back) together with the rest of the caller's transaction. Stored
+    flowers are updated with `quantity = quantity + change` in SQL so
+    concurrent terminals cannot overwrite each other's stock changes.
+    """
+    if inspect(flower).persistent:
+        flower.quantity = Flower.quantity + change
+    else:
+        flower.quantity = (flower.quantity or 0) + change
+    movement = StockMovement(
+        flower=flower,
+        change=change,
+        kind=kind,
+        order_id=order_id,
+        note=note,
+        created_at=datetime.now()
+    )
+    db.add(movement)
+    db.flush()
+    STOCK_MOVEMENTS.labels(kind).inc()
+    return movement
+
+
+def set_quantity(db, flower, quantity, note=None):
+    """Set a flower's stock to an absolute count through the ledger"""
+    change = quantity - (flower.quantity or 0)
+    if change == 0:
+        return None
+    kind = RESTOCK if change > 0 else ADJUST
+    return record_movement(db, flower, change, kind, note=note)
+
+
+def _latest_checkpoint(db, flower_id, when=None):
+    query = db.query(StockCheckpoint).filter(StockCheckpoint.flower_id == flower_id)
+    if when is not None:
+        query = query.filter(StockCheckpoint.created_at <= when)
+    return query.order_by(StockCheckpoint.created_at.desc(), StockCheckpoint.id.desc()).first()
+
+
+def stock_at(db, flower_id, when=None):
+    """Stock of a flower at time `when` (now if omitted).
+
+    Starts from the nearest checkpoint at or before `when` and only sums
+    the movements recorded after it.
+    """
+    checkpoint = _latest_checkpoint(db, flower_id, when)
+    balance = checkpoint.balance if checkpoint else 0
+    after_id = checkpoint.movement_id if checkpoint else 0
+
+    query = db.query(func.coalesce(func.sum(StockMovement.change), 0)).filter(
+        StockMovement.flower_id == flower_id,
+        StockMovement.id > after_id
+    )
+    if when is not None:
+        query = query.filter(StockMovement.created_at <= when)
+    return balance + query.scalar()
+
+
+def ledger_balances(db):
+    """Current ledger balance of every flower as {flower_id: balance}"""
+    latest = db.query(
+        StockCheckpoint.flower_id, func.max(StockCheckpoint.movement_id).label('movement_id')
+    ).group_by(StockCheckpoint.flower_id).subquery()
+    balances = {
+        flower_id: balance
+        for flower_id, balance in db.query(StockCheckpoint.flower_id, StockCheckpoint.balance).join(
+            latest, (StockCheckpoint.flower_id == latest.c.flower_id)
+            & (StockCheckpoint.movement_id == latest.c.movement_id)
+        )
+    }
+
+    recent = db.query(
+        StockMovement.flower_id, func.sum(StockMovement.change)
+    ).outerjoin(latest, StockMovement.flower_id == latest.c.flower_id).filter(
+        StockMovement.id > func.coalesce(latest.c.movement_id, 0)
+    ).group_by(StockMovement.flower_id)
+    for flower_id, change in recent:
+        balances[flower_id] = balances.get(flower_id, 0) + change
+    return balances
+
+
+def write_checkpoints(db, min_movements=CHECKPOINT_EVERY):
+    """Checkpoint every flower with at least `min_movements` uncheckpointed movements"""
+    written = 0
+    for flower_id, in db.query(Flower.id).all():
+        checkpoint = _latest_checkpoint(db, flower_id)
+        after_id = checkpoint.movement_id if checkpoint else 0
+        pending = db.query(
+            func.count(StockMovement.id), func.max(StockMovement.id), func.sum(StockMovement.change)
+        ).filter(
+            StockMovement.flower_id == flower_id,
+            StockMovement.id > after_id
+        ).one()
+        count, last_id, change = pending
+        if not count or count < min_movements:
+            continue
+
+        last = db.query(StockMovement).get(last_id)
+        db.add(StockCheckpoint(
+            flower_id=flower_id,
+            movement_id=last_id,
+            balance=(checkpoint.balance if checkpoint else 0) + change,
+            created_at=last.created_at
+        ))
+        written += 1
+    db.commit()
+    return written
+
+
+def reconcile(db, fix=False):
+    """Compare the ledger with Flower.quantity and return the mismatches.
+
+    Each mismatch is (flower, ledger balance). With `fix`, an adjustment is
+    appended so the ledger agrees with the stock on hand.
+    """
+    balances = ledger_balances(db)
+    mismatches = []
+    for flower in db.query(Flower).order_by(Flower.name).all():
+        balance = balances.get(flower.id, 0)
+        if balance != flower.quantity:
+            mismatches.append((flower, balance))
+
+    if fix and mismatches:
+        for flower, balance in mismatches:
+            db.add(StockMovement(
+                flower_id=flower.id,
+                change=flower.quantity - balance,
+                kind=ADJUST,
+                note="reconciliation",
+                created_at=datetime.now()
+            ))
+        db.commit()
+    return mismatches
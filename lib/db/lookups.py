@@ -0,0 +1,35 @@
+from sqlalchemy import bindparam, select
+from .models import Flower, Customer, Order
+
+# Prebuilt statements for the lookups every screen makes. Each statement is
+# constructed once at import time, so a call only binds a new id; SQLAlchemy
+# memoizes the statement's cache key and reuses its compiled SQL from the
+# engine's query cache (sized in session.py). Run `python lib/benchmarks.py
+# lookups` for the per-call cost against db.query(...).get().
+
+FLOWER_BY_ID = select(Flower).where(Flower.id == bindparam('id'))
+CUSTOMER_BY_ID = select(Customer).where(Customer.id == bindparam('id'))
+ORDER_BY_ID = select(Order).where(Order.id == bindparam('id'))
+ORDER_ROWS_BY_ID = select(
+    Order.id, Customer.name, Order.created_at, Order.total, Order.status
+).outerjoin(Customer, Order.customer_id == Customer.id).where(Order.id == bindparam('id'))
+
+
+def get_flower(db, flower_id):
+    """Flower by primary key, or None"""
+    return db.execute(FLOWER_BY_ID, {"id": flower_id}).scalar()
+
+
+def get_customer(db, customer_id):
+    """Customer by primary key, or None"""
+    return db.execute(CUSTOMER_BY_ID, {"id": customer_id}).scalar()
+
+
+def get_order(db, order_id):
+    """Order by primary key, or None"""
+    return db.execute(ORDER_BY_ID, {"id": order_id}).scalar()
+
+
+def order_rows_by_id(db, order_id):
+    """(id, customer name, created_at, total, status) rows for one order id"""
+    return db.execute(ORDER_ROWS_BY_ID, {"id": order_id}).all()
@@ -0,0 +1,120 @@
+import time
+from collections import namedtuple
+from sqlalchemy.exc import OperationalError
+from .session import engine
+from .scheduler import Scheduler
+
+# Maintenance settings
+MAINTENANCE_SCHEDULE = "30 3 * * *"   # nightly, when the shop is closed
+VACUUM_STEP = 1000                     # free pages returned to the OS per transaction
+STEP_SLEEP = 0.05                      # seconds to yield to writers between vacuum steps
+
+INCREMENTAL = 2                        # PRAGMA auto_vacuum value for INCREMENTAL
+
+Stats = namedtuple("Stats", ["page_size", "page_count", "freelist_count", "objects"])
+Report = namedtuple("Report", ["before", "after", "integrity", "analyzed", "vacuumed", "checkpoint", "seconds"])
+
+
+def _pragma(connection, name):
+    return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+
+def database_stats(connection):
+    """Page counts and bytes per table and index.
+
+    Object sizes come from the dbstat virtual table and are empty when
+    SQLite was built without it.
+    """
+    try:
+        objects = dict(connection.exec_driver_sql(
+            "SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY SUM(pgsize) DESC"
+        ).all())
+    except OperationalError:
+        objects = {}
+    return Stats(
+        _pragma(connection, "page_size"),
+        _pragma(connection, "page_count"),
+        _pragma(connection, "freelist_count"),
+        objects
+    )
+
+
+def integrity_problems(connection):
+    """Problems reported by PRAGMA integrity_check; empty when the file is sound"""
+    rows = [row for row, in connection.exec_driver_sql("PRAGMA integrity_check")]
+    return [] if rows == ["ok"] else rows
+
+
+def analyze(connection):
+    """Refresh planner statistics; returns True if a full ANALYZE ran.
+
+    The first run, with no sqlite_stat1 yet, analyzes everything;
+    afterwards PRAGMA optimize only re-analyzes tables that have changed
+    enough to matter.
+    """
+    has_stats = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).scalar()
+    connection.exec_driver_sql("PRAGMA optimize" if has_stats else "ANALYZE")
+    connection.commit()
+    return not has_stats
+
+
+def incremental_vacuum(connection, step=VACUUM_STEP, sleep=STEP_SLEEP):
+    """Return free pages to the OS `step` pages per transaction; returns pages freed.
+
+    Needs auto_vacuum=INCREMENTAL, which the migrations set; without it
+    nothing is done and None is returned.
+    """
+    if _pragma(connection, "auto_vacuum") != INCREMENTAL:
+        return None
+    freed = 0
+    while True:
+        free = _pragma(connection, "freelist_count")
+        if not free:
+            connection.commit()
+            return freed
+        # Each step of the statement frees one page, and only sqlite3_exec
+        # (executescript) steps it to the end
+        connection.commit()
+        connection.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({min(step, free)})")
+        freed += free - _pragma(connection, "freelist_count")
+        time.sleep(sleep)
+
+
+def checkpoint(connection):
+    """Copy the WAL into the database and truncate it: (busy, wal pages, pages checkpointed)
+
+    TRUNCATE reports zeros once the log is reset, so a PASSIVE checkpoint
+    runs first to count the pages.
+    """
+    busy, wal_pages, checkpointed = connection.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)").one()
+    truncated_busy = connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").one()[0]
+    return bool(busy or truncated_busy), wal_pages, checkpointed
+
+
+def run_maintenance(vacuum=True):
+    """ANALYZE, vacuum, checkpoint and check the live SQLite database.
+
+    Each step commits on its own, so the shop can keep selling while it
+    runs. Returns a Report with the stats before and after.
+    """
+    if engine.dialect.name != "sqlite":
+        raise ValueError("maintenance is for SQLite; PostgreSQL's autovacuum analyzes and vacuums")
+    started = time.perf_counter()
+    with engine.connect() as connection:
+        before = database_stats(connection)
+        problems = integrity_problems(connection)
+        analyzed = analyze(connection)
+        vacuumed = incremental_vacuum(connection) if vacuum else 0
+        wal = checkpoint(connection)
+        after = database_stats(connection)
+        connection.commit()
+    return Report(before, after, problems, analyzed, vacuumed, wal, time.perf_counter() - started)
+
+
+def start_maintenance(spec=MAINTENANCE_SCHEDULE):
+    """Run maintenance in the background on `spec`; returns the Scheduler"""
+    scheduler = Scheduler("maintenance")
+    scheduler.add("maintenance", spec, run_maintenance)
+    return scheduler.start()
@@ -0,0 +1,294 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import event
+
+# Latency buckets in seconds, upper bounds (Prometheus "le")
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("counts", "sum", "_lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+
+class _Metric:
+    kind = None
+    child_class = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Child for one combination of label values; keep it for hot paths"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self.child_class())
+        return child
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+    child_class = _CounterChild
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{_label_text(self.labelnames, values)} {child.value}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    child_class = _HistogramChild
+
+    def observe(self, seconds):
+        self.labels().observe(seconds)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _label_text(self.labelnames + ("le",), values + (le,))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _label_text(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {child.sum}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge(_Metric):
+    """Value read from a callback when metrics are collected"""
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._callbacks = {}
+
+    def set_function(self, func, *values):
+        self._callbacks[values] = func
+
+    def samples(self):
+        for values, func in list(self._callbacks.items()):
+            yield f"{self.name}{_label_text(self.labelnames, values)} {func()}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=()):
+        return self.register(Histogram(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Shop operations
+ORDERS_PLACED = registry.counter(
+    "myshop_orders_placed_total", "Orders submitted, by result", ["result"])
+ORDER_SECONDS = registry.histogram(
+    "myshop_place_order_seconds", "Time to place and commit an order")
+STATUS_CHANGES = registry.counter(
+    "myshop_order_status_changes_total", "Orders moved to a new status", ["status"])
+STATUS_CHANGE_SECONDS = registry.histogram(
+    "myshop_order_status_change_seconds", "Time to change one order's status, or a bulk change", ["mode"])
+STOCK_MOVEMENTS = registry.counter(
+    "myshop_stock_movements_total", "Stock ledger movements recorded", ["kind"])
+SEARCHES = registry.counter(
+    "myshop_searches_total", "Searches run", ["kind"])
+SEARCH_SECONDS = registry.histogram(
+    "myshop_search_first_result_seconds", "Time until a search returns its first row", ["kind"])
+REPORT_RUNS = registry.counter(
+    "myshop_report_runs_total", "Report computations, by report and outcome", ["report", "status"])
+REPORT_SECONDS = registry.histogram(
+    "myshop_report_seconds", "Time to compute a report", ["report"])
+JOB_RUNS = registry.counter(
+    "myshop_scheduled_job_runs_total", "Background job runs, by job and outcome", ["job", "status"])
+JOB_SECONDS = registry.histogram(
+    "myshop_scheduled_job_seconds", "Time a background job run takes", ["job"])
+
+# Database
+DB_STATEMENTS = registry.counter(
+    "myshop_db_statements_total", "SQL statements executed (on SQLite including BEGIN and COMMIT)", ["engine"])
+DB_POOL_CHECKED_OUT = registry.gauge(
+    "myshop_db_pool_checked_out", "Connections currently checked out of the pool", ["engine"])
+DB_POOL_SIZE = registry.gauge(
+    "myshop_db_pool_connections", "Connections currently held by the pool", ["engine"])
+
+
+def timed(histogram, *labels):
+    """Decorator observing how long each call takes"""
+    child = histogram.labels(*labels)
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+_END = object()
+
+
+def searched(kind, rows):
+    """Pass search results through, counting the search and timing its first row"""
+    SEARCHES.labels(kind).inc()
+    started = time.perf_counter()
+    rows = iter(rows)
+    first = next(rows, _END)
+    SEARCH_SECONDS.labels(kind).observe(time.perf_counter() - started)
+    if first is not _END:
+        yield first
+        yield from rows
+
+
+def instrument_engine(engine, name):
+    """Count every statement on `engine` and export its pool state.
+
+    On SQLite statements are counted by the trace callback, which is far
+    cheaper than SQLAlchemy's cursor events; per-statement timing would
+    cost more than the primary key lookups it measures. Other databases
+    pay a network round trip per statement, so a cursor event is fine.
+    """
+    statements = DB_STATEMENTS.labels(name)
+
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _trace(dbapi_connection, connection_record):
+            dbapi_connection.set_trace_callback(lambda sql: statements.inc())
+    else:
+        @event.listens_for(engine, "after_cursor_execute")
+        def _count(conn, cursor, statement, parameters, context, executemany):
+            statements.inc()
+
+    pool = engine.pool
+    if hasattr(pool, "checkedout"):
+        DB_POOL_CHECKED_OUT.set_function(pool.checkedout, name)
+        DB_POOL_SIZE.set_function(lambda: pool.checkedin() + pool.checkedout(), name)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # keep the menus free of access logs
+
+
+def serve(port, host="127.0.0.1"):
+    """Serve /metrics on a local port from a background thread; returns the server"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def write_textfile(path):
+    """Write the metrics file atomically, for node_exporter's textfile collector"""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(registry.render())
+    os.replace(tmp, path)
+
+
+class TextfileWriter:
+    """Background thread that rewrites the metrics file every `interval` seconds"""
+
+    def __init__(self, path, interval=15):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-textfile", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        write_textfile(self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            write_textfile(self.path)
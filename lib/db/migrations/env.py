@@ -1,3 +1,4 @@
+import os
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
@@ -21,6 +22,16 @@ if config.config_file_name is not None:
 from models import Base
 target_metadata = Base.metadata
 
+# Same override as db/session.py, so migrations can target PostgreSQL
+if os.environ.get("MYSHOP_DATABASE_URL"):
+    config.set_main_option("sqlalchemy.url", os.environ["MYSHOP_DATABASE_URL"].replace("%", "%%"))
+
+
+def include_name(name, type_, parent_names):
+    # backfill progress is bookkeeping for migrations, not part of the models
+    return not (type_ == "table" and name == "backfill_progress")
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -45,6 +56,8 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_name=include_name,
+        transaction_per_migration=True,
     )
 
     with context.begin_transaction():
@@ -65,8 +78,11 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
+        # One transaction per revision, so migrations with autocommit blocks
+        # (chunked backfills, VACUUM) leave the earlier ones stamped
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata,
+            include_name=include_name, transaction_per_migration=True
         )
 
         with context.begin_transaction():
@@ -0,0 +1,39 @@
+"""adds report snapshots
+
+Revision ID: 01d1116929f1
+Revises: 4bcedf08d1f9
+Create Date: 2026-10-19 01:59:48.724286
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '01d1116929f1'
+down_revision: Union[str, None] = '4bcedf08d1f9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('report_snapshots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('report', sa.String(length=50), nullable=False),
+    sa.Column('params', sa.String(length=200), nullable=True),
+    sa.Column('signature', sa.String(length=100), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('duration_ms', sa.Integer(), nullable=True),
+    sa.Column('data', sa.Text(), nullable=True),
+    sa.Column('error', sa.String(length=200), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_report_snapshots_report_started_at', 'report_snapshots', ['report', 'started_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_report_snapshots_report_started_at', table_name='report_snapshots')
+    op.drop_table('report_snapshots')
@@ -0,0 +1,41 @@
+"""sets incremental auto vacuum
+
+Revision ID: 0750793e6ac8
+Revises: 35199017f815
+Create Date: 2026-10-19 02:23:10.352887
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0750793e6ac8'
+down_revision: Union[str, None] = '35199017f815'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _is_sqlite():
+    return op.get_context().dialect.name == 'sqlite'
+
+
+def _set_auto_vacuum(mode):
+    # auto_vacuum only changes when the file is rebuilt, and VACUUM cannot
+    # run inside a transaction
+    with op.get_context().autocommit_block():
+        op.execute(f"PRAGMA auto_vacuum={mode}")
+        op.execute("VACUUM")
+
+
+def upgrade() -> None:
+    # PostgreSQL has no equivalent; autovacuum already reclaims space
+    if _is_sqlite():
+        _set_auto_vacuum("INCREMENTAL")
+
+
+def downgrade() -> None:
+    if _is_sqlite():
+        _set_auto_vacuum("NONE")
@@ -0,0 +1,75 @@
+"""prices order totals from price history
+
+Revision ID: 3cd72ffb082b
+Revises: 7f2f02fdbb74
+Create Date: 2026-10-19 09:41:06.207154
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3cd72ffb082b'
+down_revision: Union[str, None] = '7f2f02fdbb74'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Each line at the price in effect when its order was placed
+HISTORIC_PRICE = """COALESCE((
+            SELECT flower_prices.price FROM flower_prices
+            WHERE flower_prices.flower_id = order_items.flower_id
+              AND flower_prices.effective_from <= orders.created_at
+            ORDER BY flower_prices.effective_from DESC, flower_prices.id DESC LIMIT 1
+        ), flowers.price)"""
+
+ORDER_TOTAL_SQL = """
+    UPDATE orders SET total = (
+        SELECT COALESCE(SUM(order_items.quantity * {price}), 0)
+        FROM order_items JOIN flowers ON flowers.id = order_items.flower_id
+        WHERE order_items.order_id = {order_id}
+    ) WHERE id = {order_id};
+"""
+
+TRIGGERS = {
+    'order_items_total_insert': ("AFTER INSERT ON order_items BEGIN", ["NEW.order_id"]),
+    'order_items_total_update': ("AFTER UPDATE OF order_id, flower_id, quantity ON order_items BEGIN",
+                                 ["OLD.order_id", "NEW.order_id"]),
+    'order_items_total_delete': ("AFTER DELETE ON order_items BEGIN", ["OLD.order_id"]),
+}
+
+
+def _is_postgresql():
+    return op.get_context().dialect.name == 'postgresql'
+
+
+def _total_sql(price, order_id):
+    return ORDER_TOTAL_SQL.format(price=price, order_id=order_id)
+
+
+def _create_triggers(price):
+    # Existing totals are left as they are; only later item changes use
+    # the new pricing
+    if _is_postgresql():
+        op.execute(
+            "CREATE OR REPLACE FUNCTION order_items_total() RETURNS trigger AS $$ BEGIN "
+            "IF TG_OP <> 'INSERT' THEN" + _total_sql(price, "OLD.order_id") + "END IF; "
+            "IF TG_OP <> 'DELETE' THEN" + _total_sql(price, "NEW.order_id") + "END IF; "
+            "RETURN NULL; END $$ LANGUAGE plpgsql"
+        )
+        return
+    for name, (event, order_ids) in TRIGGERS.items():
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
+        op.execute(f"CREATE TRIGGER {name} {event}"
+                   + "".join(_total_sql(price, order_id) for order_id in order_ids) + "END")
+
+
+def upgrade() -> None:
+    _create_triggers(HISTORIC_PRICE)
+
+
+def downgrade() -> None:
+    _create_triggers("flowers.price")
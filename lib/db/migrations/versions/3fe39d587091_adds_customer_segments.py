@@ -0,0 +1,42 @@
+"""adds customer segments
+
+Revision ID: 3fe39d587091
+Revises: f620220f6a29
+Create Date: 2026-10-19 01:53:44.817958
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3fe39d587091'
+down_revision: Union[str, None] = 'f620220f6a29'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('customer_segments',
+    sa.Column('customer_id', sa.Integer(), nullable=False),
+    sa.Column('last_order_at', sa.DateTime(), nullable=False),
+    sa.Column('last_order_id', sa.Integer(), nullable=False),
+    sa.Column('recency_days', sa.Integer(), nullable=True),
+    sa.Column('frequency', sa.Integer(), nullable=False),
+    sa.Column('monetary', sa.Float(), nullable=False),
+    sa.Column('r_score', sa.Integer(), nullable=True),
+    sa.Column('f_score', sa.Integer(), nullable=True),
+    sa.Column('m_score', sa.Integer(), nullable=True),
+    sa.Column('segment', sa.String(length=20), nullable=True),
+    sa.Column('computed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['customer_id'], ['customers.id'], ),
+    sa.PrimaryKeyConstraint('customer_id')
+    )
+    op.create_index(op.f('ix_customer_segments_segment'), 'customer_segments', ['segment'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_customer_segments_segment'), table_name='customer_segments')
+    op.drop_table('customer_segments')
@@ -0,0 +1,89 @@
+"""moves order totals and timestamps into the database
+
+Revision ID: 4bcedf08d1f9
+Revises: 3fe39d587091
+Create Date: 2026-10-19 01:57:44.356909
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4bcedf08d1f9'
+down_revision: Union[str, None] = '3fe39d587091'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+ORDER_TOTAL_SQL = """
+    UPDATE orders SET total = (
+        SELECT COALESCE(SUM(order_items.quantity * flowers.price), 0)
+        FROM order_items JOIN flowers ON flowers.id = order_items.flower_id
+        WHERE order_items.order_id = {order_id}
+    ) WHERE id = {order_id};
+"""
+
+TRIGGERS = {
+    'order_items_total_insert': "AFTER INSERT ON order_items BEGIN"
+        + ORDER_TOTAL_SQL.format(order_id="NEW.order_id") + "END",
+    'order_items_total_update': "AFTER UPDATE ON order_items BEGIN"
+        + ORDER_TOTAL_SQL.format(order_id="OLD.order_id")
+        + ORDER_TOTAL_SQL.format(order_id="NEW.order_id") + "END",
+    'order_items_total_delete': "AFTER DELETE ON order_items BEGIN"
+        + ORDER_TOTAL_SQL.format(order_id="OLD.order_id") + "END",
+}
+
+PG_FUNCTION = (
+    "CREATE OR REPLACE FUNCTION order_items_total() RETURNS trigger AS $$ BEGIN "
+    "IF TG_OP <> 'INSERT' THEN" + ORDER_TOTAL_SQL.format(order_id="OLD.order_id") + "END IF; "
+    "IF TG_OP <> 'DELETE' THEN" + ORDER_TOTAL_SQL.format(order_id="NEW.order_id") + "END IF; "
+    "RETURN NULL; END $$ LANGUAGE plpgsql"
+)
+
+
+def _is_postgresql():
+    return op.get_context().dialect.name == 'postgresql'
+
+
+def upgrade() -> None:
+    op.execute("UPDATE orders SET total = 0 WHERE total IS NULL")
+    now = "LOCALTIMESTAMP" if _is_postgresql() else "(datetime('now', 'localtime'))"
+    with op.batch_alter_table('orders') as batch_op:
+        batch_op.alter_column('total', existing_type=sa.Float(), nullable=False,
+                              server_default='0')
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(),
+                              server_default=sa.text(now))
+
+    if _is_postgresql():
+        op.execute(PG_FUNCTION)
+        op.execute("CREATE TRIGGER order_items_total AFTER INSERT OR UPDATE OR DELETE ON order_items "
+                   "FOR EACH ROW EXECUTE FUNCTION order_items_total()")
+    else:
+        for name, body in TRIGGERS.items():
+            op.execute(f"CREATE TRIGGER {name} {body}")
+
+    # Orders keep the total they were sold at; today's prices would rewrite
+    # history. Only totals that were never recorded are computed from items.
+    op.execute("""
+        UPDATE orders SET total = (
+            SELECT COALESCE(SUM(order_items.quantity * flowers.price), 0)
+            FROM order_items JOIN flowers ON flowers.id = order_items.flower_id
+            WHERE order_items.order_id = orders.id
+        ) WHERE total = 0
+          AND EXISTS (SELECT 1 FROM order_items WHERE order_items.order_id = orders.id)
+    """)
+
+
+def downgrade() -> None:
+    if _is_postgresql():
+        op.execute("DROP TRIGGER IF EXISTS order_items_total ON order_items")
+        op.execute("DROP FUNCTION IF EXISTS order_items_total()")
+    else:
+        for name in TRIGGERS:
+            op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    with op.batch_alter_table('orders') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), server_default=None)
+        batch_op.alter_column('total', existing_type=sa.Float(), nullable=True, server_default=None)
@@ -0,0 +1,55 @@
+"""limits order total update trigger
+
+Revision ID: 7f2f02fdbb74
+Revises: 9217f44b469f
+Create Date: 2026-10-19 09:12:40.518227
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7f2f02fdbb74'
+down_revision: Union[str, None] = '9217f44b469f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+ORDER_TOTAL_SQL = """
+    UPDATE orders SET total = (
+        SELECT COALESCE(SUM(order_items.quantity * flowers.price), 0)
+        FROM order_items JOIN flowers ON flowers.id = order_items.flower_id
+        WHERE order_items.order_id = {order_id}
+    ) WHERE id = {order_id};
+"""
+
+UPDATE_BODY = (ORDER_TOTAL_SQL.format(order_id="OLD.order_id")
+               + ORDER_TOTAL_SQL.format(order_id="NEW.order_id") + "END")
+
+
+def _is_postgresql():
+    return op.get_context().dialect.name == 'postgresql'
+
+
+def _replace_update_trigger(columns):
+    # Any UPDATE of order_items re-summed its order, so backfilling an
+    # unrelated column rewrote totals; only item changes should
+    if _is_postgresql():
+        op.execute("DROP TRIGGER IF EXISTS order_items_total ON order_items")
+        op.execute(f"CREATE TRIGGER order_items_total AFTER INSERT OR UPDATE{columns} OR DELETE "
+                   "ON order_items FOR EACH ROW EXECUTE FUNCTION order_items_total()")
+    else:
+        op.execute("DROP TRIGGER IF EXISTS order_items_total_update")
+        op.execute(f"CREATE TRIGGER order_items_total_update AFTER UPDATE{columns} ON order_items BEGIN"
+                   + UPDATE_BODY)
+
+
+def upgrade() -> None:
+    _replace_update_trigger(" OF order_id, flower_id, quantity")
+
+
+def downgrade() -> None:
+    _replace_update_trigger("")
@@ -0,0 +1,84 @@
+"""reserves stock for pending orders
+
+Revision ID: 9217f44b469f
+Revises: 2bef328bbef5
+Create Date: 2026-10-19 02:59:30.094163
+
+"""
+from datetime import datetime, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9217f44b469f'
+down_revision: Union[str, None] = '2bef328bbef5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+RESERVATION_TTL = timedelta(hours=48)   # as in db/reservations.py
+
+reservations = sa.table('reservations',
+    sa.column('order_id', sa.Integer()),
+    sa.column('flower_id', sa.Integer()),
+    sa.column('quantity', sa.Integer()),
+    sa.column('expires_at', sa.DateTime()),
+    sa.column('created_at', sa.DateTime()),
+)
+
+
+def upgrade() -> None:
+    # Pending orders placed before reservations existed hold nothing. Reserve
+    # their items oldest order first, capped at the free stock; whatever
+    # cannot be covered is reported and checked again on completion
+    if op.get_context().as_sql:
+        return  # the caps depend on the data; run this revision online
+    connection = op.get_bind()
+    free = {}
+    names = {}
+    for flower_id, name, available in connection.execute(sa.text(
+        "SELECT id, name, quantity - reserved FROM flowers"
+    )):
+        free[flower_id] = max(0, available)
+        names[flower_id] = name
+
+    wanted = connection.execute(sa.text("""
+        SELECT order_items.order_id, order_items.flower_id, SUM(order_items.quantity)
+        FROM order_items JOIN orders ON orders.id = order_items.order_id
+        WHERE orders.status = 'pending'
+          AND NOT EXISTS (SELECT 1 FROM reservations WHERE reservations.order_id = orders.id)
+        GROUP BY order_items.order_id, order_items.flower_id
+        ORDER BY order_items.order_id, order_items.flower_id
+    """)).fetchall()
+
+    now = datetime.now()
+    rows, held, short = [], {}, {}
+    for order_id, flower_id, units in wanted:
+        units = units or 0
+        taken = min(units, free.get(flower_id, 0))
+        if taken:
+            rows.append({"order_id": order_id, "flower_id": flower_id, "quantity": taken,
+                         "created_at": now, "expires_at": now + RESERVATION_TTL})
+            free[flower_id] -= taken
+            held[flower_id] = held.get(flower_id, 0) + taken
+        if taken < units:
+            short[flower_id] = short.get(flower_id, 0) + units - taken
+
+    if rows:
+        op.bulk_insert(reservations, rows)
+    for flower_id, units in held.items():
+        connection.execute(sa.text("UPDATE flowers SET reserved = reserved + :units WHERE id = :id"),
+                           {"units": units, "id": flower_id})
+
+    print(f"  Reserved stock for {len({row['order_id'] for row in rows})} pending orders")
+    for flower_id, units in sorted(short.items()):
+        print(f"  {names.get(flower_id, flower_id)}: pending orders want {units} more than is in stock")
+
+
+def downgrade() -> None:
+    # The reservations made here are like any other: they are released when
+    # their order leaves pending or expires
+    pass
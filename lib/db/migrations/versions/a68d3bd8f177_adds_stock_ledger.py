@@ -0,0 +1,60 @@
+"""adds stock ledger
+
+Revision ID: a68d3bd8f177
+Revises: fc97dfe08daf
+Create Date: 2026-10-19 01:48:56.978307
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a68d3bd8f177'
+down_revision: Union[str, None] = 'fc97dfe08daf'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('stock_movements',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('flower_id', sa.Integer(), nullable=False),
+    sa.Column('change', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=True),
+    sa.Column('note', sa.String(length=100), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['flower_id'], ['flowers.id'], ),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_stock_movements_flower_id_id', 'stock_movements', ['flower_id', 'id'], unique=False)
+    op.create_table('stock_checkpoints',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('flower_id', sa.Integer(), nullable=False),
+    sa.Column('movement_id', sa.Integer(), nullable=False),
+    sa.Column('balance', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['flower_id'], ['flowers.id'], ),
+    sa.ForeignKeyConstraint(['movement_id'], ['stock_movements.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_stock_checkpoints_flower_id_created_at', 'stock_checkpoints', ['flower_id', 'created_at'], unique=False)
+
+    # Open the ledger with the stock currently on hand, stamped in local
+    # time like every other movement (CURRENT_TIMESTAMP is UTC on SQLite)
+    now = "LOCALTIMESTAMP" if op.get_context().dialect.name == 'postgresql' else "datetime('now', 'localtime')"
+    op.execute(
+        "INSERT INTO stock_movements (flower_id, change, kind, note, created_at) "
+        f"SELECT id, quantity, 'adjust', 'opening balance', {now} FROM flowers"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_stock_checkpoints_flower_id_created_at', table_name='stock_checkpoints')
+    op.drop_table('stock_checkpoints')
+    op.drop_index('ix_stock_movements_flower_id_id', table_name='stock_movements')
+    op.drop_table('stock_movements')
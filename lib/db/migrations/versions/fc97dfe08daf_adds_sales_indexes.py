@@ -0,0 +1,30 @@
+"""adds sales indexes
+
+Revision ID: fc97dfe08daf
+Revises: f8790385bbe5
+Create Date: 2026-10-19 01:47:34.335373
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'fc97dfe08daf'
+down_revision: Union[str, None] = 'f8790385bbe5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_orders_status_created_at', 'orders', ['status', 'created_at'], unique=False)
+    op.create_index('ix_order_items_order_id', 'order_items', ['order_id'], unique=False)
+    op.create_index('ix_order_items_flower_id', 'order_items', ['flower_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_order_items_flower_id', table_name='order_items')
+    op.drop_index('ix_order_items_order_id', table_name='order_items')
+    op.drop_index('ix_orders_status_created_at', table_name='orders')
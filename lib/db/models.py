@@ -1,9 +1,24 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index, Text, DDL, event, text
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy.sql.expression import FunctionElement
 from datetime import datetime
 
 Base = declarative_base()
 
+class local_now(FunctionElement):
+    """Current local time, evaluated by the database"""
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(local_now)
+def _local_now(element, compiler, **kw):
+    return "LOCALTIMESTAMP"
+
+@compiles(local_now, 'sqlite')
+def _local_now_sqlite(element, compiler, **kw):
+    return "(datetime('now', 'localtime'))"
+
 class Flower(Base):
     __tablename__ = 'flowers'
     id = Column(Integer, primary_key=True)
@@ -12,12 +27,19 @@ class Flower(Base):
     quantity = Column(Integer, nullable=False)
     category = Column(String(50))
     low_stock_threshold = Column(Integer, default=10)
+    reserved = Column(Integer, nullable=False, default=0, server_default='0')  # held by pending orders
     
     order_items = relationship("OrderItem", back_populates="flower")
 
     def is_low_stock(self):
         return self.quantity < self.low_stock_threshold
 
+    def available(self):
+        return self.quantity - self.reserved
+
+# Availability checks compare against this expression
+Index('ix_flowers_available', Flower.quantity - Flower.reserved)
+
 class Customer(Base):
     __tablename__ = 'customers'
     id = Column(Integer, primary_key=True)
@@ -30,8 +52,8 @@ class Customer(Base):
 class OrderItem(Base):
     __tablename__ = 'order_items'
     id = Column(Integer, primary_key=True)
-    order_id = Column(Integer, ForeignKey('orders.id'))
-    flower_id = Column(Integer, ForeignKey('flowers.id'))
+    order_id = Column(Integer, ForeignKey('orders.id'), index=True)
+    flower_id = Column(Integer, ForeignKey('flowers.id'), index=True)
     quantity = Column(Integer)
     
     order = relationship("Order", back_populates="items")
@@ -42,8 +64,167 @@ class Order(Base):
     id = Column(Integer, primary_key=True)
     customer_id = Column(Integer, ForeignKey('customers.id'))
     status = Column(String(20), default='pending')
-    total = Column(Float)
-    created_at = Column(DateTime, default=datetime)
+    total = Column(Float, nullable=False, server_default='0')  # maintained by order_items triggers
+    created_at = Column(DateTime, server_default=local_now())
+
+    __table_args__ = (
+        Index('ix_orders_status_created_at', 'status', 'created_at'),
+    )
     
     customer = relationship("Customer", back_populates="orders")
-    items = relationship("OrderItem", back_populates="order")
\ No newline at end of file
+    items = relationship("OrderItem", back_populates="order")
+
+# Keep orders.total equal to the sum of its items, each at the price in
+# effect when the order was placed (as reports price them), or the current
+# price for flowers with no history then. Updates only count when they
+# touch an item's order, flower or quantity, so backfilling other columns
+# leaves the totals alone
+ORDER_TOTAL_SQL = """
+    UPDATE orders SET total = (
+        SELECT COALESCE(SUM(order_items.quantity * COALESCE((
+            SELECT flower_prices.price FROM flower_prices
+            WHERE flower_prices.flower_id = order_items.flower_id
+              AND flower_prices.effective_from <= orders.created_at
+            ORDER BY flower_prices.effective_from DESC, flower_prices.id DESC LIMIT 1
+        ), flowers.price)), 0)
+        FROM order_items JOIN flowers ON flowers.id = order_items.flower_id
+        WHERE order_items.order_id = {order_id}
+    ) WHERE id = {order_id};
+"""
+
+ORDER_TOTAL_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS order_items_total_insert AFTER INSERT ON order_items BEGIN"
+    + ORDER_TOTAL_SQL.format(order_id="NEW.order_id") + "END",
+    "CREATE TRIGGER IF NOT EXISTS order_items_total_update "
+    "AFTER UPDATE OF order_id, flower_id, quantity ON order_items BEGIN"
+    + ORDER_TOTAL_SQL.format(order_id="OLD.order_id")
+    + ORDER_TOTAL_SQL.format(order_id="NEW.order_id") + "END",
+    "CREATE TRIGGER IF NOT EXISTS order_items_total_delete AFTER DELETE ON order_items BEGIN"
+    + ORDER_TOTAL_SQL.format(order_id="OLD.order_id") + "END",
+]
+
+# PostgreSQL triggers run a function; one handles all three events
+ORDER_TOTAL_PG_FUNCTION = (
+    "CREATE OR REPLACE FUNCTION order_items_total() RETURNS trigger AS $$ BEGIN "
+    "IF TG_OP <> 'INSERT' THEN" + ORDER_TOTAL_SQL.format(order_id="OLD.order_id") + "END IF; "
+    "IF TG_OP <> 'DELETE' THEN" + ORDER_TOTAL_SQL.format(order_id="NEW.order_id") + "END IF; "
+    "RETURN NULL; END $$ LANGUAGE plpgsql"
+)
+ORDER_TOTAL_PG_TRIGGER = (
+    "CREATE TRIGGER order_items_total "
+    "AFTER INSERT OR UPDATE OF order_id, flower_id, quantity OR DELETE ON order_items "
+    "FOR EACH ROW EXECUTE FUNCTION order_items_total()"
+)
+
+for trigger in ORDER_TOTAL_TRIGGERS:
+    event.listen(OrderItem.__table__, 'after_create', DDL(trigger).execute_if(dialect='sqlite'))
+for ddl in (ORDER_TOTAL_PG_FUNCTION, ORDER_TOTAL_PG_TRIGGER):
+    event.listen(OrderItem.__table__, 'after_create', DDL(ddl).execute_if(dialect='postgresql'))
+
+def create_order_total_triggers(connection):
+    """Install the order total triggers where they are missing.
+
+    create_all() only adds them along with a new order_items table, so a
+    database whose tables predate them would keep totals frozen.
+    """
+    if connection.dialect.name == 'sqlite':
+        for trigger in ORDER_TOTAL_TRIGGERS:
+            connection.execute(text(trigger))
+    elif connection.dialect.name == 'postgresql':
+        connection.execute(text(ORDER_TOTAL_PG_FUNCTION))
+        exists = connection.execute(text(
+            "SELECT 1 FROM pg_trigger WHERE tgname = 'order_items_total' "
+            "AND tgrelid = 'order_items'::regclass"
+        )).first()
+        if exists is None:
+            connection.execute(text(ORDER_TOTAL_PG_TRIGGER))
+
+class StockMovement(Base):
+    __tablename__ = 'stock_movements'
+    id = Column(Integer, primary_key=True)
+    flower_id = Column(Integer, ForeignKey('flowers.id'), nullable=False)
+    change = Column(Integer, nullable=False)
+    kind = Column(String(20), nullable=False)
+    order_id = Column(Integer, ForeignKey('orders.id'))
+    note = Column(String(100))
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (
+        Index('ix_stock_movements_flower_id_id', 'flower_id', 'id'),
+    )
+
+    flower = relationship("Flower")
+
+class StockCheckpoint(Base):
+    __tablename__ = 'stock_checkpoints'
+    id = Column(Integer, primary_key=True)
+    flower_id = Column(Integer, ForeignKey('flowers.id'), nullable=False)
+    movement_id = Column(Integer, ForeignKey('stock_movements.id'), nullable=False)
+    balance = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_stock_checkpoints_flower_id_created_at', 'flower_id', 'created_at'),
+    )
+
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_keys'
+    id = Column(Integer, primary_key=True)
+    key = Column(String(64), nullable=False, unique=True)
+    order_id = Column(Integer, ForeignKey('orders.id'), nullable=False)
+    created_at = Column(DateTime, default=datetime.now, nullable=False, index=True)
+
+class CustomerSegment(Base):
+    __tablename__ = 'customer_segments'
+    customer_id = Column(Integer, ForeignKey('customers.id'), primary_key=True)
+    last_order_at = Column(DateTime, nullable=False)
+    last_order_id = Column(Integer, nullable=False)
+    last_movement_id = Column(Integer)
+    recency_days = Column(Integer)
+    frequency = Column(Integer, nullable=False)
+    monetary = Column(Float, nullable=False)
+    r_score = Column(Integer)
+    f_score = Column(Integer)
+    m_score = Column(Integer)
+    segment = Column(String(20), index=True)
+    computed_at = Column(DateTime)
+
+    customer = relationship("Customer")
+
+class ReportSnapshot(Base):
+    __tablename__ = 'report_snapshots'
+    id = Column(Integer, primary_key=True)
+    report = Column(String(50), nullable=False)
+    params = Column(String(200))
+    signature = Column(String(100))
+    status = Column(String(20), nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    duration_ms = Column(Integer)
+    data = Column(Text)
+    error = Column(String(200))
+
+    __table_args__ = (
+        Index('ix_report_snapshots_report_started_at', 'report', 'started_at'),
+    )
+
+class Reservation(Base):
+    __tablename__ = 'reservations'
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey('orders.id'), nullable=False, index=True)
+    flower_id = Column(Integer, ForeignKey('flowers.id'), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+
+    flower = relationship("Flower")
+
+class FlowerPrice(Base):
+    __tablename__ = 'flower_prices'
+    id = Column(Integer, primary_key=True)
+    flower_id = Column(Integer, ForeignKey('flowers.id'), nullable=False)
+    price = Column(Float, nullable=False)
+    effective_from = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_flower_prices_flower_id_effective_from', 'flower_id', 'effective_from'),
+    )
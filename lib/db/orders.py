@@ -0,0 +1,321 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, literal, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+from .models import Flower, Order, OrderItem, IdempotencyKey, StockMovement
+from .ledger import record_movement, SALE, CANCEL_RETURN
+from .report_cache import mark_reports_stale
+from .lookups import get_flower, get_order
+from .reservations import check_available, reserve, reserve_for_orders, release, shortages, InsufficientStock
+from .metrics import timed, ORDERS_PLACED, ORDER_SECONDS, STATUS_CHANGES, STATUS_CHANGE_SECONDS, STOCK_MOVEMENTS
+
+# Idempotency settings
+KEY_TTL = timedelta(hours=24)   # how long a retried submission is recognised
+RECENT_KEYS = 1024              # idempotency keys remembered in memory
+PENDING_BATCH = 50              # pending orders claimed per transaction
+
+_recent_keys = OrderedDict()
+
+_orders_created = ORDERS_PLACED.labels("created")
+_orders_repeated = ORDERS_PLACED.labels("duplicate")
+_orders_rejected = ORDERS_PLACED.labels("out_of_stock")
+
+
+def _remember(key, order_id, created_at):
+    _recent_keys[key] = (order_id, created_at)
+    _recent_keys.move_to_end(key)
+    while len(_recent_keys) > RECENT_KEYS:
+        _recent_keys.popitem(last=False)
+
+
+def _known_order(db, key, now):
+    """Order id already created for `key`, or None if the key is new or expired"""
+    cached = _recent_keys.get(key)
+    if cached:
+        order_id, created_at = cached
+        if now - created_at < KEY_TTL:
+            _recent_keys.move_to_end(key)
+            return order_id
+        del _recent_keys[key]
+
+    row = db.query(IdempotencyKey).filter(IdempotencyKey.key == key).first()
+    if row is None:
+        return None
+    if now - row.created_at >= KEY_TTL:
+        db.delete(row)
+        db.flush()
+        return None
+    _remember(key, row.order_id, row.created_at)
+    return row.order_id
+
+
+def _lock_flowers(db, flower_ids):
+    """Lock flower rows before their stock moves, as {id: flower}.
+
+    Rows are locked in id order so two terminals selling the same flowers
+    cannot deadlock. SQLite ignores FOR UPDATE; its writes are serialised.
+    """
+    return {
+        flower.id: flower
+        for flower in db.query(Flower).filter(
+            Flower.id.in_(sorted(set(flower_ids)))
+        ).order_by(Flower.id).with_for_update()
+    }
+
+
+@timed(ORDER_SECONDS)
+def place_order(db, customer_id, items, status='completed', idempotency_key=None):
+    """Create an order from (flower_id, quantity) pairs and commit it.
+
+    Completed orders take their items out of stock and pending orders
+    reserve them; either raises InsufficientStock, writing nothing, if a
+    flower has too few free units. When `idempotency_key` is given and an
+    order was already created with it, the original order id is returned
+    and nothing is written. Returns (order_id, created).
+    """
+    now = datetime.now()
+    if idempotency_key:
+        order_id = _known_order(db, idempotency_key, now)
+        if order_id is not None:
+            _orders_repeated.inc()
+            return order_id, False
+
+    order = Order(customer_id=customer_id, status=status)
+    db.add(order)
+    db.flush()  # Get ID without committing
+
+    # orders.total and created_at are filled in by the database
+    locked = _lock_flowers(db, [flower_id for flower_id, _ in items]) if status == 'completed' else {}
+    try:
+        if status == 'completed':
+            check_available(db, items)
+        elif status == 'pending':
+            reserve(db, order.id, items, now)
+    except InsufficientStock:
+        db.rollback()
+        _orders_rejected.inc()
+        raise
+
+    for flower_id, quantity in items:
+        flower = locked.get(flower_id) or get_flower(db, flower_id)
+        db.add(OrderItem(order_id=order.id, flower_id=flower.id, quantity=quantity))
+        if status == 'completed':
+            record_movement(db, flower, -quantity, SALE, order_id=order.id)
+
+    if idempotency_key:
+        db.add(IdempotencyKey(key=idempotency_key, order_id=order.id, created_at=now))
+
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another terminal committed the same key first
+        db.rollback()
+        if not idempotency_key:
+            raise
+        order_id = _known_order(db, idempotency_key, now)
+        if order_id is None:
+            raise
+        _orders_repeated.inc()
+        return order_id, False
+
+    if idempotency_key:
+        _remember(idempotency_key, order.id, now)
+    _orders_created.inc()
+    return order.id, True
+
+
+@timed(STATUS_CHANGE_SECONDS, "single")
+def change_order_status(db, order_id, new_status):
+    """Move an order to `new_status`, adjusting stock, and commit.
+
+    Completing an order takes its items out of stock; moving a completed
+    order back to pending or cancelled returns them. Pending orders hold a
+    reservation, released when they leave 'pending'. Raises
+    InsufficientStock, writing nothing, if the stock is not there. The
+    status is switched with a conditional UPDATE, so if another terminal
+    changed the order in the meantime nothing is written and None is returned.
+    """
+    order = get_order(db, order_id)
+    if order is None:
+        return None
+    old_status = order.status
+    if old_status == new_status:
+        return order
+
+    switched = db.query(Order).filter(
+        Order.id == order_id,
+        Order.status == old_status
+    ).update({Order.status: new_status}, synchronize_session=False)
+    if not switched:
+        db.rollback()
+        return None
+
+    items = [(item.flower_id, item.quantity) for item in order.items]
+    _lock_flowers(db, [flower_id for flower_id, _ in items])
+    if old_status == 'pending':
+        release(db, [order.id])
+    try:
+        if new_status == 'completed':
+            check_available(db, items)
+            for item in order.items:
+                record_movement(db, item.flower, -item.quantity, SALE, order_id=order.id)
+        elif old_status == 'completed':
+            for item in order.items:
+                record_movement(db, item.flower, item.quantity, CANCEL_RETURN, order_id=order.id)
+        if new_status == 'pending':
+            reserve(db, order.id, items)
+    except InsufficientStock:
+        db.rollback()
+        raise
+
+    db.commit()
+    # The UPDATE bypassed the session; show the new status without
+    # marking the order dirty
+    set_committed_value(order, 'status', new_status)
+    STATUS_CHANGES.labels(new_status).inc()
+    return order
+
+
+def _bulk_conditions(new_status, order_ids=None, from_status=None, created_before=None):
+    orders = Order.__table__
+    conditions = [orders.c.status != new_status]
+    if order_ids is not None:
+        conditions.append(orders.c.id.in_(order_ids))
+    if from_status is not None:
+        conditions.append(orders.c.status == from_status)
+    if created_before is not None:
+        conditions.append(orders.c.created_at < created_before)
+    return conditions
+
+
+def count_bulk_targets(db, new_status, order_ids=None, from_status=None, created_before=None):
+    """How many orders a bulk status change would move"""
+    conditions = _bulk_conditions(new_status, order_ids, from_status, created_before)
+    return db.execute(select(func.count()).select_from(Order.__table__).where(*conditions)).scalar()
+
+
+@timed(STATUS_CHANGE_SECONDS, "bulk")
+def bulk_change_status(db, new_status, order_ids=None, from_status=None, created_before=None):
+    """Move every matching order to `new_status` with a few set-based statements.
+
+    Orders can be picked by id, current status and/or creation date. Stock
+    moves once per flower with the summed quantity of the affected items,
+    the ledger gets one row per item, and everything commits together.
+    Reservations of orders leaving 'pending' are released and orders moving
+    to 'pending' reserve their items. Raises InsufficientStock, writing
+    nothing, if completing or reserving needs more than is free.
+    Returns (orders changed, flowers restocked or sold, units moved).
+    """
+    orders = Order.__table__
+    items = OrderItem.__table__
+    flowers = Flower.__table__
+    conditions = _bulk_conditions(new_status, order_ids, from_status, created_before)
+
+    # Completing takes stock out; leaving 'completed' puts it back
+    if new_status == 'completed':
+        sign, kind, moving = -1, SALE, and_(*conditions)
+    else:
+        sign, kind, moving = 1, CANCEL_RETURN, and_(*conditions, orders.c.status == 'completed')
+    affected_items = items.join(orders, items.c.order_id == orders.c.id)
+    targets = select(orders.c.id).where(*conditions)
+
+    # Lock the flowers in id order first, as _lock_flowers does
+    db.execute(select(flowers.c.id).where(flowers.c.id.in_(
+        select(items.c.flower_id).where(items.c.order_id.in_(targets))
+    )).order_by(flowers.c.id).with_for_update())
+    release(db, targets)
+
+    delta = select(
+        items.c.flower_id, func.sum(items.c.quantity).label('units')
+    ).select_from(affected_items).where(moving).group_by(items.c.flower_id).subquery()
+    missing = shortages(db, delta) if new_status == 'completed' else []
+    if missing:
+        db.rollback()
+        raise InsufficientStock(missing)
+
+    movements = db.execute(StockMovement.__table__.insert().from_select(
+        ['flower_id', 'change', 'kind', 'order_id', 'note', 'created_at'],
+        select(
+            items.c.flower_id, items.c.quantity * sign, literal(kind), items.c.order_id,
+            literal("bulk status change"), literal(datetime.now())
+        ).select_from(affected_items).where(moving)
+    ))
+
+    units = db.execute(select(func.coalesce(func.sum(delta.c.units), 0))).scalar()
+    stock = db.execute(flowers.update().where(flowers.c.id == delta.c.flower_id).values(
+        quantity=flowers.c.quantity + sign * delta.c.units
+    ))
+
+    if new_status == 'pending':
+        try:
+            reserve_for_orders(db, targets)
+        except InsufficientStock:
+            db.rollback()
+            raise
+    changed = db.execute(orders.update().where(*conditions).values(status=new_status))
+
+    mark_reports_stale(db)
+    db.commit()
+    STATUS_CHANGES.labels(new_status).inc(changed.rowcount)
+    STOCK_MOVEMENTS.labels(kind).inc(movements.rowcount)
+    return changed.rowcount, stock.rowcount, units
+
+
+def claim_pending_orders(db, limit=PENDING_BATCH, skip=()):
+    """Lock up to `limit` of the oldest pending orders and return their ids.
+
+    Orders another node has already locked are skipped rather than waited
+    for (FOR UPDATE SKIP LOCKED), so several nodes can work through the
+    queue at once, as are the ids in `skip`. The locks are held until the
+    caller commits.
+    """
+    query = db.query(Order.id).filter(Order.status == 'pending')
+    if skip:
+        query = query.filter(Order.id.notin_(skip))
+    return [order_id for order_id, in query.order_by(
+        Order.created_at, Order.id
+    ).limit(limit).with_for_update(skip_locked=True)]
+
+
+def complete_pending_orders(db, batch=PENDING_BATCH):
+    """Complete pending orders a batch at a time; returns (orders, units moved, ids left pending).
+
+    A batch that runs short of stock is retried one order at a time, and
+    the orders that cannot be filled stay pending.
+    """
+    completed = units = 0
+    short = []
+    while True:
+        order_ids = claim_pending_orders(db, batch, skip=short)
+        if not order_ids:
+            db.rollback()
+            return completed, units, short
+        try:
+            changed, _, moved = bulk_change_status(db, 'completed', order_ids=order_ids, from_status='pending')
+        except InsufficientStock:
+            changed = moved = 0
+            for order_id in order_ids:
+                try:
+                    done, _, order_units = bulk_change_status(
+                        db, 'completed', order_ids=[order_id], from_status='pending')
+                except InsufficientStock:
+                    short.append(order_id)
+                    continue
+                changed += done
+                moved += order_units
+        completed += changed
+        units += moved
+
+
+def purge_expired_keys(db, now=None):
+    """Delete idempotency keys older than KEY_TTL, return how many were removed"""
+    cutoff = (now or datetime.now()) - KEY_TTL
+    removed = db.query(IdempotencyKey).filter(
+        IdempotencyKey.created_at < cutoff
+    ).delete(synchronize_session=False)
+    db.commit()
+    for key, (_, created_at) in list(_recent_keys.items()):
+        if created_at < cutoff:
+            del _recent_keys[key]
+    return removed
@@ -0,0 +1,57 @@
+from datetime import datetime
+from sqlalchemy import bindparam, inspect, select
+from .models import FlowerPrice, local_now
+
+# effective_from of prices already in place before history was kept
+HISTORY_START = datetime(1970, 1, 1)
+
+# Latest row at or before `when`: one seek on (flower_id, effective_from)
+PRICE_AT = select(FlowerPrice.price).where(
+    FlowerPrice.flower_id == bindparam('flower_id'),
+    FlowerPrice.effective_from <= bindparam('when')
+).order_by(FlowerPrice.effective_from.desc(), FlowerPrice.id.desc()).limit(1)
+
+
+def set_price(db, flower, price, when=None):
+    """Change a flower's price and record it in the price history.
+
+    Both land in the caller's session; nothing is written when the price
+    is unchanged. Without `when` the change is stamped by the database
+    clock, the one that stamps orders.created_at. Returns the new
+    FlowerPrice, or None.
+    """
+    if inspect(flower).persistent and flower.price == price:
+        return None
+    flower.price = price
+    if flower.id is None:
+        db.add(flower)
+        db.flush()
+    row = FlowerPrice(flower_id=flower.id, price=price, effective_from=when or local_now())
+    db.add(row)
+    db.flush()
+    return row
+
+
+def price_at(db, flower_id, when=None):
+    """Price of a flower in effect at `when` (now if omitted), or None"""
+    return db.execute(PRICE_AT, {"flower_id": flower_id, "when": when or datetime.now()}).scalar()
+
+
+def price_in_effect(flower_id, when):
+    """Correlated subquery for the price in effect, for use inside a query.
+
+    `flower_id` and `when` are columns of the outer query, e.g.
+    OrderItem.flower_id and Order.created_at; each row costs one index
+    seek. NULL where the flower has no price history yet at `when`.
+    """
+    return select(FlowerPrice.price).where(
+        FlowerPrice.flower_id == flower_id,
+        FlowerPrice.effective_from <= when
+    ).order_by(FlowerPrice.effective_from.desc(), FlowerPrice.id.desc()).limit(1).scalar_subquery()
+
+
+def price_history(db, flower_id):
+    """(effective_from, price) rows for a flower, newest first"""
+    return db.query(FlowerPrice.effective_from, FlowerPrice.price).filter(
+        FlowerPrice.flower_id == flower_id
+    ).order_by(FlowerPrice.effective_from.desc(), FlowerPrice.id.desc()).all()
@@ -0,0 +1,126 @@
+import heapq
+import threading
+from itertools import combinations
+from sqlalchemy import func, select
+from .models import Order, OrderItem, StockMovement
+from .ledger import SALE, CANCEL_RETURN
+
+TOP_K = 3           # add-ons suggested for a basket
+MIN_ORDERS = 2      # pairs seen in fewer completed orders are ignored
+
+
+def _pair_counts(db):
+    """(flower a, flower b, orders) for every pair bought together, a < b.
+
+    The pairs are counted by the database with one self-join of
+    order_items, so nothing per item is loaded into Python.
+    """
+    a = OrderItem.__table__.alias("a")
+    b = OrderItem.__table__.alias("b")
+    orders = Order.__table__
+    return db.execute(
+        select(a.c.flower_id, b.c.flower_id, func.count(func.distinct(a.c.order_id)))
+        .select_from(a.join(b, (a.c.order_id == b.c.order_id) & (a.c.flower_id < b.c.flower_id))
+                      .join(orders, orders.c.id == a.c.order_id))
+        .where(orders.c.status == 'completed')
+        .group_by(a.c.flower_id, b.c.flower_id)
+    ).all()
+
+
+def _flower_counts(db):
+    """{flower_id: completed orders containing it}"""
+    return dict(db.query(OrderItem.flower_id, func.count(func.distinct(OrderItem.order_id))).join(Order).filter(
+        Order.status == 'completed'
+    ).group_by(OrderItem.flower_id).all())
+
+
+class Recommender:
+    """Sparse flower co-occurrence matrix over completed orders.
+
+    Built once with set-based queries, then kept current from the stock
+    ledger: SALE movements newer than the watermark mean an order was
+    completed, CANCEL_RETURN movements that one was taken back.
+    """
+
+    def __init__(self, min_orders=MIN_ORDERS):
+        self.min_orders = min_orders
+        self.pairs = {}         # flower_id -> {other flower_id: orders with both}
+        self.orders_with = {}   # flower_id -> orders containing it
+        self.watermark = None   # newest stock movement id applied
+        self._lock = threading.Lock()
+
+    def _add_pair(self, a, b, count):
+        self.pairs.setdefault(a, {})
+        self.pairs.setdefault(b, {})
+        self.pairs[a][b] = self.pairs[a].get(b, 0) + count
+        self.pairs[b][a] = self.pairs[b].get(a, 0) + count
+
+    def build(self, db):
+        """Rebuild the matrix from every completed order"""
+        watermark = db.query(func.coalesce(func.max(StockMovement.id), 0)).scalar()
+        rows = _pair_counts(db)
+        counts = _flower_counts(db)
+        with self._lock:
+            self.pairs = {}
+            for a, b, count in rows:
+                self._add_pair(a, b, count)
+            self.orders_with = counts
+            self.watermark = watermark
+        return len(rows)
+
+    def refresh(self, db):
+        """Apply orders completed or taken back since the last refresh; returns how many"""
+        if self.watermark is None:
+            self.build(db)
+            return 0
+        newest = db.query(func.coalesce(func.max(StockMovement.id), 0)).scalar()
+        if newest <= self.watermark:
+            return 0
+        # Each completion moves -units and each return +units, so the sign
+        # of the sum says whether an order ended up completed or not
+        movements = db.query(StockMovement.order_id, func.sum(StockMovement.change)).filter(
+            StockMovement.id > self.watermark,
+            StockMovement.id <= newest,
+            StockMovement.order_id.isnot(None),
+            StockMovement.kind.in_([SALE, CANCEL_RETURN])
+        ).group_by(StockMovement.order_id).all()
+        signs = {order_id: (1 if change < 0 else -1) for order_id, change in movements if change}
+        items = {}
+        if signs:
+            for order_id, flower_id in db.query(OrderItem.order_id, OrderItem.flower_id).filter(
+                OrderItem.order_id.in_(list(signs))
+            ):
+                items.setdefault(order_id, set()).add(flower_id)
+        with self._lock:
+            for order_id, flowers in items.items():
+                sign = signs[order_id]
+                for flower_id in flowers:
+                    self.orders_with[flower_id] = self.orders_with.get(flower_id, 0) + sign
+                for a, b in combinations(sorted(flowers), 2):
+                    self._add_pair(a, b, sign)
+            self.watermark = newest
+        return len(signs)
+
+    def suggest(self, basket, k=TOP_K, allowed=None):
+        """Top `k` flower ids to add to `basket` (flower ids), best first.
+
+        A candidate scores the sum, over the basket, of the share of orders
+        with that basket flower that also had the candidate. `allowed`
+        limits the candidates, e.g. to flowers in stock.
+        """
+        scores = {}
+        basket = set(basket)
+        with self._lock:
+            for flower_id in basket:
+                seen = self.orders_with.get(flower_id)
+                if not seen:
+                    continue
+                for other, count in self.pairs.get(flower_id, {}).items():
+                    if count < self.min_orders or other in basket:
+                        continue
+                    if allowed is None or other in allowed:
+                        scores[other] = scores.get(other, 0) + count / seen
+        return heapq.nlargest(k, scores, key=lambda other: (scores[other], -other))
+
+
+recommender = Recommender()
@@ -0,0 +1,125 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .models import Flower, Order, OrderItem
+
+# Cache settings
+REPORT_TTL = 300              # seconds before a cached report is recomputed
+MAX_REPORTS = 64              # cached report/parameter combinations
+CACHE_FILE = "report_cache.json"
+
+# Changes to these tables make cached reports stale
+TRACKED = (Flower, Order, OrderItem)
+
+
+class ReportCache:
+    """LRU cache of report results with a TTL, optionally saved to disk"""
+
+    def __init__(self, ttl=REPORT_TTL, max_entries=MAX_REPORTS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _key(report, params):
+        return json.dumps([report, params], sort_keys=True, default=str)
+
+    def get(self, report, params=None):
+        """Return (result, computed_at) or None if missing or expired"""
+        key = self._key(report, params)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[1] >= self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, report, params, result, computed_at=None):
+        key = self._key(report, params)
+        self._entries[key] = (result, computed_at or time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def cached(self, report, params, compute, snapshot=None):
+        """Return (result, age in seconds), filling the cache on a miss.
+
+        On a miss `snapshot` is tried first; it returns a precomputed
+        (result, computed_at) that is still current, or None.
+        """
+        entry = self.get(report, params)
+        if entry is None:
+            entry = snapshot() if snapshot else None
+            if entry is None:
+                entry = (compute(), time.time())
+            self.put(report, params, *entry)
+        result, computed_at = entry
+        return result, time.time() - computed_at
+
+    def invalidate(self):
+        self._entries.clear()
+
+    def load(self, path=CACHE_FILE):
+        """Load unexpired entries saved by an earlier process"""
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, result, computed_at in saved:
+            if now - computed_at < self.ttl:
+                self._entries[key] = (result, computed_at)
+
+    def save(self, path=CACHE_FILE):
+        entries = [[key, result, computed_at] for key, (result, computed_at) in self._entries.items()]
+        with open(path, "w") as f:
+            json.dump(entries, f)
+
+
+report_cache = ReportCache()
+
+
+def mark_reports_stale(session):
+    """Invalidate cached reports when `session` next commits.
+
+    Needed for Core statements, which the ORM events below cannot see.
+    """
+    session.info["reports_stale"] = True
+
+
+def _touches_reports(instances):
+    return any(isinstance(obj, TRACKED) for obj in instances)
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_stale(session, flush_context):
+    dirty = [obj for obj in session.dirty if session.is_modified(obj)]
+    if _touches_reports(session.new) or _touches_reports(session.deleted) or _touches_reports(dirty):
+        mark_reports_stale(session)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_stale_bulk(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, TRACKED):
+            mark_reports_stale(orm_execute_state.session)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop("reports_stale", False):
+        report_cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session):
+    session.info.pop("reports_stale", None)
@@ -0,0 +1,216 @@
+import csv
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from .models import Flower, Customer, Order, OrderItem, ReportSnapshot
+from .prices import price_in_effect
+from .report_cache import report_cache
+from .scheduler import Scheduler
+from .session import SessionLocal
+from .metrics import REPORT_RUNS, REPORT_SECONDS
+
+# Precomputed reports
+SNAPSHOT_DIR = "report_snapshots"
+SNAPSHOT_MAX_AGE = 24 * 3600    # seconds a snapshot may be served while orders are unchanged
+KEEP_RUNS = 200                 # run log rows kept per report
+
+
+def _sales_summary(db):
+    # Total sales
+    total_sales = db.query(func.sum(Order.total)).filter(
+        Order.status == 'completed'
+    ).scalar() or 0
+
+    # Recent sales (last 7 days)
+    recent_sales = db.query(func.sum(Order.total)).filter(
+        Order.status == 'completed',
+        Order.created_at >= datetime.now() - timedelta(days=7)
+    ).scalar() or 0
+
+    # Order count
+    order_count = db.query(Order).filter(
+        Order.status == 'completed'
+    ).count()
+
+    return {"total_sales": total_sales, "recent_sales": recent_sales, "order_count": order_count}
+
+
+def _top_flowers(db, limit):
+    # Revenue at the price in effect when each order was placed
+    unit_price = func.coalesce(price_in_effect(OrderItem.flower_id, Order.created_at), Flower.price)
+    results = db.query(
+        Flower.name,
+        func.sum(OrderItem.quantity).label('total_sold'),
+        func.sum(OrderItem.quantity * unit_price).label('total_revenue')
+    ).join(OrderItem).join(Order).filter(
+        Order.status == 'completed'
+    ).group_by(Flower.name).order_by(
+        func.sum(OrderItem.quantity).desc()
+    ).limit(limit).all()
+    return [[row.name, row.total_sold, row.total_revenue] for row in results]
+
+
+def _top_customers(db, limit):
+    results = db.query(
+        Customer.name,
+        func.count(Order.id).label('order_count'),
+        func.sum(Order.total).label('total_spent')
+    ).join(Order).filter(
+        Order.status == 'completed'
+    ).group_by(Customer.id, Customer.name).order_by(
+        func.sum(Order.total).desc()
+    ).limit(limit).all()
+    return [[row.name, row.order_count, row.total_spent] for row in results]
+
+
+def _measured(report, compute):
+    """Wrap `compute` so every run is counted and timed"""
+    def run():
+        started = time.perf_counter()
+        try:
+            result = compute()
+        except Exception:
+            REPORT_RUNS.labels(report, "failed").inc()
+            raise
+        REPORT_SECONDS.labels(report).observe(time.perf_counter() - started)
+        REPORT_RUNS.labels(report, "ok").inc()
+        return result
+    return run
+
+
+# name -> (compute(db, **params), default params, CSV headers)
+REPORTS = {
+    "sales_summary": (_sales_summary, None, ["Metric", "Value"]),
+    "top_flowers": (_top_flowers, {"limit": 10}, ["Flower", "Units Sold", "Revenue"]),
+    "top_customers": (_top_customers, {"limit": 10}, ["Customer", "Orders", "Total Spent"]),
+}
+
+
+# name -> cron spec (minute hour day-of-month month day-of-week)
+SCHEDULE = {
+    "sales_summary": "*/30 * * * *",
+    "top_flowers": "15 * * * *",
+    "top_customers": "45 * * * *",
+}
+
+
+def report_signature(db):
+    """Fingerprint of completed orders; a snapshot is current while it matches.
+
+    The customer count catches merged duplicate customers.
+    """
+    count, last_id, total, customers = db.query(
+        func.count(Order.id), func.max(Order.id), func.sum(Order.total), func.count(func.distinct(Order.customer_id))
+    ).filter(Order.status == 'completed').one()
+    return f"{count}:{last_id or 0}:{round(total or 0, 2)}:{customers}"
+
+
+def _params_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def load_snapshot(db, report, params):
+    """Latest precomputed (result, computed_at) if still current, else None"""
+    snapshot = db.query(ReportSnapshot).filter(
+        ReportSnapshot.report == report,
+        ReportSnapshot.params == _params_key(params),
+        ReportSnapshot.status == 'ok'
+    ).order_by(ReportSnapshot.started_at.desc()).first()
+    if snapshot is None:
+        return None
+    computed_at = snapshot.started_at.timestamp()
+    if time.time() - computed_at >= SNAPSHOT_MAX_AGE or snapshot.signature != report_signature(db):
+        return None
+    return json.loads(snapshot.data), computed_at
+
+
+def _write_files(report, result, headers):
+    """Write compact JSON and CSV copies, replacing the old ones atomically"""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    rows = list(result.items()) if isinstance(result, dict) else result
+    base = os.path.join(SNAPSHOT_DIR, report)
+
+    with open(base + ".json.tmp", "w") as f:
+        json.dump(result, f, separators=(",", ":"))
+    with open(base + ".csv.tmp", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        writer.writerows(rows)
+    os.replace(base + ".json.tmp", base + ".json")
+    os.replace(base + ".csv.tmp", base + ".csv")
+
+
+def precompute(db, report):
+    """Compute `report`, store it as a snapshot and log the run; returns the log row"""
+    compute, params, headers = REPORTS[report]
+    started_at = datetime.now()
+    start = time.perf_counter()
+    run = ReportSnapshot(report=report, params=_params_key(params), started_at=started_at)
+    try:
+        run.signature = report_signature(db)
+        result = _measured(report, lambda: compute(db, **(params or {})))()
+        _write_files(report, result, headers)
+        run.data = json.dumps(result, separators=(",", ":"))
+        run.status = 'ok'
+    except Exception as e:
+        db.rollback()
+        run.status = 'failed'
+        run.error = str(e)[:200]
+    run.duration_ms = int((time.perf_counter() - start) * 1000)
+    db.add(run)
+    db.flush()
+
+    old = [id for id, in db.query(ReportSnapshot.id).filter(
+        ReportSnapshot.report == report
+    ).order_by(ReportSnapshot.started_at.desc()).offset(KEEP_RUNS)]
+    if old:
+        db.query(ReportSnapshot).filter(ReportSnapshot.id.in_(old)).delete(synchronize_session=False)
+    db.commit()
+    return run
+
+
+def _precompute_job(report):
+    def run():
+        db = SessionLocal()
+        try:
+            precompute(db, report)
+        finally:
+            db.close()
+    return run
+
+
+def start_precompute(schedule=SCHEDULE):
+    """Start precomputing reports in the background; returns the Scheduler"""
+    scheduler = Scheduler("report-precompute")
+    for report, spec in schedule.items():
+        scheduler.add(report, spec, _precompute_job(report))
+    return scheduler.start()
+
+
+def recent_runs(db, limit=20):
+    return db.query(ReportSnapshot).order_by(ReportSnapshot.started_at.desc()).limit(limit).all()
+
+
+def sales_summary(db):
+    """Sales totals as (summary dict, cache age in seconds)"""
+    compute = _measured("sales_summary", lambda: _sales_summary(db))
+    return report_cache.cached("sales_summary", None, compute,
+                               snapshot=lambda: load_snapshot(db, "sales_summary", None))
+
+
+def top_flowers(db, limit=10):
+    """Best selling flowers as ([name, units, revenue], cache age in seconds)"""
+    params = {"limit": limit}
+    compute = _measured("top_flowers", lambda: _top_flowers(db, limit))
+    return report_cache.cached("top_flowers", params, compute,
+                               snapshot=lambda: load_snapshot(db, "top_flowers", params))
+
+
+def top_customers(db, limit=10):
+    """Biggest spenders as ([name, orders, spent], cache age in seconds)"""
+    params = {"limit": limit}
+    compute = _measured("top_customers", lambda: _top_customers(db, limit))
+    return report_cache.cached("top_customers", params, compute,
+                               snapshot=lambda: load_snapshot(db, "top_customers", params))
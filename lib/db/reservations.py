@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta
+from sqlalchemy import case, func, literal, select
+from .models import Flower, OrderItem, Reservation
+from .scheduler import Scheduler
+from .session import SessionLocal
+
+RESERVATION_TTL = timedelta(hours=48)   # how long a pending order holds its stock
+RELEASE_BATCH = 500                     # expired reservations released per transaction
+SWEEP_SCHEDULE = "*/5 * * * *"          # when the background sweeper runs
+
+
+class InsufficientStock(ValueError):
+    """Raised when an order wants more of a flower than is available"""
+
+    def __init__(self, shortages):
+        self.shortages = shortages      # [(flower name, available, wanted)]
+        super().__init__("not enough stock for " + ", ".join(
+            f"{name} ({available} available, {wanted} wanted)" for name, available, wanted in shortages
+        ))
+
+
+def _available():
+    flowers = Flower.__table__
+    return flowers.c.quantity - flowers.c.reserved
+
+
+def _wanted(items):
+    """Sum (flower_id, quantity) pairs per flower, in id order"""
+    wanted = {}
+    for flower_id, quantity in items:
+        wanted[flower_id] = wanted.get(flower_id, 0) + quantity
+    return dict(sorted(wanted.items()))
+
+
+def shortages(db, demand):
+    """[(name, available, wanted)] for flowers with fewer free units than `demand`.
+
+    `demand` is a subquery of (flower_id, units); every flower is checked
+    with the one `quantity - reserved < units` comparison.
+    """
+    flowers = Flower.__table__
+    return [tuple(row) for row in db.execute(
+        select(flowers.c.name, _available(), demand.c.units).where(
+            flowers.c.id == demand.c.flower_id,
+            _available() < demand.c.units
+        ).order_by(flowers.c.id)
+    )]
+
+
+def check_available(db, items):
+    """Raise InsufficientStock unless every (flower_id, quantity) pair is free to sell.
+
+    Call it with the flowers locked, after the order's own reservations
+    have been released.
+    """
+    wanted = _wanted(items)
+    flowers = Flower.__table__
+    units = case(wanted, value=flowers.c.id)
+    missing = [tuple(row) for row in db.execute(
+        select(flowers.c.name, _available(), units).where(
+            flowers.c.id.in_(wanted),
+            _available() < units
+        ).order_by(flowers.c.id)
+    )]
+    if missing:
+        raise InsufficientStock(missing)
+
+
+def reserve(db, order_id, items, now=None):
+    """Hold stock for a pending order's (flower_id, quantity) pairs.
+
+    Each flower is claimed with a conditional `reserved = reserved + units`
+    UPDATE that only matches while `quantity - reserved >= units`, so two
+    orders can never hold the same units. Raises InsufficientStock, leaving
+    the rollback to the caller, if any flower falls short.
+    """
+    now = now or datetime.now()
+    wanted = _wanted(items)
+    missing = []
+    for flower_id, units in wanted.items():
+        claimed = db.query(Flower).filter(
+            Flower.id == flower_id,
+            Flower.quantity - Flower.reserved >= units
+        ).update({Flower.reserved: Flower.reserved + units}, synchronize_session=False)
+        if not claimed:
+            flower = db.query(Flower.name, Flower.quantity - Flower.reserved).filter(Flower.id == flower_id).one()
+            missing.append((flower[0], flower[1], units))
+    if missing:
+        raise InsufficientStock(missing)
+
+    db.execute(Reservation.__table__.insert(), [
+        {"order_id": order_id, "flower_id": flower_id, "quantity": units,
+         "created_at": now, "expires_at": now + RESERVATION_TTL}
+        for flower_id, units in wanted.items()
+    ])
+
+
+def reserve_for_orders(db, order_ids, now=None):
+    """Set-based reserve() for every item of the orders matching `order_ids` (a select).
+
+    Returns the units held.
+    """
+    now = now or datetime.now()
+    items = OrderItem.__table__
+    flowers = Flower.__table__
+    demand = select(
+        items.c.flower_id, func.sum(items.c.quantity).label('units')
+    ).where(items.c.order_id.in_(order_ids)).group_by(items.c.flower_id).subquery()
+    missing = shortages(db, demand)
+    if missing:
+        raise InsufficientStock(missing)
+
+    db.execute(Reservation.__table__.insert().from_select(
+        ['order_id', 'flower_id', 'quantity', 'created_at', 'expires_at'],
+        select(
+            items.c.order_id, items.c.flower_id, func.sum(items.c.quantity),
+            literal(now), literal(now + RESERVATION_TTL)
+        ).where(items.c.order_id.in_(order_ids)).group_by(items.c.order_id, items.c.flower_id)
+    ))
+    db.execute(flowers.update().where(flowers.c.id == demand.c.flower_id).values(
+        reserved=flowers.c.reserved + demand.c.units
+    ))
+    return db.execute(select(func.coalesce(func.sum(demand.c.units), 0))).scalar()
+
+
+def _release(db, which):
+    """Drop the reservations matching `which`, returning their units to `reserved`"""
+    reservations = Reservation.__table__
+    flowers = Flower.__table__
+    held = select(
+        reservations.c.flower_id, func.sum(reservations.c.quantity).label('units')
+    ).where(which).group_by(reservations.c.flower_id).subquery()
+    db.execute(flowers.update().where(flowers.c.id == held.c.flower_id).values(
+        reserved=flowers.c.reserved - held.c.units
+    ))
+    return db.execute(reservations.delete().where(which)).rowcount
+
+
+def release(db, order_ids):
+    """Release the reservations of `order_ids` (a list or a select); returns how many"""
+    return _release(db, Reservation.__table__.c.order_id.in_(order_ids))
+
+
+def release_expired(db, now=None, batch=RELEASE_BATCH):
+    """Release reservations past their expiry, `batch` per transaction.
+
+    Reservations another node is already releasing are skipped (FOR UPDATE
+    SKIP LOCKED). The orders stay pending; completing one later checks
+    stock again. Returns how many reservations were released.
+    """
+    now = now or datetime.now()
+    reservations = Reservation.__table__
+    flowers = Flower.__table__
+    released = 0
+    while True:
+        ids = [r for r, in db.execute(
+            select(reservations.c.id).where(reservations.c.expires_at <= now)
+            .order_by(reservations.c.id).limit(batch).with_for_update(skip_locked=True)
+        )]
+        if not ids:
+            db.rollback()
+            return released
+        # Lock the flowers in id order, as orders._lock_flowers does
+        db.execute(select(flowers.c.id).where(flowers.c.id.in_(
+            select(reservations.c.flower_id).where(reservations.c.id.in_(ids))
+        )).order_by(flowers.c.id).with_for_update())
+        released += _release(db, reservations.c.id.in_(ids))
+        db.commit()
+
+
+def _sweep():
+    db = SessionLocal()
+    try:
+        release_expired(db)
+    finally:
+        db.close()
+
+
+def start_sweeper(spec=SWEEP_SCHEDULE):
+    """Release expired reservations in the background; returns the Scheduler"""
+    scheduler = Scheduler("reservation-sweeper")
+    scheduler.add("release_reservations", spec, _sweep)
+    return scheduler.start()
+
+
+def reservation_mismatches(db):
+    """Flowers whose `reserved` differs from their live reservations: [(flower, held)]"""
+    held = dict(db.query(Reservation.flower_id, func.sum(Reservation.quantity)).group_by(
+        Reservation.flower_id
+    ).all())
+    return [
+        (flower, held.get(flower.id, 0))
+        for flower in db.query(Flower).order_by(Flower.id)
+        if flower.reserved != held.get(flower.id, 0)
+    ]
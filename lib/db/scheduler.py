@@ -0,0 +1,139 @@
+import random
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from .metrics import JOB_RUNS, JOB_SECONDS
+
+JITTER_SECONDS = 20     # random delay before each run so jobs do not fire together
+FAILURE_LOG = "scheduler.log"   # failed runs, with their tracebacks
+
+_log_lock = threading.Lock()
+
+# (low, high) for each cron field: minute hour day-of-month month day-of-week
+FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+
+def _parse_field(text, low, high):
+    """Expand one cron field ("*", "*/15", "1-5", "0,30", "9-17/2") to a set"""
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(v) for v in part.split('-', 1))
+        else:
+            start = end = int(part)
+        if not (low <= start <= end <= high) or step < 1:
+            raise ValueError(f"cron field '{text}' out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSpec:
+    """Five-field cron schedule: minute hour day-of-month month day-of-week (0 = Sunday)"""
+
+    def __init__(self, spec):
+        fields = spec.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron spec '{spec}' needs 5 fields")
+        self.spec = spec
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            _parse_field(field, low, high) for field, (low, high) in zip(fields, FIELD_RANGES)
+        )
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def matches(self, when):
+        weekday = (when.weekday() + 1) % 7
+        if self.any_day or self.any_weekday:
+            day_ok = when.day in self.days and weekday in self.weekdays
+        else:
+            # Like cron: a restricted day-of-month OR day-of-week is enough
+            day_ok = when.day in self.days or weekday in self.weekdays
+        return (when.minute in self.minutes and when.hour in self.hours
+                and when.month in self.months and day_ok)
+
+
+class Job:
+    def __init__(self, name, spec, func):
+        self.name = name
+        self.cron = CronSpec(spec)
+        self.func = func
+        self.running = threading.Lock()
+
+
+def log_failure(job, started_at, seconds, error, log=FAILURE_LOG):
+    """Append a failed run to the log; the menus own the terminal"""
+    with _log_lock, open(log, "a") as f:
+        f.write(f"{started_at:%Y-%m-%d %H:%M:%S} {job} failed after {seconds:.2f}s: "
+                f"{type(error).__name__}: {error}\n")
+        f.write("".join("    " + line for line in traceback.format_exc().splitlines(True)))
+
+
+class Scheduler:
+    """Runs jobs on cron schedules in background threads.
+
+    A job that is still running when its next slot comes up is skipped
+    rather than started twice. Every run is counted in the metrics; a run
+    that raises is written to `log` and the job stays scheduled.
+    """
+
+    def __init__(self, name, jitter=JITTER_SECONDS, log=FAILURE_LOG):
+        self.name = name
+        self.jobs = []
+        self.jitter = jitter
+        self.log = log
+        self.skipped = {}
+        self.failures = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"{name}-scheduler", daemon=True)
+
+    def add(self, name, spec, func):
+        self.jobs.append(Job(name, spec, func))
+        return self
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def due(self, when):
+        return [job for job in self.jobs if job.cron.matches(when)]
+
+    def _run(self):
+        while True:
+            now = datetime.now()
+            next_minute = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+            if self._stop.wait((next_minute - now).total_seconds()):
+                return
+            for job in self.due(next_minute):
+                threading.Thread(target=self._run_job, args=(job,), name=f"{self.name}-{job.name}",
+                                 daemon=True).start()
+
+    def _run_job(self, job):
+        if not job.running.acquire(blocking=False):
+            self.skipped[job.name] = self.skipped.get(job.name, 0) + 1
+            return
+        try:
+            if self._stop.wait(random.uniform(0, self.jitter)):
+                return
+            started_at, started = datetime.now(), time.perf_counter()
+            try:
+                job.func()
+                JOB_RUNS.labels(job.name, "ok").inc()
+            except Exception as e:
+                JOB_RUNS.labels(job.name, "failed").inc()
+                self.failures[job.name] = self.failures.get(job.name, 0) + 1
+                log_failure(job.name, started_at, time.perf_counter() - started, e, self.log)
+            finally:
+                JOB_SECONDS.labels(job.name).observe(time.perf_counter() - started)
+        finally:
+            job.running.release()
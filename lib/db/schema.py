@@ -0,0 +1,65 @@
+import os
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import inspect
+from .models import Base
+from .session import engine
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Revision the shipped myshop.db matched before it was stamped
+UNSTAMPED_REVISION = "f8790385bbe5"
+
+
+def head_revision():
+    """Newest migration revision, the schema this code expects"""
+    return ScriptDirectory(MIGRATIONS_DIR).get_current_head()
+
+
+def shop_tables(bind=engine):
+    """Names of the shop's tables that already exist in the database"""
+    return set(inspect(bind).get_table_names()) & set(Base.metadata.tables)
+
+
+def stamp_head(connection):
+    """Record a database just built from the models as being at head"""
+    MigrationContext.configure(connection).stamp(ScriptDirectory(MIGRATIONS_DIR), "head")
+
+
+def missing_columns(connection):
+    """Model tables and columns the database does not have"""
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            missing.append(table.name)
+            continue
+        have = {column["name"] for column in inspector.get_columns(table.name)}
+        missing += [f"{table.name}.{column.name}" for column in table.columns if column.name not in have]
+    return missing
+
+
+def schema_status(bind=engine):
+    """(revision, head, missing) if an existing database is behind the code, else None.
+
+    A new, empty database is not behind: create_all() builds it at head.
+    `revision` is None when the database was never stamped.
+    """
+    with bind.connect() as connection:
+        if not shop_tables(connection):
+            return None
+        revision = MigrationContext.configure(connection).get_current_revision()
+        head = head_revision()
+        if revision == head:
+            return None
+        return revision, head, missing_columns(connection)
+
+
+def upgrade_command(bind=engine, revision="head", action="upgrade"):
+    """The alembic command line that migrates this database"""
+    url = ""
+    if bind.dialect.name == "sqlite":
+        # alembic.ini's relative sqlite:///myshop.db would be lib/db/myshop.db
+        url = f"MYSHOP_DATABASE_URL=sqlite:///{os.path.abspath(bind.url.database)} "
+    return f"cd {os.path.dirname(MIGRATIONS_DIR)} && {url}pipenv run alembic {action} {revision}"
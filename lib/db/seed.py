@@ -1,5 +1,9 @@
 from .session import SessionLocal
-from .models import Flower, Customer, Order, OrderItem
+from .models import Flower, Customer, Order, OrderItem, StockMovement, StockCheckpoint, Reservation, FlowerPrice
+from .ledger import record_movement, set_quantity, SALE, RESTOCK
+from .bulkload import copy_rows
+from .prices import HISTORY_START
+from .reservations import reserve
 from datetime import datetime, timedelta
 from faker import Faker
 import random
@@ -19,6 +23,10 @@ def seed_database():
         inspector = inspect(engine)
         
         tables_to_clear = {
+            "reservations": Reservation,
+            "flower_prices": FlowerPrice,
+            "stock_checkpoints": StockCheckpoint,
+            "stock_movements": StockMovement,
             "order_items": OrderItem,
             "orders": Order,
             "flowers": Flower,
@@ -44,27 +52,32 @@ def seed_database():
         flowers = []
         for i in range(20):
             category = random.choice(flower_categories)
-            flowers.append(Flower(
+            flower = Flower(
                 name=f"{fake.color_name()} {category}",
                 price=round(random.uniform(5.99, 29.99), 2),
-                quantity=random.randint(5, 100),
+                quantity=0,
                 category=category,
-            ))
+            )
+            record_movement(db, flower, random.randint(5, 100), RESTOCK, note="initial stock")
+            flowers.append(flower)
         db.add_all(flowers)
+        db.flush()
+        # The seeded orders go back 90 days, so the prices apply from the start
+        db.add_all([
+            FlowerPrice(flower_id=flower.id, price=flower.price, effective_from=HISTORY_START)
+            for flower in flowers
+        ])
         db.commit()
         print(f"Seeded {len(flowers)} flowers")
         
         # Seed customers
         print("👥 Seeding customers...")
-        customers = []
-        for _ in range(30):
-            customers.append(Customer(
-                name=fake.name(),
-                phone=fake.phone_number(),
-                email=fake.email(),
-            ))
-        db.add_all(customers)
+        copy_rows(db, Customer.__table__, [
+            {"name": fake.name(), "phone": fake.phone_number(), "email": fake.email()}
+            for _ in range(30)
+        ])
         db.commit()
+        customers = db.query(Customer).all()
         print(f"Seeded {len(customers)} customers")
         
         # Create orders
@@ -73,6 +86,7 @@ def seed_database():
         order_items = []
         
         # Create orders for the last 90 days
+        reserved = {}
         for i in range(100):
             customer = random.choice(customers)
             order_date = fake.date_time_between(start_date="-90d", end_date="now")
@@ -86,17 +100,21 @@ def seed_database():
             db.add(order)
             db.flush()  # Get order ID
             
-            # Add 1-5 items to each order
+            # Add 1-5 items to each order; the database keeps order.total in step
             num_items = random.randint(1, 5)
-            order_total = 0
+            wanted = {}
             
             for _ in range(num_items):
                 flower = random.choice(flowers)
                 quantity = random.randint(1, 10)
                 
-                # Ensure we don't oversell
-                if quantity > flower.quantity:
-                    quantity = flower.quantity
+                # Ensure we don't oversell, or promise units a pending order holds
+                free = flower.quantity - reserved.get(flower.id, 0) - wanted.get(flower.id, 0)
+                if quantity > free:
+                    quantity = free
+                if quantity <= 0:
+                    continue
+                wanted[flower.id] = wanted.get(flower.id, 0) + quantity
                 
                 # Create order item
                 item = OrderItem(
@@ -105,17 +123,23 @@ def seed_database():
                     quantity=quantity
                 )
                 order_items.append(item)
-                
-                # Update order total
-                item_total = flower.price * quantity
-                order_total += item_total
+                db.add(item)
                 
                 # Update stock (only for completed orders)
                 if order.status == 'completed':
-                    flower.quantity -= quantity
+                    record_movement(db, flower, -quantity, SALE, order_id=order.id)
+            
+            # Every flower it picked was sold out
+            if not wanted:
+                orders.pop()
+                db.delete(order)
+                continue
             
-            # Set order total and add loyalty points
-            order.total = round(order_total, 2)
+            # Pending orders hold their flowers, as place_order does
+            if order.status == 'pending':
+                reserve(db, order.id, wanted.items())
+                for flower_id, units in wanted.items():
+                    reserved[flower_id] = reserved.get(flower_id, 0) + units
             
         db.commit()
         print(f"Seeded {len(orders)} orders with {len(order_items)} items")
@@ -124,7 +148,8 @@ def seed_database():
         print("⚠️ Creating low stock items...")
         low_stock_flowers = random.sample(flowers, 5)
         for flower in low_stock_flowers:
-            flower.quantity = random.randint(1, flower.low_stock_threshold)
+            quantity = max(reserved.get(flower.id, 0), random.randint(1, flower.low_stock_threshold))
+            set_quantity(db, flower, quantity, note="seed low stock")
         db.commit()
         
         print("✅ Database seeded successfully!")
@@ -0,0 +1,106 @@
+from bisect import bisect_left
+from datetime import datetime
+from sqlalchemy import func
+from .models import Order, CustomerSegment, StockMovement
+
+BINS = 5    # scores run from 1 (worst) to BINS (best)
+
+
+def quantile_scores(values, higher_is_better=True):
+    """Score each value 1..BINS by the quantile it falls in"""
+    ordered = sorted(values)
+    count = len(ordered)
+    scores = []
+    for value in values:
+        score = 1 + (bisect_left(ordered, value) * BINS) // count
+        scores.append(score if higher_is_better else BINS + 1 - score)
+    return scores
+
+
+def segment_name(r, f, m):
+    if r >= 4 and f >= 4:
+        return "Champions"
+    if f >= 4:
+        return "Loyal"
+    if r >= 4 and f <= 2:
+        return "New"
+    if r <= 2 and f >= 3:
+        return "At Risk"
+    if r <= 2:
+        return "Hibernating"
+    return "Needs Attention"
+
+
+def _aggregate(db, customer_ids=None):
+    """Last order, order count, spend and newest order id per customer"""
+    query = db.query(
+        Order.customer_id,
+        func.max(Order.created_at),
+        func.count(Order.id),
+        func.coalesce(func.sum(Order.total), 0),
+        func.max(Order.id)
+    ).filter(
+        Order.status == 'completed',
+        Order.customer_id.isnot(None)
+    )
+    if customer_ids is not None:
+        query = query.filter(Order.customer_id.in_(customer_ids))
+    return query.group_by(Order.customer_id).all()
+
+
+def refresh_segments(db, full=False, now=None):
+    """Recompute RFM segments and return how many customers were re-aggregated.
+
+    Only customers with orders completed or un-completed since the last run
+    are re-aggregated from the orders table; both write stock movements, so
+    the newest movement id seen is the watermark. Everyone is then
+    re-scored from the compact customer_segments rows, since quantiles and
+    recency move for all. Use `full` after merging customers.
+    """
+    now = now or datetime.now()
+    segments = {s.customer_id: s for s in db.query(CustomerSegment).all()}
+    last_movement_id = db.query(func.max(StockMovement.id)).scalar() or 0
+    watermarks = [s.last_movement_id for s in segments.values() if s.last_movement_id is not None]
+
+    if full or not watermarks:
+        rows = _aggregate(db)
+        stale = set(segments) - {row[0] for row in rows}
+    else:
+        changed = [c for c, in db.query(Order.customer_id).join(
+            StockMovement, StockMovement.order_id == Order.id
+        ).filter(
+            StockMovement.id > max(watermarks),
+            Order.customer_id.isnot(None)
+        ).distinct()]
+        rows = _aggregate(db, changed) if changed else []
+        # Customers whose last completed order was cancelled
+        stale = (set(changed) & set(segments)) - {row[0] for row in rows}
+    for customer_id in stale:
+        db.delete(segments.pop(customer_id))
+
+    for customer_id, last_order_at, frequency, monetary, last_order_id in rows:
+        segment = segments.get(customer_id)
+        if segment is None:
+            segment = CustomerSegment(customer_id=customer_id)
+            db.add(segment)
+            segments[customer_id] = segment
+        segment.last_order_at = last_order_at
+        segment.frequency = frequency
+        segment.monetary = monetary
+        segment.last_order_id = last_order_id
+
+    ordered = list(segments.values())
+    if ordered:
+        recency = [(now - s.last_order_at).days for s in ordered]
+        r_scores = quantile_scores(recency, higher_is_better=False)
+        f_scores = quantile_scores([s.frequency for s in ordered])
+        m_scores = quantile_scores([s.monetary for s in ordered])
+        for s, days, r, f, m in zip(ordered, recency, r_scores, f_scores, m_scores):
+            s.recency_days = days
+            s.r_score, s.f_score, s.m_score = r, f, m
+            s.segment = segment_name(r, f, m)
+            s.computed_at = now
+            s.last_movement_id = last_movement_id
+
+    db.commit()
+    return len(rows)
@@ -1,19 +1,111 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 import os
+from urllib.parse import quote
+from .metrics import instrument_engine
+
+# Database URL (matches alembic.ini); set MYSHOP_DATABASE_URL to use PostgreSQL,
+# e.g. postgresql+psycopg2://myshop@localhost/myshop
+SQLALCHEMY_DATABASE_URL = os.environ.get("MYSHOP_DATABASE_URL", "sqlite:///myshop.db")
+IS_SQLITE = make_url(SQLALCHEMY_DATABASE_URL).get_backend_name() == "sqlite"
+
+
+def read_only_url(url):
+    """The same database opened read-only: SQLite's file by absolute path"""
+    if make_url(url).get_backend_name() != "sqlite":
+        return url
+    path = quote(os.path.abspath(make_url(url).database))
+    return f"sqlite:///file:{path}?mode=ro&uri=true"
+
+# Read-only connections used by reports, searches and exports: the write
+# database opened read-only, or MYSHOP_READ_DATABASE_URL (e.g. a replica)
+READ_DATABASE_URL = os.environ.get("MYSHOP_READ_DATABASE_URL", read_only_url(SQLALCHEMY_DATABASE_URL))
+
+# Compiled SQL kept per engine; covers every statement shape the app uses
+QUERY_CACHE_SIZE = 1200
+
+# Seconds a connection waits for a lock before "database is locked"
+BUSY_TIMEOUT = 10
+
+
+def engine_options(url):
+    """create_engine() arguments for SQLite files or a PostgreSQL server"""
+    if make_url(url).get_backend_name() == "sqlite":
+        return {"connect_args": {"check_same_thread": False, "timeout": BUSY_TIMEOUT}}
+    return {
+        "connect_args": {"options": f"-c lock_timeout={BUSY_TIMEOUT * 1000}"},
+        "pool_pre_ping": True,
+    }
 
-# Database URL (matches alembic.ini)
-SQLALCHEMY_DATABASE_URL = "sqlite:///myshop.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False}
+    query_cache_size=QUERY_CACHE_SIZE,
+    **engine_options(SQLALCHEMY_DATABASE_URL)
+)
+read_engine = create_engine(
+    READ_DATABASE_URL,
+    query_cache_size=QUERY_CACHE_SIZE,
+    **engine_options(READ_DATABASE_URL)
 )
+
+@event.listens_for(engine, "connect")
+def _write_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers keep a snapshot while a checkout commits. auto_vacuum
+    # only takes effect on a new, empty file and must be set before WAL is;
+    # the migrations convert existing databases
+    if engine.dialect.name == "sqlite":
+        cursor = dbapi_connection.cursor()
+        if cursor.execute("PRAGMA page_count").fetchone()[0] == 0:
+            cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+@event.listens_for(read_engine, "connect")
+def _read_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    if read_engine.dialect.name == "sqlite":
+        cursor.execute("PRAGMA query_only=1")
+    else:
+        cursor.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+        dbapi_connection.commit()  # or the pool's reset-on-return undoes it
+    cursor.close()
+
+instrument_engine(engine, "write")
+instrument_engine(read_engine, "read")
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+@contextmanager
+def unit_of_work():
+    """Fresh session for one menu action.
+
+    Closing it detaches everything the action loaded, so a terminal left
+    open all day does not build up an identity map of every row it has
+    shown. Nothing is expired on commit: the session ends with the action,
+    and reloading rows that are only printed afterwards is wasted work.
+    """
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        yield db
+    finally:
+        db.close()
+
+@contextmanager
+def read_only():
+    """Session on the read-only engine, for screens that never write"""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -1,8 +1,20 @@
 import inquirer
 import os
-from tabulate import tabulate
+import sys
+import shutil
+import uuid
+from functools import wraps
+from itertools import chain, islice
 from sqlalchemy import or_, func
-from db.models import Flower, Customer, Order, OrderItem
+from db.session import read_only, unit_of_work
+from db.models import Flower, Customer, Order, OrderItem, StockMovement, FlowerPrice
+from db.ledger import record_movement, set_quantity, RESTOCK
+from db.recommendations import recommender
+from db.prices import set_price, price_at, price_in_effect, price_history, HISTORY_START
+from db.orders import place_order, change_order_status, count_bulk_targets, bulk_change_status
+from db import reports
+from db.lookups import get_flower, get_customer, get_order, order_rows_by_id
+from db.metrics import searched
 from datetime import datetime, timedelta
 
 #  Ui helper functions
@@ -26,9 +38,100 @@ def format_currency(amount):
     """Format number as currency"""
     return f"${amount:.2f}"
 
-def print_table(headers, data):
-    """Print data in a table format"""
-    print(tabulate(data, headers=headers, tablefmt="grid")) 
+# Table rendering
+SAMPLE_ROWS = 50        # rows used to size columns before printing starts
+MAX_COL_WIDTH = 40      # longer cells are cut to this width
+
+def _cell(value):
+    return "" if value is None else str(value)
+
+def _fit(text, width, right):
+    if len(text) > width:
+        text = text[:width - 1] + "~"
+    return text.rjust(width) if right else text.ljust(width)
+
+def render_table(headers, rows, widths=None):
+    """Yield the lines of a grid table while rows are still arriving.
+
+    Column widths come from `widths` (a list of hints) or from the first
+    SAMPLE_ROWS rows, so printing starts before the rest have been read.
+    Nothing is yielded when there are no rows.
+    """
+    rows = iter(rows)
+    sample = [[_cell(v) for v in row] for row in islice(rows, SAMPLE_ROWS)]
+    if not sample:
+        return
+    if widths is None:
+        widths = [
+            min(MAX_COL_WIDTH, max(len(h), *(len(r[i]) for r in sample)))
+            for i, h in enumerate(headers)
+        ]
+    right = [all(_is_number(r[i]) for r in sample) for i in range(len(headers))]
+    border = "+" + "+".join("-" * (w + 2) for w in widths) + "+"
+    
+    yield border
+    yield "| " + " | ".join(_fit(h, w, False) for h, w in zip(headers, widths)) + " |"
+    yield border.replace("-", "=")
+    for row in chain(sample, ([_cell(v) for v in row] for row in rows)):
+        yield "| " + " | ".join(_fit(c, w, r) for c, w, r in zip(row, widths, right)) + " |"
+        yield border
+
+def _is_number(text):
+    return text.lstrip("-$").replace(".", "", 1).isdigit() or text == ""
+
+def page(lines):
+    """Print lines a screen at a time when attached to a terminal"""
+    if not sys.stdout.isatty():
+        for line in lines:
+            print(line)
+        return
+    height = max(5, shutil.get_terminal_size().lines - 2)
+    for count, line in enumerate(lines, 1):
+        print(line)
+        if count % height == 0:
+            if input("-- More -- (Enter to continue, q to stop) ").strip().lower() == "q":
+                lines.close()
+                return
+
+def width_hints(db, headers, columns):
+    """Column widths taken from the stored data instead of a sample.
+
+    Each column is a fixed width or a SQL expression whose longest value
+    is looked up, so a long name far down a big table is not cut short.
+    """
+    widths = []
+    for header, column in zip(headers, columns):
+        if not isinstance(column, int):
+            column = db.query(func.max(func.length(column))).scalar() or 0
+        widths.append(min(MAX_COL_WIDTH, max(len(header), column)))
+    return widths
+
+def print_table(headers, data, widths=None):
+    """Print data in a table format, return how many rows were printed"""
+    count = 0
+    def counted():
+        nonlocal count
+        for row in data:
+            count += 1
+            yield row
+    page(render_table(headers, counted(), widths))
+    return count
+
+def read_only_screen(screen):
+    """Run a screen that never writes on a read-only session"""
+    @wraps(screen)
+    def wrapper():
+        with read_only() as reader:
+            return screen(reader)
+    return wrapper
+
+def action_screen(screen):
+    """Run a screen that writes in its own unit of work"""
+    @wraps(screen)
+    def wrapper():
+        with unit_of_work() as db:
+            return screen(db)
+    return wrapper
 
 #  databse initialization
 
@@ -66,7 +169,7 @@ def main_menu():
 
 #  Stock Management
 
-def stock_menu(db):
+def stock_menu():
     """Stock management menu"""
     while True:
         display_header("Stock Management")
@@ -80,38 +183,46 @@ def stock_menu(db):
                     ('Remove Flower', 'remove'),
                     ('Search Flowers', 'search'),
                     ('Check Low Stock', 'low_stock'),
+                    ('Replenishment Forecast', 'forecast'),
+                    ('Bulk Import (CSV)', 'import'),
+                    ('Stock On Date', 'stock_at'),
+                    ('Price History', 'prices'),
+                    ('Reconcile Stock Ledger', 'reconcile'),
                     ('Back to Main Menu', 'back')
                 ],
             )
         ])['action']
         
-        if choice == 'view': view_flowers(db)
-        elif choice == 'add': add_flower(db)
-        elif choice == 'update': update_flower(db)
-        elif choice == 'remove': remove_flower(db)
-        elif choice == 'search': search_flowers(db)
-        elif choice == 'low_stock': check_low_stock(db)
+        if choice == 'view': view_flowers()
+        elif choice == 'add': add_flower()
+        elif choice == 'update': update_flower()
+        elif choice == 'remove': remove_flower()
+        elif choice == 'search': search_flowers()
+        elif choice == 'low_stock': check_low_stock()
+        elif choice == 'forecast': view_replenishment_forecast()
+        elif choice == 'import': import_stock()
+        elif choice == 'stock_at': view_stock_at()
+        elif choice == 'prices': view_price_history()
+        elif choice == 'reconcile': reconcile_stock()
         elif choice == 'back': return
 
+@read_only_screen
 def view_flowers(db):
     """View all flowers in stock"""
     display_header("All Flowers")
-    flowers = db.query(Flower).order_by(Flower.name).all()
+    flowers = db.query(Flower).order_by(Flower.name).yield_per(500)
     
-    if not flowers:
-        print("No flowers in inventory")
-        press_enter()
-        return
-    
-    data = [[
+    data = ([
         f.id, f.name, format_currency(f.price), 
-        f.quantity, f.category, 
+        f.quantity, f.reserved, f.category, 
         "Low" if f.quantity < f.low_stock_threshold else " Ok"
-    ] for f in flowers]
+    ] for f in flowers)
     
-    print_table(["ID", "Name", "Price", "Qty", "Category", "Status"], data)
+    if not print_table(["ID", "Name", "Price", "Qty", "Reserved", "Category", "Status"], data):
+        print("No flowers in inventory")
     press_enter()
 
+@action_screen
 def add_flower(db):
     """Add a new flower to inventory"""
     display_header("Add New Flower")
@@ -126,12 +237,13 @@ def add_flower(db):
     try:
         flower = Flower(
             name=answers['name'],
-            price=float(answers['price']),
-            quantity=int(answers['quantity']),
+            quantity=0,
             category=answers['category'],
             low_stock_threshold=int(answers['threshold'])
         )
-        db.add(flower)
+        set_price(db, flower, float(answers['price']))
+        if int(answers['quantity']):
+            record_movement(db, flower, int(answers['quantity']), RESTOCK, note="initial stock")
         db.commit()
         print(f"\n Added {flower.name} successfully!")
     except Exception as e:
@@ -140,6 +252,7 @@ def add_flower(db):
     
     press_enter()
 
+@action_screen
 def update_flower(db):
     """Update flower details"""
     display_header("Update Flower")
@@ -155,7 +268,7 @@ def update_flower(db):
         inquirer.List('id', "Select flower to update", choices=choices)
     ])['id']
     
-    flower = db.query(Flower).get(flower_id)
+    flower = get_flower(db, flower_id)
     if not flower:
         print("Flower not found")
         press_enter()
@@ -171,8 +284,8 @@ def update_flower(db):
     
     try:
         flower.name = answers['name']
-        flower.price = float(answers['price'])
-        flower.quantity = int(answers['quantity'])
+        set_price(db, flower, float(answers['price']))
+        set_quantity(db, flower, int(answers['quantity']), note="manual update")
         flower.category = answers['category']
         flower.low_stock_threshold = int(answers['threshold'])
         db.commit()
@@ -183,6 +296,7 @@ def update_flower(db):
     
     press_enter()
 
+@action_screen
 def remove_flower(db):
     """Remove a flower from inventory"""
     display_header("Remove Flower")
@@ -202,7 +316,7 @@ def remove_flower(db):
     if not answers['confirm']:
         return
     
-    flower = db.query(Flower).get(answers['id'])
+    flower = get_flower(db, answers['id'])
     if not flower:
         print("Flower not found")
         press_enter()
@@ -210,9 +324,14 @@ def remove_flower(db):
     
     try:
         order_items = db.query(OrderItem).filter_by(flower_id=flower.id).count()
+        movements = db.query(StockMovement).filter_by(flower_id=flower.id).count()
         if order_items > 0:
             print(f"Cannot remove - found in {order_items} orders")
+        elif movements > 0:
+            # The stock ledger is history; a flower that ever held stock stays
+            print(f"Cannot remove - it has {movements} stock movements. Set its stock to 0 instead")
         else:
+            db.query(FlowerPrice).filter_by(flower_id=flower.id).delete()
             db.delete(flower)
             db.commit()
             print(f"\n Removed {flower.name} successfully!")
@@ -222,6 +341,7 @@ def remove_flower(db):
     
     press_enter()
 
+@read_only_screen
 def search_flowers(db):
     """Search flowers by name or category"""
     display_header("Search Flowers")
@@ -237,46 +357,232 @@ def search_flowers(db):
             Flower.name.ilike(f"%{query}%"),
             Flower.category.ilike(f"%{query}%")
         )
-    ).all()
-    
-    if not flowers:
-        print("No matching flowers found")
-        press_enter()
-        return
+    ).yield_per(500)
     
-    data = [[
+    data = ([
         f.id, f.name, format_currency(f.price), 
         f.quantity, f.category
-    ] for f in flowers]
+    ] for f in searched("flowers", flowers))
     
-    print_table(["ID", "Name", "Price", "Qty", "Category"], data)
+    if not print_table(["ID", "Name", "Price", "Qty", "Category"], data):
+        print("No matching flowers found")
     press_enter()
 
+@read_only_screen
 def check_low_stock(db):
     """Check low stock items"""
     display_header("Low Stock Alert")
     flowers = db.query(Flower).filter(
         Flower.quantity < Flower.low_stock_threshold
-    ).all()
+    ).yield_per(500)
     
-    if not flowers:
+    data = ([
+        f.id, f.name, f.quantity, 
+        f.low_stock_threshold, f.category
+    ] for f in flowers)
+    
+    if not print_table(["ID", "Name", "Current", "Threshold", "Category"], data):
         print(" All items are well stocked!")
+    press_enter()
+
+@action_screen
+def view_replenishment_forecast(db):
+    """Show sales velocity and suggested reorder points"""
+    from db.forecast import replenishment_forecast, apply_thresholds, WINDOW_DAYS
+    display_header("Replenishment Forecast")
+    forecasts = replenishment_forecast(db)
+    
+    if not forecasts:
+        print("No flowers in inventory")
         press_enter()
         return
     
     data = [[
-        f.id, f.name, f.quantity, 
-        f.low_stock_threshold, f.category
-    ] for f in flowers]
+        f.flower_id, f.name, f.quantity, f.moving_average, f.velocity,
+        f.threshold, f.reorder_point, f.reorder_quantity
+    ] for f in forecasts]
+    
+    print(f" Based on completed orders from the last {WINDOW_DAYS} days")
+    print_table(["ID", "Name", "Stock", "7-day Avg", "Per Day", "Threshold", "Reorder At", "Reorder Qty"], data)
+    
+    apply = inquirer.prompt([
+        inquirer.Confirm('apply', "Use suggested reorder points as low stock thresholds?", default=False)
+    ])['apply']
+    
+    if apply:
+        try:
+            updated = apply_thresholds(db, forecasts)
+            print(f"\n Updated thresholds for {updated} flowers")
+        except Exception as e:
+            db.rollback()
+            print(f"\n Error: {str(e)}")
     
-    print(" Low stock items:")
-    print_table(["ID", "Name", "Current", "Threshold", "Category"], data)
     press_enter()
 
 
+def print_import_diff(changes):
+    """Show the stock and price changes an import would make"""
+    data = [[
+        c.flower_id, c.name, c.old_quantity, c.new_quantity,
+        format_currency(c.old_price), format_currency(c.new_price)
+    ] for c in changes]
+    print_table(["ID", "Name", "Qty Before", "Qty After", "Price Before", "Price After"], data)
+
+@action_screen
+def import_stock(db):
+    """Bulk update stock counts and prices from a CSV file"""
+    from db.importer import plan_import, apply_import, StockImportError
+    display_header("Bulk Import (CSV)")
+    print("Columns: flower (ID or name), quantity (count, +delta or -delta), price")
+    path = inquirer.prompt([
+        inquirer.Text('path', "CSV file")
+    ])['path']
+    
+    if not path:
+        return
+    
+    try:
+        with open(path, newline='') as f:
+            changes = plan_import(db, f)
+    except OSError as e:
+        print(f"\n Error: {str(e)}")
+        press_enter()
+        return
+    except StockImportError as e:
+        print(f"\n Nothing imported, {len(e.errors)} invalid rows:")
+        for error in e.errors[:20]:
+            print(f"  {error}")
+        press_enter()
+        return
+    
+    if not changes:
+        print("\n No changes to apply")
+        press_enter()
+        return
+    
+    print_import_diff(changes)
+    confirm = inquirer.prompt([
+        inquirer.Confirm('confirm', f"Apply {len(changes)} changes?", default=False)
+    ])['confirm']
+    
+    if confirm:
+        try:
+            apply_import(db, changes)
+            print(f"\n Updated {len(changes)} flowers")
+        except StockImportError as e:
+            print("\n Nothing imported, stock changed since the preview:")
+            for error in e.errors:
+                print(f"  {error}")
+        except Exception as e:
+            db.rollback()
+            print(f"\n Error: {str(e)}")
+    
+    press_enter()
+
+@read_only_screen
+def view_stock_at(db):
+    """Show a flower's stock level at a past date"""
+    from db.ledger import stock_at
+    display_header("Stock On Date")
+    flowers = db.query(Flower).order_by(Flower.name).all()
+    
+    if not flowers:
+        print("No flowers available")
+        press_enter()
+        return
+    
+    choices = [(f"{f.name} (ID: {f.id})", f.id) for f in flowers]
+    answers = inquirer.prompt([
+        inquirer.List('id', "Select flower", choices=choices),
+        inquirer.Text('date', "Date and time (YYYY-MM-DD HH:MM)",
+            default=datetime.now().strftime('%Y-%m-%d %H:%M')),
+    ])
+    
+    try:
+        when = datetime.strptime(answers['date'], '%Y-%m-%d %H:%M')
+    except ValueError:
+        print("\n Error: use the format YYYY-MM-DD HH:MM")
+        press_enter()
+        return
+    
+    flower = get_flower(db, answers['id'])
+    print(f"\n {flower.name} at {when.strftime('%Y-%m-%d %H:%M')}: {stock_at(db, flower.id, when)}")
+    press_enter()
+
+@read_only_screen
+def view_price_history(db):
+    """Show a flower's price changes and its price at a past date"""
+    display_header("Price History")
+    flowers = db.query(Flower).order_by(Flower.name).all()
+    
+    if not flowers:
+        print("No flowers available")
+        press_enter()
+        return
+    
+    choices = [(f"{f.name} (ID: {f.id})", f.id) for f in flowers]
+    answers = inquirer.prompt([
+        inquirer.List('id', "Select flower", choices=choices),
+        inquirer.Text('date', "Price on (YYYY-MM-DD HH:MM)",
+            default=datetime.now().strftime('%Y-%m-%d %H:%M')),
+    ])
+    
+    try:
+        when = datetime.strptime(answers['date'], '%Y-%m-%d %H:%M')
+    except ValueError:
+        print("\n Error: use the format YYYY-MM-DD HH:MM")
+        press_enter()
+        return
+    
+    flower = get_flower(db, answers['id'])
+    data = ([
+        "before history" if effective_from == HISTORY_START else effective_from.strftime('%Y-%m-%d %H:%M'),
+        format_currency(price)
+    ] for effective_from, price in price_history(db, flower.id))
+    if not print_table(["Effective From", "Price"], data):
+        print("No price changes recorded")
+    price = price_at(db, flower.id, when)
+    print(f"\n {flower.name} on {when.strftime('%Y-%m-%d %H:%M')}: "
+          f"{format_currency(price) if price is not None else 'no price recorded'}")
+    press_enter()
+
+@action_screen
+def reconcile_stock(db):
+    """Check the stock ledger against current quantities"""
+    from db.ledger import reconcile, write_checkpoints
+    display_header("Reconcile Stock Ledger")
+    mismatches = reconcile(db)
+    
+    if not mismatches:
+        written = write_checkpoints(db)
+        print(f" Ledger matches stock on hand ({written} checkpoints written)")
+        press_enter()
+        return
+    
+    data = [[
+        f.id, f.name, f.quantity, balance, f.quantity - balance
+    ] for f, balance in mismatches]
+    
+    print(" Ledger differs from stock on hand:")
+    print_table(["ID", "Name", "On Hand", "Ledger", "Difference"], data)
+    
+    fix = inquirer.prompt([
+        inquirer.Confirm('fix', "Record adjustments so the ledger matches?", default=False)
+    ])['fix']
+    
+    if fix:
+        try:
+            reconcile(db, fix=True)
+            print(f"\n Recorded {len(mismatches)} adjustments")
+        except Exception as e:
+            db.rollback()
+            print(f"\n Error: {str(e)}")
+    
+    press_enter()
+
 # Customer Management 
 
-def customer_menu(db):
+def customer_menu():
     """Customer management menu"""
     while True:
         display_header("Customer Management")
@@ -289,36 +595,39 @@ def customer_menu(db):
                     ('Update Customer', 'update'),
                     ('Search Customers', 'search'),
                     ('View Purchase History', 'history'),
+                    ('Find Duplicates', 'duplicates'),
                     ('Back to Main Menu', 'back')
                 ],
             )
         ])['action']
         
-        if choice == 'view': view_customers(db)
-        elif choice == 'add': add_customer(db)
-        elif choice == 'update': update_customer(db)
-        elif choice == 'search': search_customers(db)
-        elif choice == 'history': view_customer_history(db)
+        if choice == 'view': view_customers()
+        elif choice == 'add': add_customer()
+        elif choice == 'update': update_customer()
+        elif choice == 'search': search_customers()
+        elif choice == 'history': view_customer_history()
+        elif choice == 'duplicates': find_duplicate_customers()
         elif choice == 'back': return
 
+@read_only_screen
 def view_customers(db):
     """View all customers"""
     display_header("All Customers")
-    customers = db.query(Customer).order_by(Customer.name).all()
-    
-    if not customers:
+    order_counts = db.query(
+        Order.customer_id, func.count(Order.id).label('orders')
+    ).group_by(Order.customer_id).subquery()
+    customers = db.query(
+        Customer.id, Customer.name, Customer.phone, Customer.email,
+        func.coalesce(order_counts.c.orders, 0)
+    ).outerjoin(order_counts, order_counts.c.customer_id == Customer.id).order_by(
+        Customer.name
+    ).yield_per(500)
+    
+    if not print_table(["ID", "Name", "Phone", "Email", "Orders"], customers):
         print("No customers found")
-        press_enter()
-        return
-    
-    data = [[
-        c.id, c.name, c.phone, 
-        c.email, len(c.orders)
-    ] for c in customers]
-    
-    print_table(["ID", "Name", "Phone", "Email", "Orders"], data)
     press_enter()
 
+@action_screen
 def add_customer(db):
     """Add a new customer"""
     display_header("Add New Customer")
@@ -343,6 +652,7 @@ def add_customer(db):
     
     press_enter()
 
+@action_screen
 def update_customer(db):
     """Update customer details"""
     display_header("Update Customer")
@@ -358,7 +668,7 @@ def update_customer(db):
         inquirer.List('id', "Select customer to update", choices=choices)
     ])['id']
     
-    customer = db.query(Customer).get(customer_id)
+    customer = get_customer(db, customer_id)
     if not customer:
         print("Customer not found")
         press_enter()
@@ -382,6 +692,7 @@ def update_customer(db):
     
     press_enter()
 
+@read_only_screen
 def search_customers(db):
     """Search customers by name, phone, or email"""
     display_header("Search Customers")
@@ -398,21 +709,18 @@ def search_customers(db):
             Customer.phone.ilike(f"%{query}%"),
             Customer.email.ilike(f"%{query}%")
         )
-    ).all()
-    
-    if not customers:
-        print("No matching customers found")
-        press_enter()
-        return
+    ).yield_per(500)
     
-    data = [[
+    data = ([
         c.id, c.name, c.phone, 
         c.email
-    ] for c in customers]
+    ] for c in searched("customers", customers))
     
-    print_table(["ID", "Name", "Phone", "Email"], data)
+    if not print_table(["ID", "Name", "Phone", "Email"], data):
+        print("No matching customers found")
     press_enter()
 
+@read_only_screen
 def view_customer_history(db):
     """View customer purchase history"""
     display_header("Customer History")
@@ -428,7 +736,7 @@ def view_customer_history(db):
         inquirer.List('id', "Select customer", choices=choices)
     ])['id']
     
-    customer = db.query(Customer).get(customer_id)
+    customer = get_customer(db, customer_id)
     if not customer:
         print("Customer not found")
         press_enter()
@@ -439,26 +747,68 @@ def view_customer_history(db):
     print(f" Email: {customer.email}")
     print("\nOrders:")
     
-    orders = customer.orders
-    if not orders:
+    # Price when the order was placed, as on the order details screen
+    price = func.coalesce(price_in_effect(OrderItem.flower_id, Order.created_at), Flower.price)
+    items = db.query(
+        Order.id, Order.created_at, Order.status, Flower.name, OrderItem.quantity, price, Order.total
+    ).join(OrderItem, OrderItem.order_id == Order.id).join(Flower).filter(
+        Order.customer_id == customer.id
+    ).order_by(Order.created_at.desc(), Order.id.desc(), OrderItem.id).yield_per(500)
+    
+    headers = ["Order", "Date", "Status", "Flower", "Qty", "Price", "Order Total"]
+    widths = width_hints(db, headers, [7, 10, 9, Flower.name, 3, 8, 10])
+    data = ([
+        f"#{order_id}", created_at.strftime('%Y-%m-%d'), status.capitalize(),
+        name, quantity, format_currency(price), format_currency(total or 0)
+    ] for order_id, created_at, status, name, quantity, price, total in items)
+    
+    if not print_table(headers, data, widths):
         print("No orders found")
+    press_enter()
+
+@action_screen
+def find_duplicate_customers(db):
+    """Find customers entered more than once and merge them"""
+    from db.dedupe import find_duplicates, merge_candidates, AUTO_MERGE_SCORE
+    from db.segments import refresh_segments
+    display_header("Find Duplicates")
+    candidates = find_duplicates(db)
+    
+    if not candidates:
+        print("No likely duplicates found")
         press_enter()
         return
     
-    for order in orders:
-        print(f"\n Order #{order.id} - {order.created_at.strftime('%Y-%m-%d')}")
-        print(f"   Status: {order.status.capitalize()}")
-        print(f"   Total: {format_currency(order.total)}")
-        
-        for item in order.items:
-            print(f"   - {item.flower.name}: {item.quantity} x {format_currency(item.flower.price)}")
+    data = [[
+        f"{c.score:.2f}", f"#{c.keep.id} {c.keep.label}", f"#{c.drop.id} {c.drop.label}",
+        c.keep.orders + c.drop.orders, ", ".join(c.reasons)
+    ] for c in candidates]
+    print_table(["Score", "Keep", "Merge In", "Orders", "Matched On"], data)
+    
+    choices = [(f"#{c.drop.id} into #{c.keep.id} ({c.score:.2f})", i) for i, c in enumerate(candidates)]
+    chosen = inquirer.prompt([
+        inquirer.Checkbox('merge', "Select duplicates to merge", choices=choices,
+                          default=[i for i, c in enumerate(candidates) if c.score >= AUTO_MERGE_SCORE])
+    ])['merge']
+    if not chosen or not inquirer.prompt([
+        inquirer.Confirm('confirm', f"Merge {len(chosen)} customers?", default=False)
+    ])['confirm']:
+        return
+    
+    try:
+        merged, moved = merge_candidates(db, [candidates[i] for i in chosen])
+        refresh_segments(db, full=True)
+        print(f"\n Merged {merged} customers, moving {moved} orders")
+    except Exception as e:
+        db.rollback()
+        print(f"\n Error: {str(e)}")
     
     press_enter()
 
 
 #  Order Management
 
-def order_menu(db):
+def order_menu():
     """Order management menu"""
     while True:
         display_header("Order Management")
@@ -469,6 +819,7 @@ def order_menu(db):
                     ('View All Orders', 'view'),
                     ('Create New Order', 'create'),
                     ('Update Order Status', 'update'),
+                    ('Bulk Status Change', 'bulk'),
                     ('View Order Details', 'details'),
                     ('Search Orders', 'search'),
                     ('Back to Main Menu', 'back')
@@ -476,42 +827,39 @@ def order_menu(db):
             )
         ])['action']
         
-        if choice == 'view': view_orders(db)
-        elif choice == 'create': create_order(db)
-        elif choice == 'update': update_order_status(db)
-        elif choice == 'details': view_order_details(db)
-        elif choice == 'search': search_orders(db)
+        if choice == 'view': view_orders()
+        elif choice == 'create': create_order()
+        elif choice == 'update': update_order_status()
+        elif choice == 'bulk': bulk_update_order_status()
+        elif choice == 'details': view_order_details()
+        elif choice == 'search': search_orders()
         elif choice == 'back': return
 
+@read_only_screen
 def view_orders(db):
     """View all orders"""
     display_header("All Orders")
-    orders = db.query(Order).order_by(Order.created_at.desc()).all()
-    
-    if not orders:
+    orders = db.query(
+        Order.id, Customer.name, Order.created_at, Order.total, Order.status
+    ).outerjoin(Customer).order_by(Order.created_at.desc()).yield_per(500)
+    
+    data = ([
+        order_id, name, 
+        created_at.strftime('%Y-%m-%d'),
+        format_currency(total or 0), (status or 'pending').upper()
+    ] for order_id, name, created_at, total, status in orders)
+    
+    # Sized from the whole table: the newest orders are not the widest
+    headers = ["ID", "Customer", "Date", "Total", "Status"]
+    largest_id, largest_total = db.query(func.max(Order.id), func.max(Order.total)).one()
+    widths = width_hints(db, headers, [
+        len(str(largest_id or 0)), Customer.name, 10, len(format_currency(largest_total or 0)), 9
+    ])
+    if not print_table(headers, data, widths):
         print("No orders found")
-        press_enter()
-        return
-    
-    data = []
-    for order in orders:
-        status = ""
-        if order.status == 'completed':
-            status = "COMPLETED"
-        elif order.status == 'cancelled':
-            status = "CANCELLED"
-        else:
-            status = "PENDING"
-        
-        data.append([
-            order.id, order.customer.name, 
-            order.created_at.strftime('%Y-%m-%d'),
-            format_currency(order.total), status
-        ])
-    
-    print_table(["ID", "Customer", "Date", "Total", "Status"], data)
     press_enter()
 
+@action_screen
 def create_order(db):
     """Create a new order"""
     display_header("Create New Order")
@@ -528,18 +876,25 @@ def create_order(db):
         inquirer.List('id', "Select customer", choices=choices)
     ])['id']
     
-    # Create order
-    order = Order(customer_id=customer_id)
-    db.add(order)
-    db.flush()  # Get ID without committing
-    
+    # Build the basket; nothing is written until the order is placed
+    basket = {}
+    recommender.refresh(db)
     
     while True:
-        flowers = db.query(Flower).filter(Flower.quantity > 0).all()
+        flowers = [
+            f for f in db.query(Flower).filter(Flower.quantity - Flower.reserved > 0).all()
+            if f.available() > basket.get(f.id, 0)
+        ]
         if not flowers:
             print("No flowers available")
             break
         
+        # Frequently bought together with what is already in the basket
+        by_id = {f.id: f for f in flowers}
+        suggested = [by_id[f] for f in recommender.suggest(basket, allowed=by_id)]
+        if suggested:
+            print("Often bought together: " + ", ".join(f.name for f in suggested))
+        
         choices = [
             ('Add another item', 'add'),
             ('Finish order', 'finish'),
@@ -552,42 +907,36 @@ def create_order(db):
         if action == 'finish':
             break
         elif action == 'cancel':
-            db.rollback()
             print("\n Order canceled")
             press_enter()
             return
         
         # Select flower
-        choices = [(f"{f.name} - {format_currency(f.price)} (Stock: {f.quantity})", f.id) for f in flowers]
+        suggested_ids = [f.id for f in suggested]
+        flowers.sort(key=lambda f: suggested_ids.index(f.id) if f.id in suggested_ids else len(suggested_ids))
+        choices = [(f"{f.name} - {format_currency(f.price)} (Available: {f.available() - basket.get(f.id, 0)})"
+                    + (" *suggested*" if f.id in suggested_ids else ""), f.id) for f in flowers]
         flower_id = inquirer.prompt([
             inquirer.List('id', "Select flower", choices=choices)
         ])['id']
         
-        flower = db.query(Flower).get(flower_id)
+        flower = get_flower(db, flower_id)
+        available = flower.available() - basket.get(flower.id, 0)
         
         # Select quantity
         quantity = inquirer.prompt([
             inquirer.Text('qty', 
-                f"How many? (1-{flower.quantity})", 
-                validate=lambda _, x: x.isdigit() and 1 <= int(x) <= flower.quantity)
+                f"How many? (1-{available})", 
+                validate=lambda _, x: x.isdigit() and 1 <= int(x) <= available)
         ])['qty']
         quantity = int(quantity)
         
         # Add item
-        order_item = OrderItem(
-            order_id=order.id,
-            flower_id=flower.id,
-            quantity=quantity
-        )
-        db.add(order_item)
-        
-        # Update order total
-        order.total = (order.total or 0) + (flower.price * quantity)
+        basket[flower.id] = basket.get(flower.id, 0) + quantity
         print(f"Added {quantity} {flower.name} to order")
     
     # Finalize order
-    if not order.items:
-        db.rollback()
+    if not basket:
         print("\n Order canceled - no items added")
         press_enter()
         return
@@ -599,24 +948,32 @@ def create_order(db):
             default='completed')
     ])['status']
     
-    order.status = status
-    
-    # Update stock if completed
-    if status == 'completed':
-        for item in order.items:
-            flower = db.query(Flower).get(item.flower_id)
-            flower.quantity -= item.quantity
-    
-    try:
-        db.commit()
-        print(f"\n Order #{order.id} created successfully!")
-        print(f"Total: {format_currency(order.total)}")
-    except Exception as e:
-        db.rollback()
-        print(f"\n Error creating order: {str(e)}")
+    # One key for this order, reused on retry, so an order whose commit went
+    # through before the error is not booked twice
+    key = uuid.uuid4().hex
+    while True:
+        try:
+            order_id, created = place_order(db, customer_id, list(basket.items()), status=status,
+                                            idempotency_key=key)
+            order = get_order(db, order_id)
+            if created:
+                print(f"\n Order #{order.id} created successfully!")
+            else:
+                print(f"\n Order #{order.id} was already created")
+            print(f"Total: {format_currency(order.total)}")
+            break
+        except Exception as e:
+            db.rollback()
+            print(f"\n Error creating order: {str(e)}")
+            retry = inquirer.prompt([
+                inquirer.Confirm('retry', "Try again?", default=False)
+            ])['retry']
+            if not retry:
+                break
     
     press_enter()
 
+@action_screen
 def update_order_status(db):
     """Update order status"""
     display_header("Update Order Status")
@@ -634,7 +991,7 @@ def update_order_status(db):
             choices=[('Completed', 'completed'), ('Pending', 'pending'), ('Cancelled', 'cancelled')])
     ])
     
-    order = db.query(Order).get(answers['id'])
+    order = get_order(db, answers['id'])
     if not order:
         print("Order not found")
         press_enter()
@@ -643,27 +1000,82 @@ def update_order_status(db):
     new_status = answers['status']
     
     try:
-        # Handle status changes
-        if new_status == 'completed' and order.status != 'completed':
-            for item in order.items:
-                flower = item.flower
-                flower.quantity -= item.quantity
-        
-        elif new_status == 'cancelled' and order.status == 'completed':
-            # Restore stock
-            for item in order.items:
-                flower = item.flower
-                flower.quantity += item.quantity
-        
-        order.status = new_status
-        db.commit()
-        print(f"\n Order #{order.id} updated to {new_status} successfully!")
+        if change_order_status(db, order.id, new_status) is None:
+            print(f"\n Order #{order.id} was changed by another terminal, please try again")
+        else:
+            print(f"\n Order #{order.id} updated to {new_status} successfully!")
     except Exception as e:
         db.rollback()
         print(f"\n Error: {str(e)}")
     
     press_enter()
 
+def parse_order_ids(text):
+    """Parse order IDs like "4, 7 12-20" into a list"""
+    ids = []
+    for part in text.replace(',', ' ').split():
+        if '-' in part:
+            start, end = part.split('-', 1)
+            ids.extend(range(int(start), int(end) + 1))
+        else:
+            ids.append(int(part))
+    return ids
+
+@action_screen
+def bulk_update_order_status(db):
+    """Change the status of many orders at once"""
+    display_header("Bulk Status Change")
+    answers = inquirer.prompt([
+        inquirer.List('mode', "Select orders by",
+            choices=[('Status and creation date', 'date'), ('List of order IDs', 'ids')]),
+        inquirer.List('status', "New status", 
+            choices=[('Completed', 'completed'), ('Pending', 'pending'), ('Cancelled', 'cancelled')])
+    ])
+    new_status = answers['status']
+    
+    criteria = {}
+    try:
+        if answers['mode'] == 'ids':
+            text = inquirer.prompt([
+                inquirer.Text('ids', "Order IDs (e.g. 4, 7, 12-20)")
+            ])['ids']
+            criteria['order_ids'] = parse_order_ids(text)
+        else:
+            filters = inquirer.prompt([
+                inquirer.List('from_status', "Current status", 
+                    choices=[('Pending', 'pending'), ('Completed', 'completed'), ('Cancelled', 'cancelled')]),
+                inquirer.Text('before', "Created before (YYYY-MM-DD)",
+                    default=datetime.now().strftime('%Y-%m-%d'))
+            ])
+            criteria['from_status'] = filters['from_status']
+            criteria['created_before'] = datetime.strptime(filters['before'], '%Y-%m-%d')
+    except ValueError:
+        print("\n Error: could not read the order IDs or date")
+        press_enter()
+        return
+    
+    count = count_bulk_targets(db, new_status, **criteria)
+    if not count:
+        print("\n No matching orders need changing")
+        press_enter()
+        return
+    
+    confirm = inquirer.prompt([
+        inquirer.Confirm('confirm', f"Change {count} orders to {new_status}?", default=False)
+    ])['confirm']
+    
+    if confirm:
+        try:
+            changed, flowers, units = bulk_change_status(db, new_status, **criteria)
+            print(f"\n Updated {changed} orders to {new_status}")
+            print(f" Stock adjusted for {flowers} flowers ({units} units)")
+        except Exception as e:
+            db.rollback()
+            print(f"\n Error: {str(e)}")
+    
+    press_enter()
+
+@read_only_screen
 def view_order_details(db):
     """View order details"""
     display_header("Order Details")
@@ -679,7 +1091,7 @@ def view_order_details(db):
         inquirer.List('id', "Select order", choices=choices)
     ])['id']
     
-    order = db.query(Order).get(order_id)
+    order = get_order(db, order_id)
     if not order:
         print("Order not found")
         press_enter()
@@ -692,15 +1104,20 @@ def view_order_details(db):
     print(f"Total: {format_currency(order.total)}\n")
     
     print("Items:")
+    prices = {
+        item.flower_id: price_at(db, item.flower_id, order.created_at) or item.flower.price
+        for item in order.items
+    }
     data = [[
         item.flower.name, item.quantity, 
-        format_currency(item.flower.price), 
-        format_currency(item.quantity * item.flower.price)
+        format_currency(prices[item.flower_id]), 
+        format_currency(item.quantity * prices[item.flower_id])
     ] for item in order.items]
     
     print_table(["Flower", "Qty", "Price", "Total"], data)
     press_enter()
 
+@read_only_screen
 def search_orders(db):
     """Search orders by ID or customer name"""
     display_header("Search Orders")
@@ -714,35 +1131,30 @@ def search_orders(db):
     try:
         # Search by ID if query is numeric
         order_id = int(query)
-        orders = db.query(Order).filter(Order.id == order_id).all()
+        orders = order_rows_by_id(db, order_id)
     except ValueError:
         # Search by customer name
-        orders = db.query(Order).join(Customer).filter(
+        orders = db.query(
+            Order.id, Customer.name, Order.created_at, Order.total, Order.status
+        ).outerjoin(Customer).filter(
             Customer.name.ilike(f"%{query}%")
-        ).all()
+        ).yield_per(500)
     
-    if not orders:
-        print("No matching orders found")
-        press_enter()
-        return
-    
-    data = []
-    for order in orders:
-        status = " COMPLETED" if order.status == 'completed' else (
-            " CANCELLED" if order.status == 'cancelled' else "🔄 PENDING"
+    data = ([
+        order_id, name, 
+        created_at.strftime('%Y-%m-%d'),
+        format_currency(total or 0), " COMPLETED" if status == 'completed' else (
+            " CANCELLED" if status == 'cancelled' else "🔄 PENDING"
         )
-        data.append([
-            order.id, order.customer.name, 
-            order.created_at.strftime('%Y-%m-%d'),
-            format_currency(order.total), status
-        ])
+    ] for order_id, name, created_at, total, status in orders)
     
-    print_table(["ID", "Customer", "Date", "Total", "Status"], data)
+    if not print_table(["ID", "Customer", "Date", "Total", "Status"], data):
+        print("No matching orders found")
     press_enter() 
 
     # General Expense Reports 
 
-def reports_menu(db):
+def reports_menu():
         """Reports menu"""
         while True:
             display_header("Reports")
@@ -753,93 +1165,140 @@ def reports_menu(db):
                         ('Sales Summary', 'sales'),
                         ('Top Selling Flowers', 'flowers'),
                         ('Top Customers', 'customers'),
+                        ('Customer Segments', 'segments'),
+                        ('Scheduled Runs', 'runs'),
                         ('Back to Main Menu', 'back')
                     ],
                 )
             ])['action']
             
-            if choice == 'sales': sales_summary(db)
-            elif choice == 'flowers': top_flowers(db)
-            elif choice == 'customers': top_customers(db)
+            if choice == 'sales': sales_summary()
+            elif choice == 'flowers': top_flowers()
+            elif choice == 'customers': top_customers()
+            elif choice == 'segments': customer_segments()
+            elif choice == 'runs': scheduled_runs()
             elif choice == 'back': return
 
+def display_cache_age(age):
+    """Show how old a cached report is"""
+    if age < 1:
+        print("(just computed)\n")
+    elif age < 60:
+        print(f"(cached {int(age)}s ago)\n")
+    elif age < 3600:
+        print(f"(cached {int(age // 60)}m ago)\n")
+    else:
+        print(f"(cached {int(age // 3600)}h ago)\n")
+
+@read_only_screen
 def sales_summary(db):
     """Sales summary report"""
     display_header("Sales Summary")
+    summary, age = reports.sales_summary(db)
+    display_cache_age(age)
     
-    # Total sales
-    total_sales = db.query(func.sum(Order.total)).filter(
-        Order.status == 'completed'
-    ).scalar() or 0
-    
-    # Recent sales (last 7 days)
-    recent_sales = db.query(func.sum(Order.total)).filter(
-        Order.status == 'completed',
-        Order.created_at >= datetime.now() - timedelta(days=7)
-    ).scalar() or 0
-    
-    # Order count
-    order_count = db.query(Order).filter(
-        Order.status == 'completed'
-    ).count()
-    
-    print(f"Total Sales: {format_currency(total_sales)}")
-    print(f"Recent Sales (7 days): {format_currency(recent_sales)}")
-    print(f"Total Orders: {order_count}")
+    print(f"Total Sales: {format_currency(summary['total_sales'])}")
+    print(f"Recent Sales (7 days): {format_currency(summary['recent_sales'])}")
+    print(f"Total Orders: {summary['order_count']}")
     press_enter()
 
+@read_only_screen
 def top_flowers(db):
     """Top selling flowers report"""
     display_header("Top Selling Flowers")
-    
-    results = db.query(
-        Flower.name,
-        func.sum(OrderItem.quantity).label('total_sold'),
-        func.sum(OrderItem.quantity * Flower.price).label('total_revenue')
-    ).join(OrderItem).join(Order).filter(
-        Order.status == 'completed'
-    ).group_by(Flower.name).order_by(
-        func.sum(OrderItem.quantity).desc()
-    ).limit(10).all()
+    results, age = reports.top_flowers(db)
     
     if not results:
         print("No sales data available")
         press_enter()
         return
     
+    display_cache_age(age)
     data = []
-    for i, row in enumerate(results, 1):
+    for i, (name, total_sold, total_revenue) in enumerate(results, 1):
         data.append([
-            i, row.name, row.total_sold, format_currency(row.total_revenue)
+            i, name, total_sold, format_currency(total_revenue)
         ])
     
     print_table(["Rank", "Flower", "Units Sold", "Revenue"], data)
     press_enter()
 
+@read_only_screen
 def top_customers(db):
     """Top customers report"""
     display_header("Top Customers")
-    
-    results = db.query(
-        Customer.name,
-        func.count(Order.id).label('order_count'),
-        func.sum(Order.total).label('total_spent')
-    ).join(Order).filter(
-        Order.status == 'completed'
-    ).group_by(Customer.name).order_by(
-        func.sum(Order.total).desc()
-    ).limit(10).all()
+    results, age = reports.top_customers(db)
     
     if not results:
         print("No customer data available")
         press_enter()
         return
     
+    display_cache_age(age)
     data = []
-    for i, row in enumerate(results, 1):
+    for i, (name, order_count, total_spent) in enumerate(results, 1):
         data.append([
-            i, row.name, row.order_count, format_currency(row.total_spent)
+            i, name, order_count, format_currency(total_spent)
         ])
     
     print_table(["Rank", "Customer", "Orders", "Total Spent"], data)
-    press_enter()
\ No newline at end of file
+    press_enter()
+
+@action_screen
+def customer_segments(db):
+    """Browse customers by RFM segment"""
+    from db.models import CustomerSegment
+    from db.segments import refresh_segments
+    display_header("Customer Segments")
+    
+    if inquirer.prompt([
+        inquirer.Confirm('refresh', "Refresh segments for customers with changed orders first?", default=False)
+    ])['refresh']:
+        try:
+            refreshed = refresh_segments(db)
+            print(f"\n Refreshed {refreshed} customers\n")
+        except Exception as e:
+            db.rollback()
+            print(f"\n Error: {str(e)}")
+    
+    counts = db.query(
+        CustomerSegment.segment, func.count(CustomerSegment.customer_id)
+    ).group_by(CustomerSegment.segment).order_by(func.count(CustomerSegment.customer_id).desc()).all()
+    
+    if not counts:
+        print("No segments computed yet")
+        press_enter()
+        return
+    
+    choices = [(f"{segment} ({count})", segment) for segment, count in counts]
+    segment = inquirer.prompt([
+        inquirer.List('segment', "Select segment", choices=choices)
+    ])['segment']
+    
+    rows = db.query(CustomerSegment).filter(
+        CustomerSegment.segment == segment
+    ).order_by(CustomerSegment.monetary.desc()).all()
+    
+    display_header(f"Segment: {segment}")
+    print(f"(computed {rows[0].computed_at.strftime('%Y-%m-%d %H:%M')})\n")
+    data = [[
+        r.customer_id, r.customer.name, r.recency_days, r.frequency,
+        format_currency(r.monetary), f"{r.r_score}{r.f_score}{r.m_score}"
+    ] for r in rows]
+    
+    print_table(["ID", "Customer", "Days Since", "Orders", "Spent", "RFM"], data)
+    press_enter()
+
+@read_only_screen
+def scheduled_runs(db):
+    """Recent background report runs"""
+    display_header("Scheduled Runs")
+    runs = reports.recent_runs(db)
+    data = [[
+        r.report, r.started_at.strftime('%Y-%m-%d %H:%M:%S'), r.status,
+        f"{r.duration_ms} ms", r.error or ""
+    ] for r in runs]
+    
+    if not print_table(["Report", "Started", "Status", "Duration", "Error"], data):
+        print("No reports have been precomputed yet")
+    press_enter()
@@ -0,0 +1,242 @@
+import argparse
+import multiprocessing
+import random
+import time
+import uuid
+from sqlalchemy import create_engine, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from db.models import Flower, Customer, Order, OrderItem, StockMovement
+from db.ledger import record_movement, reconcile, RESTOCK
+from db.orders import place_order, change_order_status
+from db.lookups import get_flower, get_order
+from db.reservations import reservation_mismatches, InsufficientStock
+
+LOCK_TIMEOUT = 5          # seconds SQLite waits on a lock before raising
+MAX_RETRIES = 20          # attempts per operation on "database is locked"
+RESUBMIT = 0.05           # share of orders submitted twice, like a double-clicked till
+
+# Relative weights of each operation in a worker's mix
+OPERATIONS = [
+    ('create', 50),
+    ('complete', 20),
+    ('cancel', 15),
+    ('restock', 15),
+]
+
+
+def make_session(path):
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False, "timeout": LOCK_TIMEOUT}
+    )
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def _is_locked(error):
+    return "database is locked" in str(error)
+
+
+def _create(db, rng, customer_ids, flower_ids, key):
+    items = {}
+    for flower_id in rng.sample(flower_ids, min(len(flower_ids), rng.randint(1, 3))):
+        items[flower_id] = rng.randint(1, 3)
+    in_stock = dict(db.query(Flower.id, Flower.quantity - Flower.reserved).filter(Flower.id.in_(items)).all())
+    status = 'completed' if rng.random() < 0.5 else 'pending'
+    if status == 'completed' and any(in_stock.get(f, 0) < q for f, q in items.items()):
+        status = 'pending'
+    return place_order(db, rng.choice(customer_ids), list(items.items()), status=status, idempotency_key=key)[1]
+
+
+def _change(db, rng, from_status, to_status):
+    order_id = db.query(func.max(Order.id)).filter(Order.status == from_status).scalar()
+    if order_id is None:
+        return
+    order_id = rng.randint(max(1, order_id - 50), order_id)
+    order = get_order(db, order_id)
+    if order is not None and order.status == from_status:
+        change_order_status(db, order_id, to_status)
+
+
+def _restock(db, rng, flower_ids):
+    flower = get_flower(db, rng.choice(flower_ids))
+    record_movement(db, flower, rng.randint(5, 20), RESTOCK, note="load test")
+    db.commit()
+
+
+def run_operation(db, rng, operation, customer_ids, flower_ids, key=None):
+    """Run one operation; False if it was an order already placed under `key`"""
+    if operation == 'create':
+        return _create(db, rng, customer_ids, flower_ids, key)
+    elif operation == 'complete':
+        _change(db, rng, 'pending', 'completed')
+    elif operation == 'cancel':
+        _change(db, rng, rng.choice(['pending', 'completed']), 'cancelled')
+    elif operation == 'restock':
+        _restock(db, rng, flower_ids)
+    return True
+
+
+def worker(path, duration, seed, results):
+    """One cashier: run a random operation mix until `duration` is up"""
+    rng = random.Random(seed)
+    db = make_session(path)
+    customer_ids = [c for c, in db.query(Customer.id).all()]
+    flower_ids = [f for f, in db.query(Flower.id).all()]
+    names = [name for name, _ in OPERATIONS]
+    weights = [weight for _, weight in OPERATIONS]
+
+    latencies = {name: [] for name in names}
+    retries = 0
+    errors = 0
+    sold_out = 0
+    resubmitted = duplicates = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        operation = rng.choices(names, weights)[0]
+        key = uuid.uuid4().hex  # retries reuse the order's key
+        started = time.perf_counter()
+        for _ in range(MAX_RETRIES):
+            try:
+                run_operation(db, rng, operation, customer_ids, flower_ids, key)
+                break
+            except InsufficientStock:
+                sold_out += 1
+                key = None
+                break
+            except OperationalError as e:
+                db.rollback()
+                if not _is_locked(e):
+                    raise
+                retries += 1
+                time.sleep(rng.uniform(0.001, 0.01))
+        else:
+            errors += 1
+            continue
+        latencies[operation].append(time.perf_counter() - started)
+
+        if operation == 'create' and key and rng.random() < RESUBMIT:
+            # The same order again; it must come back as the one just placed
+            try:
+                created = run_operation(db, rng, operation, customer_ids, flower_ids, key)
+                resubmitted += 1
+                duplicates += not created
+            except (InsufficientStock, OperationalError):
+                db.rollback()
+
+    db.close()
+    results.put((latencies, retries, errors, sold_out, resubmitted, duplicates))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def order_stock_totals(db):
+    """Per flower: stock moved by orders, and units in completed orders"""
+    moved = dict(db.query(StockMovement.flower_id, func.sum(StockMovement.change)).filter(
+        StockMovement.order_id.isnot(None)
+    ).group_by(StockMovement.flower_id).all())
+    sold = dict(db.query(OrderItem.flower_id, func.sum(OrderItem.quantity)).join(Order).filter(
+        Order.status == 'completed'
+    ).group_by(OrderItem.flower_id).all())
+    return moved, sold
+
+
+def consistency_problems(db, before):
+    """Check stock against the ledger, and the ledger against order history.
+
+    Only changes made during the run are compared with the order history,
+    so history recorded before the ledger existed does not count.
+    """
+    problems = [
+        f"{flower.name}: on hand {flower.quantity}, ledger {balance}"
+        for flower, balance in reconcile(db)
+    ]
+    problems += [
+        f"{flower.name}: reserved {flower.reserved}, reservations {held}"
+        for flower, held in reservation_mismatches(db)
+    ]
+    problems += [
+        f"{flower.name}: oversold, on hand {flower.quantity}, reserved {flower.reserved}"
+        for flower in db.query(Flower).filter(Flower.quantity - Flower.reserved < 0)
+    ]
+    moved_before, sold_before = before
+    moved, sold = order_stock_totals(db)
+    for flower_id in set(moved) | set(sold) | set(moved_before) | set(sold_before):
+        moved_delta = (moved.get(flower_id) or 0) - (moved_before.get(flower_id) or 0)
+        sold_delta = (sold.get(flower_id) or 0) - (sold_before.get(flower_id) or 0)
+        if -moved_delta != sold_delta:
+            problems.append(
+                f"flower {flower_id}: stock moved by orders {moved_delta}, completed units {sold_delta}"
+            )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the order path with N cashier processes")
+    parser.add_argument('database', help="path to a seeded copy of myshop.db")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=30, help="seconds to run")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    db = make_session(args.database)
+    before = order_stock_totals(db)
+    db.close()
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(args.database, args.duration, args.seed + i, results))
+        for i in range(args.workers)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = {name: [] for name, _ in OPERATIONS}
+    retries = errors = sold_out = resubmitted = duplicates = 0
+    for worker_latencies, worker_retries, worker_errors, worker_sold_out, worker_resubmitted, \
+            worker_duplicates in collected:
+        for name, values in worker_latencies.items():
+            latencies[name].extend(values)
+        retries += worker_retries
+        errors += worker_errors
+        sold_out += worker_sold_out
+        resubmitted += worker_resubmitted
+        duplicates += worker_duplicates
+
+    print(f"{args.workers} workers for {elapsed:.1f}s")
+    print(f"Orders/sec: {len(latencies['create']) / elapsed:.1f}")
+    print(f"'database is locked' retries: {retries}, gave up: {errors}")
+    print(f"Turned away for lack of stock: {sold_out}")
+    print(f"Orders submitted twice: {resubmitted}, recognised as duplicates: {duplicates}")
+    print(f"{'Operation':<10} {'Count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, values in latencies.items():
+        print(f"{name:<10} {len(values):>7} "
+              f"{percentile(values, 50) * 1000:>8.1f} {percentile(values, 95) * 1000:>8.1f} "
+              f"{percentile(values, 99) * 1000:>8.1f} {max(values, default=0) * 1000:>8.1f}")
+
+    db = make_session(args.database)
+    problems = consistency_problems(db, before)
+    db.close()
+    if duplicates < resubmitted:
+        problems.append(f"{resubmitted - duplicates} resubmitted orders were booked twice")
+    if problems:
+        print(f"Stock consistency: {len(problems)} problems")
+        for problem in problems:
+            print(f"  {problem}")
+        raise SystemExit(1)
+    print("Stock consistency: ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+import argparse
+import json
+import math
+import random
+import time
+from datetime import date, datetime, timedelta
+from db.session import SessionLocal
+from db.models import Flower, Customer
+from db.ledger import record_movement, RESTOCK
+from db.orders import place_order, change_order_status
+from db.lookups import get_flower
+from db.reservations import InsufficientStock
+from db import reports
+from loadtest import percentile
+
+TRACE_VERSION = 1
+DAY = 24 * 3600
+
+# Demand on an ordinary day
+ORDERS_PER_DAY = 40
+WEEKDAYS = [0.8, 0.85, 0.9, 1.0, 1.4, 1.6, 0.6]      # Monday first
+HOURS = {8: .04, 9: .06, 10: .08, 11: .10, 12: .12, 13: .10,
+         14: .07, 15: .07, 16: .09, 17: .12, 18: .09, 19: .06}   # share of a day's orders, shop open 8-20
+POPULARITY = 1.0          # Zipf exponent over flowers; peak days concentrate on a few
+
+# Orders: (value, weight)
+BASKET_SIZES = [(1, 45), (2, 25), (3, 15), (4, 8), (5, 5), (6, 2)]
+QUANTITIES = [(1, 50), (2, 20), (3, 10), (6, 8), (12, 10), (24, 2)]
+PENDING_SHARE = 0.4       # orders placed for later pickup
+PREORDER_SHARE = 0.5      # of a peak day's orders, placed up to a week ahead
+CANCEL_RATE = 0.05        # pending orders never picked up
+RETURN_RATE = 0.01        # completed orders taken back within three days
+
+RESTOCK_HOUR = 7
+RESTOCK_MARGIN = 1.1      # a day's restock covers its expected sales plus this
+REPORT_VIEWS = 4          # reports opened per day
+
+
+def peak_days(year):
+    """{date: (name, demand multiplier, popularity exponent)} for `year`"""
+    may_first = date(year, 5, 1)
+    mothers_day = may_first + timedelta(days=(6 - may_first.weekday()) % 7 + 7)   # second Sunday of May
+    valentines = date(year, 2, 14)
+    peaks = {}
+    for offset, multiplier in [(-2, 2), (-1, 4), (0, 8)]:
+        peaks[valentines + timedelta(days=offset)] = ("Valentine's Day", multiplier, 1.8)
+    for offset, multiplier in [(-2, 2), (-1, 4), (0, 6)]:
+        peaks[mothers_day + timedelta(days=offset)] = ("Mother's Day", multiplier, 1.5)
+    for day in range(20, 25):
+        peaks[date(year, 12, day)] = ("Christmas", 1.8, 1.2)
+    return peaks
+
+
+def _pick(rng, table):
+    return rng.choices([value for value, _ in table], [weight for _, weight in table])[0]
+
+
+def _open_at(at, rng):
+    """`at`, or a time during the next opening day if the shop is closed then"""
+    day, seconds = divmod(at, DAY)
+    if int(seconds // 3600) in HOURS:
+        return at
+    if seconds >= max(HOURS) * 3600:
+        day += 1
+    return day * DAY + _pick(rng, list(HOURS.items())) * 3600 + rng.uniform(0, 3600)
+
+
+def generate(start, days, seed=0, flowers=20, orders_per_day=ORDERS_PER_DAY):
+    """A trace of `days` of shop traffic from `start`: (header, events sorted by time).
+
+    Events refer to flowers by popularity rank and to customers by number,
+    so a trace replays against any seeded database. Times are seconds
+    since midnight of `start`.
+    """
+    rng = random.Random(seed)
+    peaks = {}
+    for year in range(start.year, (start + timedelta(days=days)).year + 1):
+        peaks.update(peak_days(year))
+    hours = list(HOURS.items())
+    events = []
+    restock = {}            # (day, flower rank) -> units sold that day
+    names = {}
+    order_number = 0
+
+    for day in range(days):
+        today = start + timedelta(days=day)
+        name, multiplier, exponent = peaks.get(today, (None, 1, POPULARITY))
+        if name:
+            names[day] = name
+        weights = [1 / (rank + 1) ** exponent for rank in range(flowers)]
+        count = round(orders_per_day * WEEKDAYS[today.weekday()] * multiplier * rng.uniform(0.85, 1.15))
+
+        for _ in range(count):
+            wanted = day * DAY + _pick(rng, hours) * 3600 + rng.uniform(0, 3600)
+            items = [
+                [rank, _pick(rng, QUANTITIES)]
+                for rank in rng.choices(range(flowers), weights, k=_pick(rng, BASKET_SIZES))
+            ]
+            if name and rng.random() < PREORDER_SHARE:
+                placed = _open_at(wanted - rng.uniform(1, 7) * DAY, rng)
+                status = 'pending'
+            else:
+                placed = wanted
+                status = 'pending' if rng.random() < PENDING_SHARE else 'completed'
+                if status == 'pending':
+                    wanted = _open_at(placed + rng.uniform(1, 30) * 3600, rng)
+            if placed < 0:
+                continue
+
+            order_number += 1
+            events.append({"at": round(placed, 1), "op": "order", "order": order_number,
+                           "customer": rng.randrange(10 ** 6), "items": items, "status": status})
+            if status == 'pending':
+                follow_up = 'cancel' if rng.random() < CANCEL_RATE else 'complete'
+                events.append({"at": round(wanted, 1), "op": follow_up, "order": order_number})
+            elif rng.random() < RETURN_RATE:
+                returned = _open_at(placed + rng.uniform(1, 3) * DAY, rng)
+                events.append({"at": round(returned, 1), "op": "cancel", "order": order_number})
+            for rank, quantity in items:
+                key = (int(placed // DAY), rank)
+                restock[key] = restock.get(key, 0) + quantity
+
+        for _ in range(REPORT_VIEWS):
+            events.append({"at": round(day * DAY + _pick(rng, hours) * 3600 + rng.uniform(0, 3600), 1),
+                           "op": "report", "report": rng.choice(sorted(reports.REPORTS))})
+
+    for (day, rank), units in restock.items():
+        events.append({"at": day * DAY + RESTOCK_HOUR * 3600, "op": "restock", "flower": rank,
+                       "units": math.ceil(units * RESTOCK_MARGIN)})
+
+    events = [event for event in events if event["at"] < days * DAY]
+    events.sort(key=lambda event: event["at"])
+    header = {"trace": TRACE_VERSION, "start": start.isoformat(), "days": days, "seed": seed,
+              "flowers": flowers, "orders": order_number, "peaks": names}
+    return header, events
+
+
+def write_trace(path, header, events):
+    """Write a trace as JSON lines: the header, then one event per line"""
+    with open(path, "w") as f:
+        for line in [header] + events:
+            f.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+
+def read_trace(path):
+    """(header, events) from a trace file"""
+    with open(path) as f:
+        header = json.loads(f.readline())
+        if header.get("trace") != TRACE_VERSION:
+            raise ValueError(f"{path} is not a version {TRACE_VERSION} trace")
+        return header, [json.loads(line) for line in f]
+
+
+# report event -> the call the Reports menu makes
+REPORT_CALLS = {
+    "sales_summary": reports.sales_summary,
+    "top_flowers": reports.top_flowers,
+    "top_customers": reports.top_customers,
+}
+
+
+def run_event(db, event, flower_ids, customer_ids, orders):
+    """Replay one event through the shop's own code; False if it was skipped"""
+    op = event["op"]
+    if op == "order":
+        items = {}
+        for rank, quantity in event["items"]:
+            flower_id = flower_ids[rank % len(flower_ids)]
+            items[flower_id] = items.get(flower_id, 0) + quantity
+        customer_id = customer_ids[event["customer"] % len(customer_ids)]
+        orders[event["order"]] = place_order(db, customer_id, list(items.items()), status=event["status"])[0]
+    elif op in ("complete", "cancel"):
+        order_id = orders.get(event["order"])
+        if order_id is None:
+            return False    # turned away, or placed before the replayed days
+        change_order_status(db, order_id, 'completed' if op == "complete" else 'cancelled')
+    elif op == "restock":
+        flower = get_flower(db, flower_ids[event["flower"] % len(flower_ids)])
+        record_movement(db, flower, event["units"], RESTOCK, note="workload replay")
+        db.commit()
+    elif op == "report":
+        REPORT_CALLS[event["report"]](db)
+    return True
+
+
+def replay(db, events, speed=0):
+    """Run `events` in order; returns ([(at, op, seconds, lag)], sold out, skipped).
+
+    With `speed` > 0 each event waits until its time, `speed` trace
+    seconds to a second, and `lag` is how late it started. With 0 the
+    events run back to back.
+    """
+    flower_ids = [f for f, in db.query(Flower.id).order_by(Flower.id)]
+    customer_ids = [c for c, in db.query(Customer.id).order_by(Customer.id)]
+    if not flower_ids or not customer_ids:
+        raise ValueError("seed the database before replaying a trace")
+    orders = {}
+    samples = []
+    sold_out = skipped = 0
+    origin = events[0]["at"] if events else 0
+    started = time.perf_counter()
+    for event in events:
+        lag = 0.0
+        if speed:
+            wait = started + (event["at"] - origin) / speed - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                lag = -wait
+        begun = time.perf_counter()
+        try:
+            ran = run_event(db, event, flower_ids, customer_ids, orders)
+        except InsufficientStock:
+            sold_out += 1
+            continue
+        if not ran:
+            skipped += 1
+            continue
+        samples.append((event["at"], event["op"], time.perf_counter() - begun, lag))
+    return samples, sold_out, skipped
+
+
+def _label(header, at):
+    moment = datetime.fromisoformat(header["start"]) + timedelta(seconds=at)
+    peak = header.get("peaks", {}).get(str(int(at // DAY)))
+    return moment.strftime("%a %Y-%m-%d %H:00") + (f"  {peak}" if peak else "")
+
+
+def _p95(samples, op):
+    return percentile([seconds for _, name, seconds, _ in samples if name == op], 95) * 1000
+
+
+def _ms(samples, op):
+    values = [seconds for _, name, seconds, _ in samples if name == op]
+    return f"{percentile(values, 95) * 1000:>9.1f}" if values else f"{'-':>9}"
+
+
+def print_replay_report(header, samples, sold_out, skipped, elapsed, slices=10, worst=5):
+    """Latency per operation, as the database grew, and in the slowest hours"""
+    ops = sorted({op for _, op, _, _ in samples})
+    print(f"Replayed {len(samples)} events in {elapsed:.1f}s ({len(samples) / max(elapsed, 1e-9):.0f} events/sec)")
+    print(f"Turned away for lack of stock: {sold_out}, follow-ups skipped: {skipped}")
+    lags = [lag for _, _, _, lag in samples]
+    if any(lags):
+        print(f"Behind schedule: p95 {percentile(lags, 95):.2f}s, max {max(lags):.2f}s")
+
+    print(f"\n{'Operation':<10} {'Count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for op in ops:
+        values = [seconds for _, name, seconds, _ in samples if name == op]
+        print(f"{op:<10} {len(values):>7} "
+              f"{percentile(values, 50) * 1000:>8.1f} {percentile(values, 95) * 1000:>8.1f} "
+              f"{percentile(values, 99) * 1000:>8.1f} {max(values) * 1000:>8.1f}")
+
+    peaks = header.get("peaks", {})
+    on_peak = [s for s in samples if str(int(s[0] // DAY)) in peaks]
+    off_peak = [s for s in samples if str(int(s[0] // DAY)) not in peaks]
+    if on_peak and off_peak:
+        print(f"\norder p95 on peak days {_p95(on_peak, 'order'):.1f}ms, other days {_p95(off_peak, 'order'):.1f}ms")
+
+    print("\nLatency as the database grew (p95 ms)")
+    print(f"{'Events':>13} " + " ".join(f"{op:>9}" for op in ops))
+    size = math.ceil(len(samples) / slices) or 1
+    for first in range(0, len(samples), size):
+        chunk = samples[first:first + size]
+        print(f"{first + 1:>6}-{first + len(chunk):<6} " + " ".join(_ms(chunk, op) for op in ops))
+
+    hours = {}
+    for sample in samples:
+        hours.setdefault(int(sample[0] // 3600), []).append(sample)
+    busy = [(hour, chunk) for hour, chunk in hours.items() if sum(1 for s in chunk if s[1] == "order") >= 5]
+    busy.sort(key=lambda item: _p95(item[1], "order"), reverse=True)
+    print("\nSlowest hours by order p95")
+    print(f"{'Hour':<40} {'Events':>7} {'p95 ms':>8} {'lag s':>7}")
+    for hour, chunk in busy[:worst]:
+        print(f"{_label(header, hour * 3600):<40} {len(chunk):>7} {_p95(chunk, 'order'):>8.1f} "
+              f"{max(s[3] for s in chunk):>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate and replay seasonal shop traffic")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    make = commands.add_parser('generate', help="write a trace file")
+    make.add_argument('trace', help="file to write, JSON lines")
+    make.add_argument('--start', type=date.fromisoformat, default=date(date.today().year, 1, 1),
+                      help="first day, YYYY-MM-DD (default: January 1st)")
+    make.add_argument('--days', type=int, default=365)
+    make.add_argument('--orders-per-day', type=int, default=ORDERS_PER_DAY, help="on an ordinary Thursday")
+    make.add_argument('--flowers', type=int, default=20, help="flower popularity ranks")
+    make.add_argument('--seed', type=int, default=0)
+
+    run = commands.add_parser('replay', help="replay a trace against MYSHOP_DATABASE_URL")
+    run.add_argument('trace')
+    run.add_argument('--speed', type=float, default=0,
+                     help="trace seconds per second, 1 for recorded speed (default: as fast as possible)")
+    run.add_argument('--from-day', type=int, default=0, help="first trace day to replay")
+    run.add_argument('--days', type=int, help="trace days to replay (default: all)")
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        header, events = generate(args.start, args.days, args.seed, args.flowers, args.orders_per_day)
+        write_trace(args.trace, header, events)
+        print(f"Wrote {len(events)} events ({header['orders']} orders) over {args.days} days to {args.trace}")
+        for day, name in sorted(header["peaks"].items(), key=lambda item: int(item[0])):
+            print(f"  {args.start + timedelta(days=int(day))}  {name}")
+        return
+
+    header, events = read_trace(args.trace)
+    last = args.from_day + args.days if args.days else header["days"]
+    events = [event for event in events if args.from_day * DAY <= event["at"] < last * DAY]
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        samples, sold_out, skipped = replay(db, events, args.speed)
+        print_replay_report(header, samples, sold_out, skipped, time.perf_counter() - started)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()